@@ -0,0 +1,150 @@
+import datetime
+import hashlib
+import os
+import threading
+from collections import Counter, namedtuple
+
+from cachetools import TTLCache
+
+from app import logger
+from util import get_redis_client
+
+# serialized /v2/<doi> responses, keyed by normalized doi.
+# the local cache is per process and can't be invalidated from elsewhere, so keep it short.
+# walden rows are written outside this repo, so nothing invalidates redis when they change either
+# and its TTL is the staleness bound too.
+LOCAL_CACHE_SIZE = int(os.getenv("DOI_RESPONSE_LOCAL_CACHE_SIZE", 50000))
+LOCAL_CACHE_TTL_SECONDS = 5 * 60
+REDIS_CACHE_TTL_SECONDS = int(os.getenv("DOI_RESPONSE_REDIS_CACHE_TTL_SECONDS", 5 * 60))
+REDIS_KEY_PREFIX = "v2-doi-response:"
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "last_modified"])
+
+_local_cache = TTLCache(maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL_SECONDS)
+_local_cache_lock = threading.Lock()
+_stats = Counter()
+
+
+def _redis_key(doi):
+    return f'{REDIS_KEY_PREFIX}{doi}'
+
+
+def make_cached_response(body, updated=None):
+    last_modified = None
+    if updated:
+        try:
+            last_modified = datetime.datetime.fromisoformat(updated)
+        except (TypeError, ValueError):
+            pass
+
+    return CachedResponse(
+        body=body,
+        etag=hashlib.sha1(body).hexdigest(),
+        last_modified=last_modified
+    )
+
+
+def _read_redis(doi):
+    redis_client = get_redis_client()
+    if not redis_client:
+        return None
+
+    try:
+        cached = redis_client.hgetall(_redis_key(doi))
+    except Exception as e:
+        logger.exception(f'error reading cached response for {doi}: {e}')
+        return None
+
+    if not cached or b'body' not in cached:
+        return None
+
+    last_modified = cached.get(b'last_modified')
+    return CachedResponse(
+        body=cached[b'body'],
+        etag=cached[b'etag'].decode('utf-8'),
+        last_modified=last_modified and datetime.datetime.fromisoformat(last_modified.decode('utf-8'))
+    )
+
+
+def _write_redis(doi, cached_response):
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+
+    mapping = {'body': cached_response.body, 'etag': cached_response.etag}
+    if cached_response.last_modified:
+        mapping['last_modified'] = cached_response.last_modified.isoformat()
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(_redis_key(doi))
+        pipe.hset(_redis_key(doi), mapping=mapping)
+        pipe.expire(_redis_key(doi), REDIS_CACHE_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.exception(f'error caching response for {doi}: {e}')
+
+
+def get_doi_response(doi, load_response):
+    """
+    Return the CachedResponse for doi, checking this process, then redis, then calling
+    load_response(doi), which should return a CachedResponse or None if there isn't one.
+
+    A response can be up to REDIS_CACHE_TTL_SECONDS + LOCAL_CACHE_TTL_SECONDS (10 minutes by
+    default) behind unpaywall_from_walden, unless invalidate_doi_responses is called.
+    """
+    with _local_cache_lock:
+        cached_response = _local_cache.get(doi)
+    if cached_response:
+        _stats['local_hit'] += 1
+        return cached_response
+
+    cached_response = _read_redis(doi)
+    if cached_response:
+        _stats['redis_hit'] += 1
+        with _local_cache_lock:
+            _local_cache[doi] = cached_response
+        return cached_response
+
+    _stats['miss'] += 1
+    cached_response = load_response(doi)
+    if cached_response:
+        with _local_cache_lock:
+            _local_cache[doi] = cached_response
+        _write_redis(doi, cached_response)
+
+    return cached_response
+
+
+def invalidate_doi_responses(dois):
+    """Call this when unpaywall_from_walden rows change. Other web processes drop theirs when the local TTL runs out."""
+    dois = [d for d in dois if d]
+
+    with _local_cache_lock:
+        for doi in dois:
+            _local_cache.pop(doi, None)
+
+    redis_client = get_redis_client()
+    if redis_client and dois:
+        try:
+            redis_client.delete(*[_redis_key(doi) for doi in dois])
+        except Exception as e:
+            logger.exception(f'error invalidating cached responses: {e}')
+
+    _stats['invalidated'] += len(dois)
+
+
+def cache_stats():
+    with _local_cache_lock:
+        return dict(_stats, local_size=len(_local_cache))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Drop cached /v2/<doi> responses.")
+    parser.add_argument('--doi', nargs="+", type=str, help="normalized dois to invalidate")
+    parsed_args = parser.parse_args()
+
+    invalidate_doi_responses(parsed_args.doi or [])
+    logger.info(f'invalidated {len(parsed_args.doi or [])} cached responses')
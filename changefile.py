@@ -1,8 +1,12 @@
 import json
+import os
+import threading
+import time
 
 import boto
 from botocore.exceptions import ClientError
 import boto3
+import redis
 from sqlalchemy import sql
 
 from app import db, logger
@@ -29,10 +33,73 @@ DAILY_FEED = {
 }
 
 
-def valid_changefile_api_keys():
-    return [r[0] for r in db.session.execute(
+# keys are checked on every keyed api request, so keep them in memory.
+# after the ttl the old set is served while a thread reloads it.
+CHANGEFILE_API_KEYS_TTL_SECONDS = 5 * 60
+# publish anything here after changing data_feed_api_keys to reload the keys in every process now
+CHANGEFILE_API_KEYS_CHANNEL = 'changefile-api-keys-changed'
+
+_changefile_api_keys = None
+_changefile_api_keys_loaded_at = None
+_changefile_api_keys_refreshing = False
+_changefile_api_keys_lock = threading.Lock()
+
+
+def _load_changefile_api_keys():
+    global _changefile_api_keys, _changefile_api_keys_loaded_at
+
+    rows = db.engine.execute(sql.text(
         "select api_key from data_feed_api_keys where not trial or now() between begins and ends + '7 days'::interval"
-    ).fetchall()]
+    )).fetchall()
+
+    _changefile_api_keys = frozenset(r[0] for r in rows)
+    _changefile_api_keys_loaded_at = time.time()
+
+
+def _refresh_changefile_api_keys():
+    global _changefile_api_keys_refreshing
+
+    try:
+        _load_changefile_api_keys()
+    except Exception as e:
+        logger.exception(f'failed reloading changefile api keys: {e}')
+    finally:
+        _changefile_api_keys_refreshing = False
+
+
+def _listen_for_changefile_api_key_changes():
+    try:
+        pubsub = redis.from_url(os.environ.get("REDIS_URL")).pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANGEFILE_API_KEYS_CHANNEL)
+        for message in pubsub.listen():
+            logger.info('changefile api keys changed, reloading')
+            _refresh_changefile_api_keys()
+    except Exception as e:
+        logger.exception(f'stopped listening for changefile api key changes: {e}')
+
+
+def valid_changefile_api_keys():
+    """A frozenset of the api keys that can use the data feed, cached in this process."""
+    global _changefile_api_keys_refreshing
+
+    if _changefile_api_keys is None:
+        with _changefile_api_keys_lock:
+            if _changefile_api_keys is None:
+                _load_changefile_api_keys()
+                if os.environ.get("REDIS_URL"):
+                    threading.Thread(target=_listen_for_changefile_api_key_changes, daemon=True).start()
+
+    elif time.time() - _changefile_api_keys_loaded_at > CHANGEFILE_API_KEYS_TTL_SECONDS:
+        with _changefile_api_keys_lock:
+            if not _changefile_api_keys_refreshing:
+                _changefile_api_keys_refreshing = True
+                threading.Thread(target=_refresh_changefile_api_keys, daemon=True).start()
+
+    return _changefile_api_keys
+
+
+def announce_changefile_api_keys_changed():
+    redis.from_url(os.environ.get("REDIS_URL")).publish(CHANGEFILE_API_KEYS_CHANNEL, 'changed')
 
 
 def get_file_from_bucket(filename, feed=WEEKLY_FEED):
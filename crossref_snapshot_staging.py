@@ -1,7 +1,14 @@
-import tarfile
+import argparse
+import csv
+import io
 import json
-import psycopg2
 import os
+import re
+import tarfile
+from collections import deque
+from multiprocessing import Pool
+
+import psycopg2
 
 
 """"
@@ -9,62 +16,118 @@ Use this script to stage the Crossref snapshot data in a PostgreSQL database. De
 
 1. Save the Crossref snapshot tar.gz file to an EC2 instance with:
     curl -H 'crossref-api-key: mykey' -H 'User-Agent: Downloader/1.1 (mailto:dev@ourresearch.org)' -v -L -o all.json.tar.gz -X GET https://api.crossref.org/snapshots/monthly/latest/all.json.tar.gz
-2. Create a temp table to hold the data:
+2. Create temp tables to hold the data and to record which tar members are done:
     CREATE TABLE IF NOT EXISTS temp_crossref_monthly_sync (
-        id TEXT PRIMARY KEY,
-        response_jsonb JSONB
+        id SERIAL PRIMARY KEY,
+        doi TEXT,
+        indexed TIMESTAMP WITHOUT TIME ZONE,
+        response_jsonb JSONB,
         processed BOOLEAN DEFAULT FALSE
     );
     CREATE INDEX idx_temp_crossref_monthly_sync_processed ON temp_crossref_monthly_sync(processed) WHERE processed = FALSE;
-3. Run this script to dump each JSON line into the temp table:
-    python crossref_snapshot_setup.py
+    CREATE TABLE IF NOT EXISTS temp_crossref_monthly_sync_member (
+        name TEXT PRIMARY KEY,
+        records INTEGER,
+        staged TIMESTAMP WITHOUT TIME ZONE DEFAULT now()
+    );
+3. Run this script to COPY each record into the temp table:
+    python crossref_snapshot_staging.py --file ~/crossref/all.json.tar.gz --workers 8
+   If it stops, run it again. Members already in temp_crossref_monthly_sync_member are skipped.
 """
 
+DEFAULT_WORKERS = 4
+
+_doi_pattern = re.compile(r'(10\.\d+/[^\s]+)')
+
+
+def normalize_doi(doi):
+    # same result as util.normalize_doi, which we can't import here without the app
+    matches = doi and _doi_pattern.findall(doi.strip().lower())
+    return matches[0].replace('\0', '') if matches else None
+
+
+def member_to_csv(member_name, member_content):
+    """Decode one tar member and return (member_name, record count, csv of doi, indexed, response_jsonb)."""
+    items = json.loads(member_content).get('items', [])
+
+    csv_buffer = io.StringIO()
+    csv_writer = csv.writer(csv_buffer)
+    for record in items:
+        csv_writer.writerow([
+            normalize_doi(record.get('DOI')),
+            record.get('indexed', {}).get('date-time'),
+            json.dumps(record, separators=(',', ':'))
+        ])
+
+    return member_name, len(items), csv_buffer.getvalue()
 
-def read_json_records_from_tar_gz_stream(file_path, batch_size=5000):
+
+def get_staged_members(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM temp_crossref_monthly_sync_member")
+        return set(row[0] for row in cursor.fetchall())
+
+
+def stage_member(conn, member_name, record_count, member_csv):
+    # rows and the member marker go in together, so a restart never stages a member twice
+    with conn.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY temp_crossref_monthly_sync (doi, indexed, response_jsonb) FROM STDIN WITH (FORMAT csv)",
+            io.StringIO(member_csv)
+        )
+        cursor.execute(
+            "INSERT INTO temp_crossref_monthly_sync_member (name, records) VALUES (%s, %s)",
+            (member_name, record_count)
+        )
+    conn.commit()
+    print(f"Staged {record_count} records from {member_name}")
+
+
+def read_unstaged_members(file_path, staged_members):
     with tarfile.open(file_path, mode='r|gz') as tar:
         for tarinfo in tar:
             if tarinfo.isfile() and tarinfo.name.endswith('.json'):
-                print(f"Processing {tarinfo.name}")
-                file_content = tar.extractfile(tarinfo).read()
-                json_content = json.loads(file_content)
-
-                items = json_content.get('items', [])
+                if tarinfo.name in staged_members:
+                    continue
 
-                for i in range(0, len(items), batch_size):
-                    yield items[i:i + batch_size]
+                yield tarinfo.name, tar.extractfile(tarinfo).read()
 
 
-def process_batch(batch, conn):
-    cursor = conn.cursor()
-    insert_sql = """
-        INSERT INTO temp_crossref_monthly_sync (response_jsonb)
-        VALUES %s
+def stage_snapshot(file_path, conn, workers=DEFAULT_WORKERS):
     """
+    Stream the snapshot, decode members in a process pool and COPY their rows in the order they were read.
+    Only a couple of members per worker are held in memory at once.
+    """
+    staged_members = get_staged_members(conn)
+    print(f"Skipping {len(staged_members)} members that are already staged")
 
-    # Prepare the batch data
-    batch_data = [(json.dumps(record),) for record in batch]
+    max_pending = workers * 2
+    pending = deque()
 
-    # Use psycopg2's `extras` to execute a batch insert
-    from psycopg2 import extras
-    extras.execute_values(cursor, insert_sql, batch_data)
+    with Pool(workers) as pool:
+        for member_name, member_content in read_unstaged_members(file_path, staged_members):
+            pending.append(pool.apply_async(member_to_csv, (member_name, member_content)))
 
-    conn.commit()
-    cursor.close()
+            while len(pending) >= max_pending:
+                stage_member(conn, *pending.popleft().get())
+
+        while pending:
+            stage_member(conn, *pending.popleft().get())
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Stage a Crossref snapshot in temp_crossref_monthly_sync.")
+    parser.add_argument('--file', type=str, default='~/crossref/august_2023.json.tar.gz', help="local snapshot tar.gz")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="processes to decode members with")
+    parsed_args = parser.parse_args()
+
     # Establish connection to PostgreSQL
     conn = psycopg2.connect(os.getenv('UNPAYWALL_DB'))
 
-    # Set the path to the local tar.gz file
-    local_path = os.path.expanduser('~/crossref/august_2023.json.tar.gz')
-
-    # Iterate over records in batches
-    for batch in read_json_records_from_tar_gz_stream(local_path):
-        process_batch(batch, conn)
-
-    conn.close()
+    try:
+        stage_snapshot(os.path.expanduser(parsed_args.file), conn, workers=parsed_args.workers)
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import argparse
 import datetime
 import os
 
@@ -23,6 +24,8 @@ class MonthlySync(db.Model):
     __tablename__ = 'temp_crossref_monthly_sync'
 
     id = db.Column(db.Integer, primary_key=True)
+    doi = db.Column(db.Text)
+    indexed = db.Column(db.DateTime)
     response_jsonb = db.Column(JSONB)
     processed = db.Column(db.Boolean, default=False)
 
@@ -137,5 +140,129 @@ def sync_crossref_snapshot():
         num_pubs_added_so_far, datetime.datetime.now().isoformat()[0:10]))
 
 
+SET_BASED_CHUNK_SIZE = 10000
+
+# Claims a chunk of staged rows and, for dois already in pub, applies the same rule as
+# needs_update: take the staged record if it was indexed more than 20 minutes after ours.
+# Updated dois are queued for recordthresher in the same statement. Only dois that aren't
+# in pub yet come back with their records, since their titles need build_new_pub.
+SET_BASED_SYNC_SQL = '''
+    with claimed as (
+        update temp_crossref_monthly_sync
+        set processed = true
+        where id in (
+            select id from temp_crossref_monthly_sync
+            where not processed
+            and doi is not null
+            and mod(abs(hashtext(doi)::bigint), :partitions) = :partition
+            limit :chunk_size
+            for update skip locked
+        )
+        returning id, doi, indexed, response_jsonb
+    ),
+    latest as (
+        select distinct on (doi) doi, indexed, response_jsonb
+        from claimed
+        order by doi, indexed desc nulls last, id desc
+    ),
+    updated as (
+        update pub
+        set crossref_api_raw_new = latest.response_jsonb
+        from latest
+        where pub.id = latest.doi
+        and (
+            (pub.crossref_api_raw_new->'indexed'->>'date-time') is null
+            or latest.indexed - (pub.crossref_api_raw_new->'indexed'->>'date-time')::timestamp without time zone
+                > interval '20 minutes'
+        )
+        returning pub.id, latest.indexed
+    ),
+    enqueued as (
+        insert into recordthresher.doi_record_queue (doi, updated) (
+            select id, indexed from updated
+        ) on conflict (doi) do update set updated = excluded.updated
+        returning doi
+    )
+    select
+        latest.doi,
+        case when pub.id is null then latest.response_jsonb end as response_jsonb,
+        (select count(*) from enqueued) as num_updated
+    from latest left join pub on pub.id = latest.doi
+'''
+
+
+def add_new_pubs_from_snapshot(new_records):
+    new_pubs = []
+    for doi, response_jsonb in new_records:
+        my_pub = build_new_pub(doi, response_jsonb)
+        # hack so it gets updated soon
+        my_pub.updated = datetime.datetime(1042, 1, 1)
+        new_pubs.append(my_pub)
+
+    if new_pubs:
+        db.session.add_all(new_pubs)
+        db.session.execute(
+            text(
+                '''
+                insert into recordthresher.doi_record_queue (doi, updated) (
+                    select id, (crossref_api_raw_new->'indexed'->>'date-time')::timestamp without time zone from pub
+                    where id = any (:dois)
+                ) ON CONFLICT (doi) DO UPDATE SET updated = excluded.updated
+                '''
+            ).bindparams(dois=[p.id for p in new_pubs])
+        )
+
+    return new_pubs
+
+
+def sync_crossref_snapshot_set_based(partitions=1, partition=0, chunk_size=SET_BASED_CHUNK_SIZE):
+    """
+    Sync staged rows in chunks of chunk_size, diffing against pub in SQL. With partitions > 1
+    this worker only takes dois whose hash falls in its partition, so workers never contend
+    for the same rows.
+    """
+    num_pubs_added_so_far = 0
+    num_pubs_updated_so_far = 0
+
+    while True:
+        logger.info("syncing a chunk of crossref snapshot rows in the db")
+        rows = db.session.execute(
+            text(SET_BASED_SYNC_SQL),
+            {'partitions': partitions, 'partition': partition, 'chunk_size': chunk_size}
+        ).fetchall()
+
+        if not rows:
+            db.session.commit()
+            break
+
+        new_records = [(row.doi, row.response_jsonb) for row in rows if row.response_jsonb is not None]
+        added_pubs = add_new_pubs_from_snapshot(new_records)
+
+        # claims, updates and new pubs stand or fall together
+        db.session.commit()
+        db.session.expunge_all()
+
+        logger.info(f"synced {len(rows)} dois: {rows[0].num_updated} updated, {len(added_pubs)} added")
+        num_pubs_added_so_far += len(added_pubs)
+        num_pubs_updated_so_far += rows[0].num_updated
+
+    logger.info("Added >>{}<< and updated >>{}<< crossref dois on {}".format(
+        num_pubs_added_so_far, num_pubs_updated_so_far, datetime.datetime.now().isoformat()[0:10]))
+
+
 if __name__ == "__main__":
-    sync_crossref_snapshot()
+    parser = argparse.ArgumentParser(description="Sync a staged Crossref snapshot into pub.")
+    parser.add_argument('--per-record', default=False, action='store_true', help="compare records one at a time in python")
+    parser.add_argument('--partitions', type=int, default=1, help="number of doi hash partitions across all workers")
+    parser.add_argument('--partition', type=int, default=0, help="the doi hash partition this worker takes, from 0")
+    parser.add_argument('--chunk-size', type=int, default=SET_BASED_CHUNK_SIZE, help="staged rows per transaction")
+    parsed_args = parser.parse_args()
+
+    if parsed_args.per_record:
+        sync_crossref_snapshot()
+    else:
+        sync_crossref_snapshot_set_based(
+            partitions=parsed_args.partitions,
+            partition=parsed_args.partition,
+            chunk_size=parsed_args.chunk_size
+        )
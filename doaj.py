@@ -1,44 +1,71 @@
+import time
+from collections import defaultdict
+
 from sqlalchemy import text
 
 from app import db
 
-_doaj_issns = []
-
-
-def doaj_issns():
-    global _doaj_issns
-    if not _doaj_issns:
-        # remove hyphens here so don't have to do it every time
-
-        doaj_issns_with_hyphens = db.engine.execute(
-            text("""
-                select issn, license, year from filtered_doaj_journals where issn is not null
-                union all
-                select e_issn as issn, license, year from filtered_doaj_journals where e_issn is not null
-            """)
-        ).fetchall()
-
-        for row in doaj_issns_with_hyphens:
-            (row_issn_with_hyphen, row_license, doaj_start_year) = row
-            row_issn_no_hypen = row_issn_with_hyphen.replace("-", "")
-            _doaj_issns.append([row_issn_no_hypen, row_license, doaj_start_year])
-    return _doaj_issns
-
-
-_doaj_titles = []
-
-
-def doaj_titles():
-    global _doaj_titles
-    if not _doaj_titles:
-        _doaj_titles = [
-            (title.encode("utf-8"), license, start_year) for (title, license, start_year) in
-            db.engine.execute(
-               text("""
-                    select title, license, year from filtered_doaj_journals where title is not null
-                    union all
-                    select alt_title as title, license, year from filtered_doaj_journals where alt_title is not null
-                """)
-            ).fetchall()
-        ]
-    return _doaj_titles
+# rebuild the lookups this often so long-running workers pick up doaj changes
+DOAJ_INDEX_TTL_SECONDS = 6 * 60 * 60
+
+_doaj_issn_index = {}
+_doaj_title_index = {}
+_doaj_index_loaded_at = None
+
+
+def normalize_doaj_issn(issn):
+    return issn.replace("-", "")
+
+
+def normalize_doaj_title(title):
+    # compare utf-8 bytes so only ascii letters are case-folded, like we always have
+    return title.encode("utf-8").strip().lower()
+
+
+def _load_doaj_indexes():
+    global _doaj_issn_index, _doaj_title_index, _doaj_index_loaded_at
+
+    # map each key to a list of (license, start year) in row order,
+    # so a journal listed more than once is checked the same way as before
+    issn_index = defaultdict(list)
+    issn_rows = db.engine.execute(
+        text("""
+            select issn, license, year from filtered_doaj_journals where issn is not null
+            union all
+            select e_issn as issn, license, year from filtered_doaj_journals where e_issn is not null
+        """)
+    ).fetchall()
+
+    for (row_issn_with_hyphen, row_license, doaj_start_year) in issn_rows:
+        issn_index[normalize_doaj_issn(row_issn_with_hyphen)].append((row_license, doaj_start_year))
+
+    title_index = defaultdict(list)
+    title_rows = db.engine.execute(
+        text("""
+            select title, license, year from filtered_doaj_journals where title is not null
+            union all
+            select alt_title as title, license, year from filtered_doaj_journals where alt_title is not null
+        """)
+    ).fetchall()
+
+    for (row_title, row_license, doaj_start_year) in title_rows:
+        title_index[normalize_doaj_title(row_title)].append((row_license, doaj_start_year))
+
+    _doaj_issn_index = dict(issn_index)
+    _doaj_title_index = dict(title_index)
+    _doaj_index_loaded_at = time.time()
+
+
+def _ensure_doaj_indexes():
+    if _doaj_index_loaded_at is None or time.time() - _doaj_index_loaded_at > DOAJ_INDEX_TTL_SECONDS:
+        _load_doaj_indexes()
+
+
+def doaj_issn_matches(issn):
+    _ensure_doaj_indexes()
+    return _doaj_issn_index.get(normalize_doaj_issn(issn), [])
+
+
+def doaj_title_matches(title):
+    _ensure_doaj_indexes()
+    return _doaj_title_index.get(normalize_doaj_title(title), [])
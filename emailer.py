@@ -43,7 +43,7 @@ def create_email(address, subject, template_name, context, attachment_filenames)
 
 def add_results_attachment(email, filename=None):
     my_attachment = Attachment()
-    attachment_type = filename.split(".")[1]
+    attachment_type = os.path.splitext(filename)[1].lstrip(".")
     if attachment_type == "csv":
         my_attachment.file_type = FileType("application/{}".format(attachment_type))
     else:
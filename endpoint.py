@@ -28,6 +28,9 @@ def lookup_endpoint_by_pmh_url(pmh_url_query=None):
     return endpoints
 
 
+BASE_RETRY_INTERVAL = datetime.timedelta(minutes=5)
+
+
 class Endpoint(db.Model):
     id = db.Column(db.Text, primary_key=True)
     id_old = db.Column(db.Text)
@@ -114,20 +117,23 @@ class Endpoint(db.Model):
         self.call_pmh_endpoint(first=first, last=last)
 
         # if success, update so we start at next point next time
-        base_retry_interval = datetime.timedelta(minutes=5)
         if self.error:
             logger.info("error so not saving finished info: {}".format(self.error))
-            retry_interval = self.retry_interval or base_retry_interval
-            self.retry_at = datetime.datetime.utcnow() + retry_interval
-            self.retry_interval = retry_interval * 2
-            self.last_harvest_started = None
+            self.schedule_retry()
         else:
             logger.info("success!  saving info")
             self.last_harvest_finished = datetime.datetime.utcnow().isoformat()
             self.most_recent_year_harvested = min(yesterday, last)
             self.last_harvest_started = None
             self.retry_at = None
-            self.retry_interval = base_retry_interval
+            self.retry_interval = BASE_RETRY_INTERVAL
+
+    def schedule_retry(self):
+        # back off, doubling the wait each time, and release the claim on this endpoint
+        retry_interval = self.retry_interval or BASE_RETRY_INTERVAL
+        self.retry_at = datetime.datetime.utcnow() + retry_interval
+        self.retry_interval = retry_interval * 2
+        self.last_harvest_started = None
 
     def get_pmh_record(self, record_id):
         my_sickle = _get_my_sickle(self.pmh_url)
@@ -252,14 +258,22 @@ class Endpoint(db.Model):
                           first=None,
                           last=None,
                           chunk_size=50,
-                          scrape=False):
-
+                          scrape=False,
+                          bulk_chunk_size=1000):
+        """
+        Harvest records and save them with their pages. Unless we're scraping as we go,
+        records are saved bulk_chunk_size at a time with pmh_record.save_pmh_records.
+        """
         start_time = time()
         records_to_save = []
         num_records_updated = 0
         loop_counter = 0
         self.error = None
 
+        bulk = not scrape
+        if bulk:
+            chunk_size = bulk_chunk_size
+
         (pmh_input_record, pmh_records, error) = self.get_pmh_input_record(first, last)
 
         if error:
@@ -277,16 +291,16 @@ class Endpoint(db.Model):
             my_pmh_record.populate(self.id, pmh_input_record, metadata_prefix=self.metadata_prefix)
 
             if is_complete(my_pmh_record):
-                my_pages = my_pmh_record.mint_pages(reset_scrape_date=True)
-                my_pmh_record.pages = my_pages
-                if scrape:
+                if not bulk:
+                    my_pages = my_pmh_record.mint_pages(reset_scrape_date=True)
+                    my_pmh_record.pages = my_pages
                     for my_page in my_pages:
                         my_page.scrape_if_matches_pub()
+                    my_pmh_record.delete_old_record()
+                    db.session.merge(my_pmh_record)
+                    db.session.flush()
+                    my_pmh_record.enqueue_representative_page()
                 records_to_save.append(my_pmh_record)
-                my_pmh_record.delete_old_record()
-                db.session.merge(my_pmh_record)
-                db.session.flush()
-                my_pmh_record.enqueue_representative_page()
             else:
                 logger.info("pmh record is not complete")
                 # print my_pmh_record
@@ -294,6 +308,8 @@ class Endpoint(db.Model):
 
             if len(records_to_save) >= chunk_size:
                 num_records_updated += len(records_to_save)
+                if bulk:
+                    pmh_record.save_pmh_records(records_to_save)
                 safe_commit(db)
                 records_to_save = []
 
@@ -308,6 +324,8 @@ class Endpoint(db.Model):
             last_record = records_to_save[-1]
             logger.info("saving {} last ones, last record saved: {} for {}, loop_counter={}".format(
                 len(records_to_save), last_record.id, self.id, loop_counter))
+            if bulk:
+                pmh_record.save_pmh_records(records_to_save)
             safe_commit(db)
         else:
             logger.info("finished loop, but no records to save, loop_counter={}".format(loop_counter))
@@ -1,20 +1,25 @@
 from base64 import b64decode
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from time import sleep
 from time import time
 from typing import Optional
-import json
+from urllib.parse import urlparse
 
 import certifi
 import requests
 import tenacity
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
 
 from app import logger
 from tenacity import retry, stop_after_attempt, wait_exponential, \
     retry_if_result
 import requests.exceptions
+from response_cache import FetchedResponse, cached_fetch
 from util import elapsed
 from zyte_session import get_matching_policies
 
@@ -192,30 +197,18 @@ def call_requests_get(url=None, headers=None, read_timeout=300, connect_timeout=
     # set URL in parameters
     zyte_params["url"] = url
 
-    # make the API call
-    zyte_api_response = call_with_zyte_api(url, zyte_params)
-    good_status_code = zyte_api_response.get('statusCode')
-    bad_status_code = zyte_api_response.get('status')
-
-    if good_status_code is not None and good_status_code < 400:
-        logger.info(f"zyte api good status code for {url}: {good_status_code}")
+    # make the API call, or use a cached response
+    fetched = cached_fetch(url, zyte_params, lambda: fetch_with_zyte_api(url, zyte_params))
 
-        headers = zyte_api_response.get('httpResponseHeaders', [])
-
-        content = None
-        if 'httpResponseBody' in zyte_api_response:
-            content = b64decode(zyte_api_response.get('httpResponseBody'))
-        elif 'browserHtml' in zyte_api_response:
-            content = zyte_api_response.get('browserHtml').encode()
-        else:
-            content = b''
+    if fetched.status_code is not None and fetched.status_code < 400:
+        logger.info(f"zyte api good status code for {url}: {fetched.status_code}")
 
         # create response object
         r = ResponseObject(
-            content=content,
-            headers=headers,
-            status_code=good_status_code,
-            url=zyte_api_response.get('url', url),
+            content=fetched.content,
+            headers=fetched.headers,
+            status_code=fetched.status_code,
+            url=fetched.url,
         )
 
         content_type = r.headers.get("Content-Type", "").lower()
@@ -258,13 +251,35 @@ def call_requests_get(url=None, headers=None, read_timeout=300, connect_timeout=
         r = ResponseObject(
             content='',
             headers=[],
-            status_code=bad_status_code,
+            status_code=fetched.status_code,
             url=url,
         )
-        logger.info(f"zyte api bad status code for {url}: {bad_status_code}")
+        logger.info(f"zyte api bad status code for {url}: {fetched.status_code}")
         return r
 
 
+def fetch_with_zyte_api(url, zyte_params):
+    zyte_api_response = call_with_zyte_api(url, zyte_params)
+    good_status_code = zyte_api_response.get('statusCode')
+
+    if good_status_code is not None and good_status_code < 400:
+        if 'httpResponseBody' in zyte_api_response:
+            content = b64decode(zyte_api_response.get('httpResponseBody'))
+        elif 'browserHtml' in zyte_api_response:
+            content = zyte_api_response.get('browserHtml').encode()
+        else:
+            content = b''
+
+        return FetchedResponse(
+            status_code=good_status_code,
+            url=zyte_api_response.get('url', url),
+            headers=zyte_api_response.get('httpResponseHeaders', []),
+            content=content
+        )
+
+    return FetchedResponse(status_code=zyte_api_response.get('status'), url=url, headers=[], content=b'')
+
+
 def http_get(url,
              headers=None,
              read_timeout=60,
@@ -308,79 +323,152 @@ def http_get(url,
     return r
 
 
-def call_with_zyte_api(url, params=None):
-    zyte_api_url = "https://api.zyte.com/v1/extract"
-    zyte_api_key = os.getenv("ZYTE_API_KEY")
-    default_params = {
-        "url": url,
-        "httpResponseHeaders": True,
-        "httpResponseBody": True,
-        "requestHeaders": {"referer": "https://www.google.com/"},
-    }
-    if not params:
-        params = default_params
-    params['url'] = url
-    os.environ["HTTP_PROXY"] = ''
-    os.environ["HTTPS_PROXY"] = ''
-
-    logger.info(f"calling zyte api for {url}")
-    if "wiley.com" in url:
+ZYTE_API_URL = "https://api.zyte.com/v1/extract"
+# connections kept open to the zyte api per process, and requests fetch_many has out at once
+ZYTE_POOL_SIZE = int(os.getenv("ZYTE_POOL_SIZE", 20))
+ZYTE_MAX_IN_FLIGHT = int(os.getenv("ZYTE_MAX_IN_FLIGHT", 10))
+# wiley hands out cookies that work for a while, so don't ask for new ones on every url
+WILEY_COOKIES_TTL_SECONDS = 10 * 60
+
+
+class ZyteClient(object):
+    """
+    Calls the Zyte extract API over one keep-alive connection pool.
+    Safe to share between threads; http_get uses the module-level one from zyte_client().
+    """
+    def __init__(self, api_key=None, pool_size=ZYTE_POOL_SIZE, max_in_flight=ZYTE_MAX_IN_FLIGHT):
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.auth = (api_key or os.getenv("ZYTE_API_KEY"), '')
+        self.session.verify = False
+        # we never want to go through the crawlera proxy to reach zyte
+        self.session.trust_env = False
+
+        self.max_in_flight = max_in_flight
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        self._wiley_cookies = TTLCache(maxsize=100, ttl=WILEY_COOKIES_TTL_SECONDS)
+        self._wiley_cookies_lock = threading.Lock()
+
+    def extract(self, params):
+        return self.session.post(ZYTE_API_URL, json=params).json()
+
+    def get_cookies(self, url):
+        cookies_response = self.extract({
+            "url": url,
+            "browserHtml": True,
+            "javascript": True,
+            "experimental": {
+                "responseCookies": True
+            }
+        })
+        return cookies_response.get("experimental", {}).get("responseCookies", {})
+
+    def _call_wiley(self, url):
+        host = urlparse(url).hostname
+        with self._wiley_cookies_lock:
+            cookies = self._wiley_cookies.get(host)
+
+        if cookies:
+            response = self._extract_with_cookies(url, cookies)
+            if (response.get('statusCode') or 400) < 400:
+                return response
+
+            # they expired early, start over
+            with self._wiley_cookies_lock:
+                self._wiley_cookies.pop(host, None)
+
         # get cookies
-        cookies_response = requests.post(zyte_api_url, auth=(zyte_api_key, ''),
-                                         json={
-                                             "url": url,
-                                             "browserHtml": True,
-                                             "javascript": True,
-                                             "experimental": {
-                                                 "responseCookies": True
-                                             }
-                                         }, verify=False)
-        cookies_response = json.loads(cookies_response.text)
-        cookies = cookies_response.get("experimental", {}).get(
-            "responseCookies", {})
+        cookies = self.get_cookies(url)
 
         # use cookies to get valid response
         if cookies:
-            response = requests.post(zyte_api_url, auth=(zyte_api_key, ''),
-                                     json={
-                                         "url": url,
-                                         "httpResponseHeaders": True,
-                                         "httpResponseBody": True,
-                                         "experimental": {
-                                             "requestCookies": cookies
-                                         }
-                                     }, verify=False)
-        else:
-            response = requests.post(zyte_api_url, auth=(zyte_api_key, ''),
-                                     json={
-                                         "url": url,
-                                         "httpResponseHeaders": True,
-                                         "httpResponseBody": True,
-                                         "requestHeaders": {
-                                             "referer": "https://www.google.com/"},
-                                     }, verify=False)
-    else:
-        response = requests.post(zyte_api_url, auth=(zyte_api_key, ''),
-                                 json=params, verify=False)
-    return response.json()
+            with self._wiley_cookies_lock:
+                self._wiley_cookies[host] = cookies
+            return self._extract_with_cookies(url, cookies)
+
+        return self.extract({
+            "url": url,
+            "httpResponseHeaders": True,
+            "httpResponseBody": True,
+            "requestHeaders": {
+                "referer": "https://www.google.com/"},
+        })
+
+    def _extract_with_cookies(self, url, cookies):
+        return self.extract({
+            "url": url,
+            "httpResponseHeaders": True,
+            "httpResponseBody": True,
+            "experimental": {
+                "requestCookies": cookies
+            }
+        })
+
+    def call(self, url, params=None):
+        default_params = {
+            "url": url,
+            "httpResponseHeaders": True,
+            "httpResponseBody": True,
+            "requestHeaders": {"referer": "https://www.google.com/"},
+        }
+        if not params:
+            params = default_params
+        params['url'] = url
+
+        logger.info(f"calling zyte api for {url}")
+        if "wiley.com" in url:
+            return self._call_wiley(url)
+
+        return self.extract(params)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+            return self._executor
+
+    def fetch_many(self, urls, **http_get_kwargs):
+        """
+        http_get each url, at most max_in_flight at once. Yields (url, response, error)
+        as each one finishes; error is the exception if http_get raised.
+        Zyte policies from get_matching_policies apply to each url as usual.
+        """
+        executor = self._get_executor()
+        futures = {executor.submit(http_get, url, **http_get_kwargs): url for url in urls}
+
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                yield url, future.result(), None
+            except Exception as e:
+                yield url, None, e
+
+
+_zyte_client = None
+_zyte_client_lock = threading.Lock()
+
+
+def zyte_client():
+    global _zyte_client
+
+    with _zyte_client_lock:
+        if _zyte_client is None:
+            _zyte_client = ZyteClient()
+        return _zyte_client
+
+
+def call_with_zyte_api(url, params=None):
+    return zyte_client().call(url, params)
 
 
 def get_cookies_with_zyte_api(url):
-    zyte_api_url = "https://api.zyte.com/v1/extract"
-    zyte_api_key = os.getenv("ZYTE_API_KEY")
-    cookies_response = requests.post(zyte_api_url, auth=(zyte_api_key, ''),
-                                     json={
-                                         "url": url,
-                                         "browserHtml": True,
-                                         "javascript": True,
-                                         "experimental": {
-                                             "responseCookies": True
-                                         }
-                                     })
-    cookies_response = json.loads(cookies_response.text)
-    cookies = cookies_response.get("experimental", {}).get("responseCookies",
-                                                           {})
-    return cookies
+    return zyte_client().get_cookies(url)
+
+
+def fetch_many(urls, **http_get_kwargs):
+    return zyte_client().fetch_many(urls, **http_get_kwargs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from app import db
+from app import logger
+
+# rebuild the map this often so long-running workers pick up new journals
+ISSN_L_MAP_TTL_SECONDS = 6 * 60 * 60
+
+IssnlMapping = namedtuple('IssnlMapping', ['issn_l', 'journal_id'])
+
+_issn_pattern = re.compile(r'^(\d{4})-(\d{3})([\dX])$')
+
+_issn_l_map = None
+_issn_l_map_loaded_at = None
+
+
+def _issn_code(issn):
+    # pack a well-formed issn into one int: 7 digits and a check digit where X is 10.
+    # anything else is matched exactly, like the primary key lookup this replaces.
+    match = issn and _issn_pattern.match(issn)
+    if not match:
+        return None
+
+    check_digit = match.group(3)
+    return int(match.group(1) + match.group(2)) * 11 + (10 if check_digit == 'X' else int(check_digit))
+
+
+class IssnlMap(object):
+    """
+    Every row of openalex_issn_to_issnl, kept as a sorted array of packed issns
+    and a parallel array of indexes into the distinct (issn_l, journal_id) pairs.
+    A few million issns fit in tens of MB this way instead of a dict of strings.
+    """
+    def __init__(self, rows):
+        mappings = {}
+        coded_rows = []
+        self.uncoded = {}
+
+        for issn, issn_l, journal_id in rows:
+            mapping = IssnlMapping(issn_l, journal_id)
+            mapping_index = mappings.setdefault(mapping, len(mappings))
+
+            code = _issn_code(issn)
+            if code is None:
+                self.uncoded[issn] = mapping_index
+            else:
+                coded_rows.append((code, mapping_index))
+
+        coded_rows.sort()
+        self.codes = array('q', (code for code, mapping_index in coded_rows))
+        self.mapping_indexes = array('l', (mapping_index for code, mapping_index in coded_rows))
+        self.mappings = list(mappings)
+
+    def __len__(self):
+        return len(self.codes) + len(self.uncoded)
+
+    def get(self, issn):
+        code = _issn_code(issn)
+
+        if code is None:
+            mapping_index = self.uncoded.get(issn)
+            return None if mapping_index is None else self.mappings[mapping_index]
+
+        i = bisect_left(self.codes, code)
+        if i < len(self.codes) and self.codes[i] == code:
+            return self.mappings[self.mapping_indexes[i]]
+
+        return None
+
+
+def _load_issn_l_map():
+    global _issn_l_map, _issn_l_map_loaded_at
+
+    start = time.time()
+    rows = db.engine.execute(
+        text('select issn, issn_l, journal_id from openalex_issn_to_issnl where issn is not null')
+    )
+    _issn_l_map = IssnlMap(rows)
+    _issn_l_map_loaded_at = time.time()
+
+    logger.info(f'loaded {len(_issn_l_map)} issn to issn_l mappings in {round(time.time() - start, 2)} seconds')
+
+
+def issn_l_mapping(issn):
+    """Return the IssnlMapping for issn, or None if it isn't in openalex_issn_to_issnl."""
+    if _issn_l_map_loaded_at is None or time.time() - _issn_l_map_loaded_at > ISSN_L_MAP_TTL_SECONDS:
+        _load_issn_l_map()
+
+    return _issn_l_map.get(issn)
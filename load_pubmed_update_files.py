@@ -1,31 +1,40 @@
+import argparse
 import csv
 import gzip
+import multiprocessing
+import os
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from ftplib import FTP
+from threading import BoundedSemaphore
 
 from lxml import etree
 from sqlalchemy import text
 
 from app import db, logger
 
+UPDATE_FILES_DIR = '/pubmed/updatefiles/'
+
+DEFAULT_DOWNLOAD_WORKERS = 2
+DEFAULT_PARSE_WORKERS = 4
+
 
 def retrieve_file(ftp_client, filename):
-    local_filename = tempfile.mkstemp()[1]
+    fd, local_filename = tempfile.mkstemp(suffix='.xml.gz')
 
-    with open(local_filename, 'wb') as f:
+    with os.fdopen(fd, 'wb') as f:
         ftp_client.retrbinary(f'RETR {filename}', f.write)
 
     logger.info(f'retrieved {filename} as {local_filename}')
     return local_filename
 
 
-def xml_gz_to_csv(xml_gz_filename):
+def write_pubmed_raw_csv(xml_gz_filename, csv_file):
     seen_pmids = set()
+    csv_writer = csv.writer(csv_file)
 
-    csv_filename = tempfile.mkstemp()[1]
-    with gzip.open(xml_gz_filename, "rb") as xml_file, open(csv_filename, 'wt') as csv_file:
-        csv_writer = csv.writer(csv_file)
-
+    with gzip.open(xml_gz_filename, "rb") as xml_file:
         for article_event, article_element in etree.iterparse(xml_file, tag="PubmedArticle", remove_blank_text=True):
             pmid_node = article_element.find('.//PubmedData/ArticleIdList/ArticleId[@IdType="pubmed"]')
             pmid = pmid_node.text if pmid_node is not None else None
@@ -58,11 +67,25 @@ def xml_gz_to_csv(xml_gz_filename):
             csv_writer.writerow([pmid, doi, pmcid, article_element_string])
             article_element.getparent().remove(article_element)
 
-    logger.info(f'converted {len(seen_pmids)} articles from {xml_gz_filename} to csv {csv_filename}')
+    return len(seen_pmids)
+
+
+def xml_gz_to_csv_file(xml_gz_filename):
+    # runs in a parser process. rows go straight to a temp file, so a whole file's csv
+    # is never held in memory or pickled back to the parent, just its name.
+    fd, csv_filename = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', newline='') as csv_file:
+            article_count = write_pubmed_raw_csv(xml_gz_filename, csv_file)
+    except Exception:
+        os.remove(csv_filename)
+        raise
+
+    logger.info(f'converted {article_count} articles from {xml_gz_filename} to {csv_filename}')
     return csv_filename
 
 
-def load_csv(csv_filename):
+def load_csv_file(csv_filename, replace=True):
     db.session.rollback()
 
     logger.info(f'loading csv rows to temp table')
@@ -70,12 +93,16 @@ def load_csv(csv_filename):
     db.session.execute(text('create temp table tmp_pubmed_raw (like recordthresher.pubmed_raw including all);'))
 
     cursor = db.session.connection().connection.cursor()
-    with open(csv_filename, 'rt') as f:
-        cursor.copy_expert("copy tmp_pubmed_raw (pmid, doi, pmcid, pubmed_article_xml) from stdin csv", f)
+    with open(csv_filename, newline='') as csv_file:
+        cursor.copy_expert("copy tmp_pubmed_raw (pmid, doi, pmcid, pubmed_article_xml) from stdin csv", csv_file)
 
-    logger.info(f'replacing rows in recordthresher.pubmed_raw')
-    db.session.execute(text('delete from recordthresher.pubmed_raw where pmid in (select pmid from tmp_pubmed_raw);'))
-    db.session.execute(text('insert into recordthresher.pubmed_raw (select * from tmp_pubmed_raw)'))
+    if replace:
+        logger.info(f'replacing rows in recordthresher.pubmed_raw')
+        db.session.execute(text('delete from recordthresher.pubmed_raw where pmid in (select pmid from tmp_pubmed_raw);'))
+        db.session.execute(text('insert into recordthresher.pubmed_raw (select * from tmp_pubmed_raw)'))
+    else:
+        logger.info(f'backfilling rows in recordthresher.pubmed_raw')
+        db.session.execute(text('insert into recordthresher.pubmed_raw (select * from tmp_pubmed_raw) on conflict do nothing'))
 
     db.session.commit()
 
@@ -100,39 +127,116 @@ def finish_ingest(remote_filename):
     )
 
 
-def new_ftp_client():
+def new_ftp_client(ftp_dir=UPDATE_FILES_DIR):
     ftp = FTP('ftp.ncbi.nlm.nih.gov')
     ftp.login()
-    ftp.cwd('/pubmed/updatefiles/')
+    ftp.cwd(ftp_dir)
     return ftp
 
 
-def run():
-    ftp = new_ftp_client()
+def pending_filenames(ftp_dir):
+    ftp = new_ftp_client(ftp_dir)
     remote_filenames = sorted([f for f in ftp.nlst() if f.endswith('.xml.gz')])
     ftp.quit()
 
-    finished_filenames = [
+    finished_filenames = set(
         x[0] for x in
         db.engine.execute("select filename from recordthresher.pubmed_update_ingest where finished is not null").all()
-    ]
+    )
 
     for remote_filename in remote_filenames:
         if remote_filename in finished_filenames:
             logger.info(f'skipping {remote_filename}')
-            continue
+        else:
+            yield remote_filename
+
 
-        if start_ingest(remote_filename):
-            logger.info(f'starting {remote_filename}')
-            ftp = new_ftp_client()
+def fetch_and_parse(remote_filename, ftp_dir, download_slots, parsers):
+    with download_slots:
+        ftp = new_ftp_client(ftp_dir)
+        try:
             local_filename = retrieve_file(ftp, remote_filename)
+        finally:
             ftp.quit()
-            csv_filename = xml_gz_to_csv(local_filename)
-            load_csv(csv_filename)
-            finish_ingest(remote_filename)
-        else:
-            logger.info(f'skipping {remote_filename}')
+
+    try:
+        return parsers.submit(xml_gz_to_csv_file, local_filename).result()
+    finally:
+        os.remove(local_filename)
+
+
+def run(
+    ftp_dir=UPDATE_FILES_DIR,
+    replace=True,
+    max_files=None,
+    download_workers=DEFAULT_DOWNLOAD_WORKERS,
+    parse_workers=DEFAULT_PARSE_WORKERS
+):
+    """
+    Download, parse and load pending files as a pipeline. Several files are downloaded
+    and parsed at once, but they're loaded one at a time in filename order so a later
+    update file always wins over an earlier one. At most download_workers + parse_workers
+    files are in flight, which bounds how much parsed csv is waiting on disk.
+    """
+    max_in_flight = download_workers + parse_workers
+    download_slots = BoundedSemaphore(download_workers)
+    claimed_count = 0
+    in_flight = deque()
+
+    remote_filenames = pending_filenames(ftp_dir)
+
+    # parsers are started from fetcher threads, and forking a multithreaded process isn't safe
+    parser_context = multiprocessing.get_context('spawn')
+
+    with ThreadPoolExecutor(max_in_flight) as fetchers, ProcessPoolExecutor(parse_workers, mp_context=parser_context) as parsers:
+        def claim_more():
+            nonlocal claimed_count
+
+            while len(in_flight) < max_in_flight and (max_files is None or claimed_count < max_files):
+                remote_filename = next(remote_filenames, None)
+                if remote_filename is None:
+                    return
+
+                if start_ingest(remote_filename):
+                    logger.info(f'starting {remote_filename}')
+                    in_flight.append((
+                        remote_filename,
+                        fetchers.submit(fetch_and_parse, remote_filename, ftp_dir, download_slots, parsers)
+                    ))
+                    claimed_count += 1
+                else:
+                    logger.info(f'skipping {remote_filename}')
+
+        try:
+            claim_more()
+            while in_flight:
+                remote_filename, csv_filename_future = in_flight.popleft()
+                csv_filename = csv_filename_future.result()
+                try:
+                    load_csv_file(csv_filename, replace=replace)
+                finally:
+                    os.remove(csv_filename)
+
+                finish_ingest(remote_filename)
+                logger.info(f'finished {remote_filename}')
+                claim_more()
+        finally:
+            # don't leave parsed files from an interrupted run behind
+            for remote_filename, csv_filename_future in in_flight:
+                csv_filename_future.cancel()
+                if not csv_filename_future.cancelled() and not csv_filename_future.exception():
+                    os.remove(csv_filename_future.result())
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Load new PubMed update files into recordthresher.pubmed_raw.")
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="files to download at once")
+    parser.add_argument('--parse-workers', type=int, default=DEFAULT_PARSE_WORKERS, help="processes to parse files with")
+    parser.add_argument('--max-files', type=int, default=None, help="stop after this many pending files")
+    parsed_args = parser.parse_args()
+
+    run(
+        max_files=parsed_args.max_files,
+        download_workers=parsed_args.download_workers,
+        parse_workers=parsed_args.parse_workers
+    )
@@ -13,7 +13,7 @@ from util import elapsed
 
 
 def test_changefile_listing_endpoint(feed):
-    api_key = random.choice(valid_changefile_api_keys())
+    api_key = random.choice(sorted(valid_changefile_api_keys()))
     url = 'https://api.unpaywall.org/feed/changefiles?api_key={}&interval={}'.format(api_key, feed['interval'])
     start = time()
     r = requests.get(url)
@@ -67,7 +67,7 @@ def _ensure_size_in_range(feed, filedata, min_lines, max_lines):
 
 
 def test_latest_changefile_size(feed, min_lines, max_lines):
-    api_key = random.choice(valid_changefile_api_keys())
+    api_key = random.choice(sorted(valid_changefile_api_keys()))
     url = 'https://api.unpaywall.org/feed/changefiles?api_key={}&interval={}'.format(api_key, feed['interval'])
     changefiles = requests.get(url).json()
 
@@ -77,7 +77,7 @@ def test_latest_changefile_size(feed, min_lines, max_lines):
 
 
 def test_latest_changefile_age(feed, age):
-    api_key = random.choice(valid_changefile_api_keys())
+    api_key = random.choice(sorted(valid_changefile_api_keys()))
     url = 'https://api.unpaywall.org/feed/changefiles?api_key={}&interval={}'.format(api_key, feed['interval'])
     changefiles = requests.get(url).json()
 
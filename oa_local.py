@@ -10,7 +10,7 @@ import urllib.request
 
 import requests
 
-from doaj import doaj_issns, doaj_titles
+from doaj import doaj_issn_matches, doaj_title_matches
 from app import logger
 from util import normalize_issn
 
@@ -96,17 +96,15 @@ def is_open_via_doaj(issns, all_journals, pub_year=None):
 def is_open_via_doaj_issn(issns, pub_year=None):
     if issns:
         for issn in issns:
-            issn_no_hypen = issn.replace("-", "")
-            for (row_issn_no_hyphen, row_license, doaj_start_year) in doaj_issns():
-                if issn_no_hypen == row_issn_no_hyphen:
-                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                        pass # journal wasn't open yet!
-                    else:
-                        # logger.info(u"open: doaj issn match!")
-                        if row_license == "Publisher's own license":
-                            return "publisher-specific-oa"
-
-                        return find_normalized_license(row_license)
+            for (row_license, doaj_start_year) in doaj_issn_matches(issn):
+                if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                    pass # journal wasn't open yet!
+                else:
+                    # logger.info(u"open: doaj issn match!")
+                    if row_license == "Publisher's own license":
+                        return "publisher-specific-oa"
+
+                    return find_normalized_license(row_license)
     return False
 
 # returns true if is in open list of issns, or doaj issns
@@ -147,22 +145,21 @@ def is_open_via_doaj_journal(all_journals, pub_year=None):
 
     for journal_name in all_journals:
         if journal_name:
-            journal_name_encoded = journal_name.encode('utf-8')
+            original_journal_name = journal_name
             # override journal names when what Crossref gives us back
             # doesn't match what DOAJ has
             journal_name = doaj_journal_name_substitutions().get(journal_name, journal_name)
 
             journals_to_skip = doaj_titles_to_skip()
             if journal_name not in journals_to_skip:
-                for (row_journal_name, row_license, doaj_start_year) in doaj_titles():
-                    if journal_name_encoded.strip().lower() == row_journal_name.strip().lower():
-                        if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                            pass # journal wasn't open yet!
-                        else:
-                            # logger.info(u"open: doaj journal name match! {}".format(journal_name))
-                            if row_license == "Publisher's own license":
-                                return "publisher-specific-oa"
-                            return find_normalized_license(row_license)
+                for (row_license, doaj_start_year) in doaj_title_matches(original_journal_name):
+                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                        pass # journal wasn't open yet!
+                    else:
+                        # logger.info(u"open: doaj journal name match! {}".format(journal_name))
+                        if row_license == "Publisher's own license":
+                            return "publisher-specific-oa"
+                        return find_normalized_license(row_license)
     return False
 
 def is_open_via_datacite_prefix(doi):
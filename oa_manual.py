@@ -3,7 +3,6 @@
 from collections import defaultdict
 
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy import func
 
 from app import db
 import oa_evidence
@@ -20,7 +19,7 @@ class OAManual(db.Model):
 
 def get_override_dict(pub):
     overrides_dict = get_overrides_dict()
-    db_overrides_dict = db.session.query(OAManual).filter(func.lower(OAManual.doi) == func.lower(pub.doi)).first()
+    db_overrides_dict = pub.lookup_oa_manual()
 
     if pub.doi in overrides_dict:
         return overrides_dict[pub.doi]
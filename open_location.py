@@ -54,18 +54,27 @@ def url_sort_score(url):
     return score
 
 
-def validate_pdf_urls(open_locations):
+def validate_pdf_urls(open_locations, prefetched_is_pdf=None):
+    # prefetched_is_pdf maps urls already looked up in bulk to pdf_url.is_pdf (None if no row)
+    prefetched_is_pdf = prefetched_is_pdf or {}
     unvalidated = [x for x in open_locations if x.pdf_url_valid is None]
 
     if unvalidated:
         bad_pdf_urls = {
-            x.url for x in
-            PdfUrl.query.filter(
-                PdfUrl.url.in_([x.pdf_url for x in unvalidated]),
-                PdfUrl.is_pdf.is_(False)
-            ).all()
+            x.pdf_url for x in unvalidated
+            if x.pdf_url in prefetched_is_pdf and prefetched_is_pdf[x.pdf_url] is False
         }
 
+        urls_to_query = [x.pdf_url for x in unvalidated if x.pdf_url not in prefetched_is_pdf]
+        if urls_to_query:
+            bad_pdf_urls |= {
+                x.url for x in
+                PdfUrl.query.filter(
+                    PdfUrl.url.in_(urls_to_query),
+                    PdfUrl.is_pdf.is_(False)
+                ).all()
+            }
+
         for location in unvalidated:
             location.pdf_url_valid = (
                 location.pdf_url not in bad_pdf_urls
@@ -3,7 +3,10 @@
 
 import datetime
 import html
+import io
+import json
 import re
+from collections import Counter, defaultdict
 
 from sqlalchemy import nullslast, or_, orm, text
 from sqlalchemy.dialects.postgresql import JSONB
@@ -22,6 +25,76 @@ DEBUG_BASE = False
 _too_common_normalized_titles = None
 
 
+# urls that we know are closed or otherwise not useful
+BLACKLIST_URL_SNIPPETS = [
+    "/10.1093/analys/",
+    "academic.oup.com/analysis",
+    "analysis.oxfordjournals.org/",
+    "ncbi.nlm.nih.gov/pubmed/",
+    "gateway.webofknowledge.com/",
+    "orcid.org/",
+    "researchgate.net/",
+    "academia.edu/",
+    "europepmc.org/abstract/",
+    "ftp://",
+    "api.crossref",
+    "api.elsevier",
+    "api.osf",
+    "eprints.soton.ac.uk/413275",
+    "eprints.qut.edu.au/91459/3/91460.pdf",
+    "hdl.handle.net/2117/168732",
+    "hdl.handle.net/10044/1/81238",  # wrong article
+    "journals.elsevier.com",
+    "https://hdl.handle.net/10037/19572",  # copyright violation. ticket 22259
+    "http://irep.iium.edu.my/58547/9/Antibiotic%20dosing%20during%20extracorporeal%20membrane%20oxygenation.pdf",
+    "oceanrep.geomar.de/52096/7/s41586-021-03496-1.pdf",
+    "eprints.lmu.edu.ng/3516/",
+    "springerlink.com/content/",
+]
+
+BLACKLIST_URL_PATTERNS = [
+    r'springer.com/.*/journal/\d+$',
+    r'springer.com/journal/\d+$',
+    r'supinfo\.pdf$',
+    r'\dfigures\.pdf$',
+    r'\dsupplemental\.pdf$',
+    r'Appendix[^/]*\.pdf$',
+    r'^https?://www\.icgip\.org/?$',
+    r'^https?://(www\.)?agu.org/journals/',
+    r'issue/current$',
+    r'/809AB601-EF05-4DD1-9741-E33D7847F8E5\.pdf$',
+    r'onlinelibrary\.wiley\.com/doi/',
+    r'https?://doi\.org/10\.1002/',  # wiley
+    r'https?://doi\.org/10\.1111/',  # wiley
+    r'https?://doi\.org/10\.1007/',  # springer
+    r'authors\.library\.caltech\.edu/93971/\d+/41562_2019_595_MOESM',
+    r'aeaweb\.org/.*\.ds$',
+    r'aeaweb\.org/.*\.data$',
+    r'aeaweb\.org/.*\.appx$',
+    r'https?://dspace\.stir\.ac\.uk/.*\.jpg$',
+    r'https?://dspace\.stir\.ac\.uk/.*\.tif$',
+    r'/table_final\.pdf$',
+    r'/supplemental_final\.pdf$',
+    r'psasir\.upm\.edu\.my/id/eprint/36880/1/Conceptualizing%20and%20measuring%20youth\.pdf',
+    r'psasir\.upm\.edu\.my/id/eprint/53326/1/Conceptualizing%20and%20measuring%20youth\.pdf',
+    r'^https?://(www\.)?tandfonline\.com/toc/',
+    r'\dSuppl\.pdf$',
+    r'^https://lirias\.kuleuven\.be/handle/\d+/\d+$',
+    r'^https?://eu\.wiley\.com/',
+    r'^https?://www\.wiley\.com/',
+    r'hull-repository\.worktribe\.com/(\w+/)?437540(/|$)',
+    r'researchonline\.jcu\.edu\.au/.*_cover.pdf',
+]
+
+# one alternation so each url is checked in a single pass
+_blacklist_url_regex = re.compile('|'.join(
+    '(?:{})'.format(pattern) for pattern in list(map(re.escape, BLACKLIST_URL_SNIPPETS)) + BLACKLIST_URL_PATTERNS
+))
+
+# only filtered out if there's more than one url
+_supplemental_url_regex = re.compile(r'Figures.pdf$')
+
+
 def too_common_normalized_titles():
     global _too_common_normalized_titles
     if _too_common_normalized_titles is None:
@@ -493,77 +566,10 @@ class PmhRecord(db.Model):
         if self.bare_pmh_id and self.bare_pmh_id.startswith('oai:pure.rug.nl:'):
             valid_urls = [url for url in valid_urls if 'rug.nl' in url]
 
-        # filter out some urls that we know are closed or otherwise not useful
-        blacklist_url_snippets = [
-            "/10.1093/analys/",
-            "academic.oup.com/analysis",
-            "analysis.oxfordjournals.org/",
-            "ncbi.nlm.nih.gov/pubmed/",
-            "gateway.webofknowledge.com/",
-            "orcid.org/",
-            "researchgate.net/",
-            "academia.edu/",
-            "europepmc.org/abstract/",
-            "ftp://",
-            "api.crossref",
-            "api.elsevier",
-            "api.osf",
-            "eprints.soton.ac.uk/413275",
-            "eprints.qut.edu.au/91459/3/91460.pdf",
-            "hdl.handle.net/2117/168732",
-            "hdl.handle.net/10044/1/81238",  # wrong article
-            "journals.elsevier.com",
-            "https://hdl.handle.net/10037/19572",  # copyright violation. ticket 22259
-            "http://irep.iium.edu.my/58547/9/Antibiotic%20dosing%20during%20extracorporeal%20membrane%20oxygenation.pdf",
-            "oceanrep.geomar.de/52096/7/s41586-021-03496-1.pdf",
-            "eprints.lmu.edu.ng/3516/",
-            "springerlink.com/content/",
-        ]
-
-        backlist_url_patterns = list(map(re.escape, blacklist_url_snippets)) + [
-            r'springer.com/.*/journal/\d+$',
-            r'springer.com/journal/\d+$',
-            r'supinfo\.pdf$',
-            r'\dfigures\.pdf$',
-            r'\dsupplemental\.pdf$',
-            r'Appendix[^/]*\.pdf$',
-            r'^https?://www\.icgip\.org/?$',
-            r'^https?://(www\.)?agu.org/journals/',
-            r'issue/current$',
-            r'/809AB601-EF05-4DD1-9741-E33D7847F8E5\.pdf$',
-            r'onlinelibrary\.wiley\.com/doi/',
-            r'https?://doi\.org/10\.1002/',  # wiley
-            r'https?://doi\.org/10\.1111/',  # wiley
-            r'https?://doi\.org/10\.1007/',  # springer
-            r'authors\.library\.caltech\.edu/93971/\d+/41562_2019_595_MOESM',
-            r'aeaweb\.org/.*\.ds$',
-            r'aeaweb\.org/.*\.data$',
-            r'aeaweb\.org/.*\.appx$',
-            r'https?://dspace\.stir\.ac\.uk/.*\.jpg$',
-            r'https?://dspace\.stir\.ac\.uk/.*\.tif$',
-            r'/table_final\.pdf$',
-            r'/supplemental_final\.pdf$',
-            r'psasir\.upm\.edu\.my/id/eprint/36880/1/Conceptualizing%20and%20measuring%20youth\.pdf',
-            r'psasir\.upm\.edu\.my/id/eprint/53326/1/Conceptualizing%20and%20measuring%20youth\.pdf',
-            r'^https?://(www\.)?tandfonline\.com/toc/',
-            r'\dSuppl\.pdf$',
-            r'^https://lirias\.kuleuven\.be/handle/\d+/\d+$',
-            r'^https?://eu\.wiley\.com/',
-            r'^https?://www\.wiley\.com/',
-            r'hull-repository\.worktribe\.com/(\w+/)?437540(/|$)',
-            r'researchonline\.jcu\.edu\.au/.*_cover.pdf',
-        ]
-
-        for url_snippet in backlist_url_patterns:
-            valid_urls = [url for url in valid_urls if not re.search(url_snippet, url)]
-
-        supplemental_url_patterns = [
-            r'Figures.pdf$',
-        ]
+        valid_urls = [url for url in valid_urls if not _blacklist_url_regex.search(url)]
 
         if len(valid_urls) > 1:
-            for url_pattern in supplemental_url_patterns:
-                valid_urls = [url for url in valid_urls if not re.search(url_pattern, url)]
+            valid_urls = [url for url in valid_urls if not _supplemental_url_regex.search(url)]
 
         # and then html unescape them, because some are html escaped
         valid_urls = [html.unescape(url) for url in valid_urls]
@@ -655,57 +661,69 @@ class PmhRecord(db.Model):
             PmhRecord.id == self.bare_pmh_id, PmhRecord.endpoint_id == self.endpoint_id
         ).delete()
 
-    def mint_pages(self, reset_scrape_date=False):
+    def urls_to_mint(self):
+        """The urls to mint pages for, or None if this record's pages shouldn't be touched at all."""
         if self.endpoint_id == 'ac9de7698155b820de7':
             # NIH PMC. Don't mint pages because we use a CSV dump to make OA locations. See Pub.ask_pmc
-            return []
+            return None
 
         if self.bare_pmh_id and self.bare_pmh_id.startswith('oai:openarchive.ki.se:'):
             # ticket 22247, only type=art can match DOIs
             if '<dc:type>art</dc:type>' not in self.api_raw:
-                return []
+                return None
 
-        self.pages = []
+        if re.compile(r'<dc:rights>Limited Access</dc:rights>', re.MULTILINE).findall(self.api_raw):
+            logger.info('found limited access label, not minting pages')
+            return []
 
         # this should have already been done when setting .urls, but do it again in case there were improvements
         # case in point:  new url patterns added to the blacklist
-        good_urls = self.get_good_urls(self.urls)
+        return self.get_good_urls(self.urls)
+
+    def allows_title_match(self, normalized_title, num_pages_with_this_normalized_title):
+        if (
+                num_pages_with_this_normalized_title >= 20
+                and normalized_title not in title_match_limit_exceptions()
+                and "oai:HAL:" not in self.bare_pmh_id
+        ):
+            logger.info(
+                "not allowing title matches because too many with this title: {}".format(
+                    normalized_title
+                )
+            )
+            return False
+        elif self.bare_pmh_id and self.bare_pmh_id.startswith("oai:mdpi.com:"):
+            # publisher site, don't match to other DOIs by title
+            return False
 
-        if re.compile(r'<dc:rights>Limited Access</dc:rights>', re.MULTILINE).findall(self.api_raw):
-            logger.info('found limited access label, not minting pages')
-        else:
-            for url in good_urls:
-                my_repo_page = self.mint_repo_page_for_url(url)
-
-                if self.doi:
-                    my_repo_page.match_doi = True
-
-                normalized_title = self.calc_normalized_title()
-                if normalized_title:
-                    num_pages_with_this_normalized_title = db.session.query(page.RepoPage.id).filter(
-                        page.RepoPage.match_title == True,
-                        page.RepoPage.normalized_title == normalized_title
-                    ).count()
-
-                    if (
-                            num_pages_with_this_normalized_title >= 20
-                            and normalized_title not in title_match_limit_exceptions()
-                            and "oai:HAL:" not in self.bare_pmh_id
-                    ):
-                        logger.info(
-                            "not allowing title matches because too many with this title: {}".format(
-                                normalized_title
-                            )
-                        )
-                    elif self.bare_pmh_id and self.bare_pmh_id.startswith("oai:mdpi.com:"):
-                        # publisher site, don't match to other DOIs by title
-                        pass
-                    else:
-                        my_repo_page.match_title = True
+        return True
+
+    def mint_pages(self, reset_scrape_date=False):
+        good_urls = self.urls_to_mint()
+        if good_urls is None:
+            return []
+
+        self.pages = []
+
+        for url in good_urls:
+            my_repo_page = self.mint_repo_page_for_url(url)
+
+            if self.doi:
+                my_repo_page.match_doi = True
+
+            normalized_title = self.calc_normalized_title()
+            if normalized_title:
+                num_pages_with_this_normalized_title = db.session.query(page.RepoPage.id).filter(
+                    page.RepoPage.match_title == True,
+                    page.RepoPage.normalized_title == normalized_title
+                ).count()
 
-                self.pages.append(my_repo_page)
+                if self.allows_title_match(normalized_title, num_pages_with_this_normalized_title):
+                    my_repo_page.match_title = True
 
-            # logger.info(u"minted pages: {}".format(self.pages))
+            self.pages.append(my_repo_page)
+
+        # logger.info(u"minted pages: {}".format(self.pages))
 
         # delete pages with this pmh_id that aren't being updated
         db.session.query(page.PageNew).filter(
@@ -746,3 +764,223 @@ class PmhRecord(db.Model):
         }
         return response
 
+
+
+# page_new columns written for pages minted by save_pmh_records, and the ones
+# an existing page gets updated, matching what merging a minted page changes
+_SAVED_PAGE_COLUMNS = [
+    'id', 'url', 'pmh_id', 'endpoint_id', 'repo_id', 'doi', 'title', 'normalized_title', 'authors',
+    'record_timestamp', 'scrape_updated', 'scrape_metadata_url', 'scrape_pdf_url', 'scrape_license',
+    'scrape_version', 'error', 'updated', 'rand', 'match_type', 'match_title', 'match_doi',
+]
+_UPDATED_PAGE_COLUMNS = [
+    'pmh_id', 'repo_id', 'doi', 'title', 'authors', 'record_timestamp', 'scrape_updated',
+    'scrape_metadata_url', 'scrape_pdf_url', 'scrape_license', 'scrape_version', 'match_title', 'match_doi',
+]
+_PAGE_SCRAPE_COLUMNS = ['scrape_updated', 'scrape_metadata_url', 'scrape_pdf_url', 'scrape_license', 'scrape_version']
+
+
+def _copy_value(value, is_json=False):
+    if value is None:
+        return '\\N'
+    if is_json:
+        value = json.dumps(value)
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _upsert_rows(table, columns, json_columns, rows, update_columns):
+    """COPY rows into a temp copy of table, then move them over with INSERT ... ON CONFLICT (id) DO UPDATE."""
+    tmp_table = f'tmp_{table}'
+    db.session.execute(text(f'drop table if exists {tmp_table}'))
+    db.session.execute(text(f'create temp table {tmp_table} (like {table} including defaults) on commit drop'))
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[c], c in json_columns) for c in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"copy {tmp_table} ({', '.join(columns)}) from stdin", buffer)
+
+    db.session.execute(text(
+        f"insert into {table} ({', '.join(columns)}) select {', '.join(columns)} from {tmp_table} "
+        f"on conflict (id) do update set {', '.join(f'{c} = excluded.{c}' for c in update_columns)}"
+    ))
+
+
+def save_pmh_records(pmh_records):
+    """
+    Mint pages for and save a batch of populated records from one endpoint, doing what
+    mint_pages(reset_scrape_date=True), delete_old_record, merge and enqueue_representative_page
+    do for each record, but with the same handful of queries however many records there are.
+    Doesn't commit.
+    """
+    # a record listed twice in one harvest window: the later one wins, like it would one at a time
+    records = list({r.id: r for r in pmh_records}.values())
+    if not records:
+        return []
+
+    endpoint_id = records[0].endpoint_id
+    repo_page_type = page.RepoPage.__mapper_args__["polymorphic_identity"]
+
+    urls_by_record_id = {r.id: r.urls_to_mint() for r in records}
+    normalized_titles = {r.id: r.calc_normalized_title() for r in records}
+    all_urls = list({url for urls in urls_by_record_id.values() if urls for url in urls})
+    all_titles = list({normalized_titles[r.id] for r in records if urls_by_record_id[r.id]} - {None})
+
+    # every page already at one of these urls, for reusing pages and carrying scrape results over
+    pages_by_url = defaultdict(list)
+    if all_urls:
+        for row in db.session.execute(
+            text('''
+                select id, url, normalized_title, match_type, match_title, match_doi,
+                    scrape_updated, scrape_metadata_url, scrape_pdf_url, scrape_license, scrape_version
+                from page_new
+                where endpoint_id = :endpoint_id and url = any(:urls)
+            '''),
+            {'endpoint_id': endpoint_id, 'urls': all_urls}
+        ):
+            pages_by_url[row.url].append(row)
+
+    title_match_counts = Counter()
+    if all_titles:
+        title_match_counts.update(dict(db.session.execute(
+            text('''
+                select normalized_title, count(*) from page_new
+                where match_type = :match_type and match_title and normalized_title = any(:titles)
+                group by normalized_title
+            '''),
+            {'match_type': repo_page_type, 'titles': all_titles}
+        ).fetchall()))
+
+    pages_by_key = {}
+    counted_page_ids = set()
+    stale_pmh_ids = set()
+
+    for r in records:
+        good_urls = urls_by_record_id[r.id]
+        normalized_title = normalized_titles[r.id]
+        r.pages = []
+
+        if good_urls is None:
+            # mint_pages leaves these alone, but the merge still drops the record's own pages
+            stale_pmh_ids.add(r.id)
+            continue
+
+        stale_pmh_ids.update([r.id, r.pmh_id])
+        newly_title_matched = []
+
+        for url in good_urls:
+            my_page = pages_by_key.get((normalized_title, url))
+
+            if not my_page:
+                my_page = page.RepoPage()
+                my_page.url = url
+                my_page.normalized_title = normalized_title
+                my_page.endpoint_id = endpoint_id
+
+                for row in pages_by_url[url]:
+                    if row.normalized_title == normalized_title and row.match_type == repo_page_type:
+                        my_page.id = row.id
+                        my_page.match_title = row.match_title
+                        my_page.match_doi = row.match_doi
+                        if row.match_title:
+                            counted_page_ids.add(row.id)
+                        break
+
+                pages_by_key[(normalized_title, url)] = my_page
+
+            # get the most recent scrape data
+            if pages_by_url[url]:
+                most_recent_old_page = max(
+                    pages_by_url[url],
+                    key=lambda row: (row.scrape_updated is not None, row.scrape_updated or datetime.datetime.min)
+                )
+                for column in _PAGE_SCRAPE_COLUMNS:
+                    setattr(my_page, column, getattr(most_recent_old_page, column))
+
+            my_page.doi = r.doi
+            my_page.title = r.title
+            my_page.authors = r.authors
+            my_page.record_timestamp = r.record_timestamp
+            my_page.pmh_id = r.id
+            my_page.repo_id = r.repo_id
+
+            if r.doi:
+                my_page.match_doi = True
+
+            if normalized_title and r.allows_title_match(normalized_title, title_match_counts[normalized_title]):
+                my_page.match_title = True
+                newly_title_matched.append(my_page)
+
+            r.pages.append(my_page)
+
+        # pages this record matched by title count against the next records with the same title
+        for my_page in newly_title_matched:
+            if my_page.id not in counted_page_ids:
+                counted_page_ids.add(my_page.id)
+                title_match_counts[normalized_title] += 1
+
+    pages = list({p.id: p for r in records for p in r.pages}.values())
+    page_ids = [p.id for p in pages]
+
+    record_columns = [c.name for c in PmhRecord.__table__.columns]
+    record_json_columns = {c.name for c in PmhRecord.__table__.columns if isinstance(c.type, JSONB)}
+    _upsert_rows(
+        PmhRecord.__tablename__,
+        record_columns,
+        record_json_columns,
+        [{c: getattr(r, c) for c in record_columns} for r in records],
+        [c for c in record_columns if c != 'id']
+    )
+
+    if pages:
+        _upsert_rows(
+            page.PageNew.__tablename__,
+            _SAVED_PAGE_COLUMNS,
+            {'authors'},
+            [{c: getattr(p, c) for c in _SAVED_PAGE_COLUMNS} for p in pages],
+            _UPDATED_PAGE_COLUMNS
+        )
+
+    # delete pages with these pmh_ids that aren't being updated
+    db.session.execute(
+        text('''
+            delete from page_new
+            where endpoint_id = :endpoint_id and pmh_id = any(:pmh_ids) and not id = any(:page_ids)
+        '''),
+        {'endpoint_id': endpoint_id, 'pmh_ids': list(stale_pmh_ids), 'page_ids': page_ids}
+    )
+
+    # old records used the bare record_id as pmh_record.id
+    db.session.execute(
+        text('delete from pmh_record where endpoint_id = :endpoint_id and id = any(:ids)'),
+        {'endpoint_id': endpoint_id, 'ids': list({r.bare_pmh_id for r in records})}
+    )
+
+    if page_ids:
+        # move already queued-pages at the front of the queue
+        # if the record was updated the oa status might have changed
+        db.session.execute(
+            text('update page_green_scrape_queue set finished = null where id = any(:ids) and started is null'),
+            {'ids': page_ids}
+        )
+
+    # if recordthresher is going to try to make a record based on a page, enqueue it now
+    representative_page_ids = list({rp.id for r in records if (rp := PmhRecordMaker.representative_page(r))})
+    if representative_page_ids:
+        db.session.execute(
+            text('''
+                insert into page_green_scrape_queue (id, endpoint_id)
+                select unnest(cast(:ids as text[])), :endpoint_id
+                on conflict (id) do update set endpoint_id = excluded.endpoint_id
+            '''),
+            {'ids': representative_page_ids, 'endpoint_id': endpoint_id}
+        )
+
+    logger.info(f'saved {len(records)} pmh records and {len(pages)} pages for {endpoint_id}')
+    return records
@@ -1,6 +1,5 @@
 import datetime
 import gzip
-import json
 import random
 import re
 import urllib.parse
@@ -9,17 +8,15 @@ from collections import OrderedDict
 from collections import defaultdict
 from enum import Enum
 from functools import cached_property
-from threading import Thread
+from threading import Lock, Thread
 
 import boto3
 import dateutil.parser
 import requests
 from dateutil.relativedelta import relativedelta
 from lxml import etree
-from psycopg2.errors import UniqueViolation
 from sqlalchemy import orm, sql, text, func
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.attributes import flag_modified
 
 import oa_evidence
@@ -33,6 +30,7 @@ from const import LANDING_PAGE_ARCHIVE_BUCKET, PDF_ARCHIVE_BUCKET, \
     LANDING_PAGE_ARCHIVE_BUCKET_NEW
 from convert_http_to_https import fix_url_scheme
 from http_cache import get_session_id
+from issn_l_map import issn_l_mapping
 from urllib.parse import quote
 from journal import Journal
 from oa_manual import OAManual
@@ -54,6 +52,7 @@ from s3_util import harvest_html_table
 from util import NoDoiException, enqueue_unpaywall_refresh, \
     save_landing_page_new
 from util import is_pmc, clamp, clean_doi, normalize_doi
+from util import json_equal_ignoring_keys
 from convert_http_to_https import fix_url_scheme
 from util import normalize
 from util import normalize_title
@@ -360,6 +359,84 @@ def build_crossref_record(data):
     return record
 
 
+def _squash_whitespace(record, field):
+    try:
+        return re.sub(r"\s+", " ", record[field])
+    except (KeyError, TypeError, AttributeError, IndexError):
+        return None
+
+
+def _crossref_date(data, field):
+    try:
+        if data and "date-parts" in data[field]:
+            date_parts = data[field]["date-parts"][0]
+            return get_citeproc_date(*date_parts)
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+class CrossrefView(object):
+    """
+    build_crossref_record and the fields Pub derives from it, for one
+    crossref_api_raw_new value. Each field is worked out on first use and kept,
+    so a recalculate parses the crossref record once instead of on every access.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    @cached_property
+    def record(self):
+        if self.data:
+            try:
+                return build_crossref_record(self.data)
+            except IndexError:
+                pass
+
+        return None
+
+    def get(self, field):
+        try:
+            return self.record[field]
+        except (KeyError, TypeError, AttributeError, IndexError):
+            return None
+
+    @cached_property
+    def publisher(self):
+        return _squash_whitespace(self.record, "publisher")
+
+    @cached_property
+    def title(self):
+        return _squash_whitespace(self.record, "title")
+
+    @cached_property
+    def journal(self):
+        return _squash_whitespace(self.record, "journal")
+
+    @cached_property
+    def genre(self):
+        return _squash_whitespace(self.record, "type")
+
+    @cached_property
+    def issued(self):
+        return _crossref_date(self.data, "issued")
+
+    @cached_property
+    def published(self):
+        return _crossref_date(self.data, "published")
+
+    @cached_property
+    def deposited(self):
+        return _crossref_date(self.data, "deposited")
+
+    @cached_property
+    def approved(self):
+        return _crossref_date(self.data, "approved")
+
+    @cached_property
+    def created(self):
+        return _crossref_date(self.data, "created")
+
+
 class PmcidPublishedVersionLookup(db.Model):
     pmcid = db.Column(db.Text, db.ForeignKey('pmcid_lookup.pmcid'),
                       primary_key=True)
@@ -451,6 +528,238 @@ class PubRefreshResult(db.Model):
         return f'<PubRefreshResult({self.id}, {self.refresh_time}, {self.oa_status_before}, {self.oa_status_after})>'
 
 
+_prefetched_pub_lookups = None
+
+
+class PrefetchedPubLookups(object):
+    """Rows that Pub.refresh/update would otherwise query one pub at a time,
+    loaded for a whole chunk with one query per table.
+
+    Use as a context manager around the chunk. Keys that were prefetched map to
+    the row (or None/[] if there wasn't one), anything else falls back to a normal query.
+    """
+
+    def __init__(self, pubs):
+        self.rows = defaultdict(dict)
+        pubs = [p for p in pubs if p is not None]
+        dois = list({p.id for p in pubs if p.id})
+
+        self.rows['s2'] = dict.fromkeys(dois)
+        for lookup in db.session.query(S2Lookup).filter(S2Lookup.doi.in_(dois)):
+            self.rows['s2'][lookup.doi] = lookup
+
+        issn_ls = list({p.issn_l for p in pubs if p.issn_l})
+
+        self.rows['journal'] = dict.fromkeys(issn_ls)
+        journals = db.session.query(Journal).options(
+            orm.defer('api_raw_crossref'), orm.defer('api_raw_issn')
+        ).filter(Journal.issn_l.in_(issn_ls))
+        for journal in journals:
+            self.rows['journal'][journal.issn_l] = journal
+
+        self.rows['journal_oa_start_year'] = dict.fromkeys(issn_ls)
+        for lookup in db.session.query(JournalOaStartYear).filter(JournalOaStartYear.issn_l.in_(issn_ls)):
+            self.rows['journal_oa_start_year'][lookup.issn_l] = lookup
+
+        lower_dois = list({doi.lower() for doi in dois})
+        self.rows['oa_manual'] = dict.fromkeys(lower_dois)
+        for override in db.session.query(OAManual).filter(func.lower(OAManual.doi).in_(lower_dois)):
+            if self.rows['oa_manual'].get(override.doi.lower()) is None:
+                self.rows['oa_manual'][override.doi.lower()] = override
+
+        self.rows['preprints_of'] = {doi: [] for doi in dois}
+        self.rows['postprints_of'] = {doi: [] for doi in dois}
+        relationships = db.session.query(FilteredPreprint).filter(
+            sql.or_(FilteredPreprint.postprint_id.in_(dois), FilteredPreprint.preprint_id.in_(dois))
+        )
+        for relationship in relationships:
+            if relationship.postprint_id in self.rows['preprints_of']:
+                self.rows['preprints_of'][relationship.postprint_id].append(relationship)
+            if relationship.preprint_id in self.rows['postprints_of']:
+                self.rows['postprints_of'][relationship.preprint_id].append(relationship)
+
+        candidate_pdf_urls = set()
+        for p in pubs:
+            candidate_pdf_urls.add(p.scrape_pdf_url)
+            for my_page in p.page_matches_by_doi + p.repo_page_matches_by_doi + p.repo_page_matches_by_title:
+                candidate_pdf_urls.add(my_page.scrape_pdf_url)
+        candidate_pdf_urls |= {lookup.s2_pdf_url for lookup in self.rows['s2'].values() if lookup}
+        candidate_pdf_urls = list(candidate_pdf_urls - {None})
+
+        self.pdf_url_is_pdf = dict.fromkeys(candidate_pdf_urls)
+        for pdf_url in db.session.query(PdfUrl).filter(PdfUrl.url.in_(candidate_pdf_urls)):
+            self.pdf_url_is_pdf[pdf_url.url] = pdf_url.is_pdf
+
+        logger.info(f'prefetched lookups for {len(pubs)} pubs')
+
+    def __enter__(self):
+        global _prefetched_pub_lookups
+        _prefetched_pub_lookups = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _prefetched_pub_lookups
+        _prefetched_pub_lookups = None
+
+
+def prefetched_lookup(table, key, load_one):
+    if _prefetched_pub_lookups is not None and key in _prefetched_pub_lookups.rows[table]:
+        return _prefetched_pub_lookups.rows[table][key]
+    return load_one()
+
+
+def prefetched_pdf_url_is_pdf():
+    if _prefetched_pub_lookups is not None:
+        return _prefetched_pub_lookups.pdf_url_is_pdf
+    return None
+
+
+def store_pdf_urls(conn, pdf_urls):
+    """pdf_urls is a list of (url, publisher). New rows go to pdf_url_check_queue via the pdf_url insert trigger."""
+    publishers_by_url = dict(pdf_urls)
+    if publishers_by_url:
+        conn.execute(
+            text("""
+                insert into pdf_url (url, publisher)
+                select * from unnest(cast(:urls as text[]), cast(:publishers as text[]))
+                on conflict (url) do update set publisher = excluded.publisher
+                where pdf_url.publisher is distinct from excluded.publisher
+            """),
+            {'urls': list(publishers_by_url.keys()), 'publishers': list(publishers_by_url.values())}
+        )
+
+
+def store_refresh_priorities(conn, priorities):
+    """priorities is a list of (id, priority) for rows in pub_refresh_queue."""
+    priorities_by_id = dict(priorities)
+    if priorities_by_id:
+        conn.execute(
+            text("""
+                update pub_refresh_queue q set priority = v.priority
+                from unnest(cast(:ids as text[]), cast(:priorities as float8[])) as v(id, priority)
+                where q.id = v.id
+            """),
+            {'ids': list(priorities_by_id.keys()), 'priorities': list(priorities_by_id.values())}
+        )
+
+
+def store_preprints(conn, relationships):
+    """relationships is a list of (preprint_id, postprint_id)."""
+    relationships = set(relationships)
+    if relationships:
+        conn.execute(
+            text("""
+                insert into preprint (preprint_id, postprint_id)
+                select * from unnest(cast(:preprint_ids as text[]), cast(:postprint_ids as text[]))
+                on conflict do nothing
+            """),
+            {
+                'preprint_ids': [r[0] for r in relationships],
+                'postprint_ids': [r[1] for r in relationships],
+            }
+        )
+
+
+def replace_retractions(conn, retraction_dois, retractions):
+    """Make (retraction_doi, retracted_doi) in retractions the only rows for each of retraction_dois."""
+    retraction_dois = list(set(retraction_dois))
+    retractions = set(retractions)
+    if not retraction_dois:
+        return
+
+    params = {
+        'retraction_dois': retraction_dois,
+        'retraction_ids': [r[0] for r in retractions],
+        'retracted_ids': [r[1] for r in retractions],
+    }
+
+    conn.execute(
+        text("""
+            delete from retraction r
+            where r.retraction_doi = any(cast(:retraction_dois as text[]))
+            and (r.retraction_doi, r.retracted_doi) not in (
+                select * from unnest(cast(:retraction_ids as text[]), cast(:retracted_ids as text[]))
+            )
+        """),
+        params
+    )
+
+    if retractions:
+        conn.execute(
+            text("""
+                insert into retraction (retraction_doi, retracted_doi)
+                select * from unnest(cast(:retraction_ids as text[]), cast(:retracted_ids as text[]))
+                on conflict do nothing
+            """),
+            params
+        )
+
+
+_batched_pub_writes = None
+
+
+class BatchedPubWrites(object):
+    """Rows that Pub.update/refresh would otherwise write one pub at a time
+    (pdf urls, refresh priorities, preprint relationships and retractions),
+    written for a whole chunk in one transaction when the block exits without an error.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.closed = False
+        self.pdf_urls = []
+        self.refresh_priorities = []
+        self.preprints = []
+        self.retraction_dois = []
+        self.retractions = []
+
+    def add(self, **rows):
+        # a pub abandoned by a timed out worker can still get here after the batch is written.
+        # refusing those rows sends them down the per-pub path instead of losing them.
+        with self.lock:
+            if self.closed:
+                logger.warning(f'batched pub writes already closed, writing {list(rows)} directly')
+                return False
+
+            for name, values in rows.items():
+                getattr(self, name).extend(values)
+
+            return True
+
+    def write(self):
+        with db.engine.begin() as conn:
+            store_pdf_urls(conn, self.pdf_urls)
+            store_refresh_priorities(conn, self.refresh_priorities)
+            store_preprints(conn, self.preprints)
+            replace_retractions(conn, self.retraction_dois, self.retractions)
+
+        logger.info(
+            f'wrote {len(self.pdf_urls)} pdf urls, {len(self.refresh_priorities)} refresh priorities, '
+            f'{len(self.preprints)} preprint relationships and {len(self.retractions)} retractions'
+        )
+
+    def __enter__(self):
+        global _batched_pub_writes
+        _batched_pub_writes = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _batched_pub_writes
+        _batched_pub_writes = None
+
+        with self.lock:
+            self.closed = True
+
+        if exc_type is None:
+            self.write()
+
+
+def add_batched_pub_writes(**rows):
+    """Add rows to the open BatchedPubWrites. False if there isn't one and the caller should write them itself."""
+    batched_pub_writes = _batched_pub_writes
+    return batched_pub_writes is not None and batched_pub_writes.add(**rows)
+
+
 class Pub(db.Model):
     id = db.Column(db.Text, primary_key=True)
     updated = db.Column(db.DateTime)
@@ -527,8 +836,6 @@ class Pub(db.Model):
         self.closed_urls = []
         self.session_id = None
         self.version = None
-        self.issn_l = None
-        self.openalex_journal_id = None
         # self.updated = datetime.datetime.utcnow()
         for (k, v) in biblio.items():
             self.__setattr__(k, v)
@@ -551,10 +858,41 @@ class Pub(db.Model):
         self.closed_urls = []
         self.session_id = None
         self.version = None
+        self.location_pipeline_runs = 0
+        self.clear_location_pipeline_cache()
+        self._crossref_view = None
+
+        # looked up on first use, most loaded pubs never need it
+        self._issn_l_resolved = False
+        self._issn_l = None
+        self._openalex_journal_id = None
+
+    def _resolve_issn_l(self):
+        if not self._issn_l_resolved:
+            mapping = self.lookup_issn_l()
+            self._issn_l = mapping.issn_l if mapping else None
+            self._openalex_journal_id = mapping.journal_id if mapping else None
+            self._issn_l_resolved = True
+
+    @property
+    def issn_l(self):
+        self._resolve_issn_l()
+        return self._issn_l
+
+    @issn_l.setter
+    def issn_l(self, issn_l):
+        self._resolve_issn_l()
+        self._issn_l = issn_l
+
+    @property
+    def openalex_journal_id(self):
+        self._resolve_issn_l()
+        return self._openalex_journal_id
 
-        issn_l_lookup = self.lookup_issn_l()
-        self.issn_l = issn_l_lookup.issn_l if issn_l_lookup else None
-        self.openalex_journal_id = issn_l_lookup.journal_id if issn_l_lookup else None
+    @openalex_journal_id.setter
+    def openalex_journal_id(self, openalex_journal_id):
+        self._resolve_issn_l()
+        self._openalex_journal_id = openalex_journal_id
 
     @property
     def doi(self):
@@ -581,23 +919,15 @@ class Pub(db.Model):
         return record
 
     @property
-    def crossref_api_modified(self):
-        record = None
-        if self.crossref_api_raw_new:
-            try:
-                return build_crossref_record(self.crossref_api_raw_new)
-            except IndexError:
-                pass
+    def crossref_view(self):
+        # rebuilt whenever crossref_api_raw_new is assigned or reloaded
+        if self._crossref_view is None or self._crossref_view.data is not self.crossref_api_raw_new:
+            self._crossref_view = CrossrefView(self.crossref_api_raw_new)
+        return self._crossref_view
 
-        if self.crossref_api_raw:
-            try:
-                record = build_crossref_record(self.crossref_api_raw)
-                print("got record")
-                return record
-            except IndexError:
-                pass
-
-        return record
+    @property
+    def crossref_api_modified(self):
+        return self.crossref_view.record
 
     @property
     def open_urls(self):
@@ -825,22 +1155,9 @@ class Pub(db.Model):
 
     @staticmethod
     def ignored_top_level_keys_for_external_diff():
-        # existing ignored key regex method doesn't work for multiline keys
-        # but don't want to replace it yet because it works on nested rows
+        # ignored only at the top of the response, not in nested locations
         return ["z_authors", "oa_locations_embargoed"]
 
-    @staticmethod
-    def remove_response_keys(jsonb_response, keys):
-        response_copy = json.loads(json.dumps(jsonb_response))
-
-        for key in keys:
-            try:
-                del response_copy[key]
-            except KeyError:
-                pass
-
-        return response_copy
-
     def has_changed(self, old_response_jsonb, ignored_keys,
                     ignored_top_level_keys):
         if not old_response_jsonb:
@@ -848,44 +1165,8 @@ class Pub(db.Model):
                 "response for {} has changed: no old response".format(self.id))
             return True
 
-        copy_of_new_response = Pub.remove_response_keys(self.response_jsonb,
-                                                        ignored_top_level_keys)
-        copy_of_old_response = Pub.remove_response_keys(old_response_jsonb,
-                                                        ignored_top_level_keys)
-
-        # have to sort to compare
-        copy_of_new_response_in_json = json.dumps(copy_of_new_response,
-                                                  sort_keys=True, indent=2)
-        # have to sort to compare
-        copy_of_old_response_in_json = json.dumps(copy_of_old_response,
-                                                  sort_keys=True, indent=2)
-
-        for key in ignored_keys:
-            # remove it
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*".+?",?\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*".+?",?\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-            # also remove it if it is an empty list
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*\[\],?\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*\[\],?\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-            # also anything till a comma (gets data_standard)
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*.+?,\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*.+?,\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-        return copy_of_new_response_in_json != copy_of_old_response_in_json
+        return not json_equal_ignoring_keys(self.response_jsonb, old_response_jsonb,
+                                            ignored_keys, ignored_top_level_keys)
 
     def update(self):
         return self.recalculate_and_store()
@@ -912,6 +1193,7 @@ class Pub(db.Model):
             pass
 
         self.set_results()
+        logger.debug(f'location pipeline ran {self.location_pipeline_runs} times for {self.id}')
         self.mint_pages()
         self.scrape_green_locations(GreenScrapeAction.queue)
         self.store_or_remove_pdf_urls_for_validation()
@@ -1027,8 +1309,10 @@ class Pub(db.Model):
             self.last_changed_date = datetime.datetime.utcnow()
 
     def ask_preprints(self):
-        preprint_relationships = FilteredPreprint.query.filter(
-            FilteredPreprint.postprint_id == self.doi).all()
+        preprint_relationships = prefetched_lookup(
+            'preprints_of', self.doi,
+            lambda: FilteredPreprint.query.filter(FilteredPreprint.postprint_id == self.doi).all()
+        )
         for preprint_relationship in preprint_relationships:
             preprint_pub = Pub.query.get(preprint_relationship.preprint_id)
             if preprint_pub:
@@ -1045,8 +1329,10 @@ class Pub(db.Model):
                     pass
 
     def ask_postprints(self):
-        preprint_relationships = FilteredPreprint.query.filter(
-            FilteredPreprint.preprint_id == self.doi).all()
+        preprint_relationships = prefetched_lookup(
+            'postprints_of', self.doi,
+            lambda: FilteredPreprint.query.filter(FilteredPreprint.preprint_id == self.doi).all()
+        )
         for preprint_relationship in preprint_relationships:
             postprint_pub = Pub.query.get(preprint_relationship.postprint_id)
             if postprint_pub:
@@ -1710,7 +1996,9 @@ class Pub(db.Model):
         return has_new_green_locations
 
     def ask_s2(self):
-        lookup = db.session.query(S2Lookup).get(self.doi)
+        lookup = prefetched_lookup(
+            's2', self.doi, lambda: db.session.query(S2Lookup).get(self.doi)
+        )
         if lookup:
             location = OpenLocation()
             location.endpoint_id = s2_endpoint_id
@@ -1888,10 +2176,7 @@ class Pub(db.Model):
 
     @property
     def publisher(self):
-        try:
-            return re.sub("\s+", " ", self.crossref_api_modified["publisher"])
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.publisher
 
     @property
     def volume(self):
@@ -1928,58 +2213,23 @@ class Pub(db.Model):
 
     @property
     def issued(self):
-        try:
-            if self.crossref_api_raw_new and "date-parts" in \
-                    self.crossref_api_raw_new["issued"]:
-                date_parts = self.crossref_api_raw_new["issued"]["date-parts"][
-                    0]
-                return get_citeproc_date(*date_parts)
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.issued
 
     @property
     def crossref_published(self):
-        try:
-            if self.crossref_api_raw_new and "date-parts" in \
-                    self.crossref_api_raw_new["published"]:
-                date_parts = \
-                    self.crossref_api_raw_new["published"]["date-parts"][0]
-                return get_citeproc_date(*date_parts)
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.published
 
     @property
     def deposited(self):
-        try:
-            if self.crossref_api_raw_new and "date-parts" in \
-                    self.crossref_api_raw_new["deposited"]:
-                date_parts = \
-                    self.crossref_api_raw_new["deposited"]["date-parts"][0]
-                return get_citeproc_date(*date_parts)
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.deposited
 
     @property
     def approved(self):
-        try:
-            if self.crossref_api_raw_new and "date-parts" in \
-                    self.crossref_api_raw_new["approved"]:
-                date_parts = \
-                    self.crossref_api_raw_new["approved"]["date-parts"][0]
-                return get_citeproc_date(*date_parts)
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.approved
 
     @property
     def created(self):
-        try:
-            if self.crossref_api_raw_new and "date-parts" in \
-                    self.crossref_api_raw_new["created"]:
-                date_parts = self.crossref_api_raw_new["created"]["date-parts"][
-                    0]
-                return get_citeproc_date(*date_parts)
-        except (KeyError, TypeError, AttributeError):
-            return None
+        return self.crossref_view.created
 
     @property
     def crossref_text_mining_pdf(self):
@@ -2118,17 +2368,11 @@ class Pub(db.Model):
 
     @property
     def authors(self):
-        try:
-            return self.crossref_api_modified["all_authors"]
-        except (AttributeError, TypeError, KeyError):
-            return None
+        return self.crossref_view.get("all_authors")
 
     @property
     def first_author_lastname(self):
-        try:
-            return self.crossref_api_modified["first_author_lastname"]
-        except (AttributeError, TypeError, KeyError):
-            return None
+        return self.crossref_view.get("first_author_lastname")
 
     @property
     def last_author_lastname(self):
@@ -2146,20 +2390,10 @@ class Pub(db.Model):
 
     @property
     def issns(self):
-        issns = []
-        try:
-            issns = self.crossref_api_modified["issn"]
-        except (AttributeError, TypeError, KeyError):
-            try:
-                issns = self.crossref_api_modified["issn"]
-            except (AttributeError, TypeError, KeyError):
-                if self.tdm_api:
-                    issns = re.findall("<issn media_type=.*>(.*)</issn>",
-                                       self.tdm_api)
-        if not issns:
-            return None
-        else:
-            return issns
+        issns = self.crossref_view.get("issn")
+        if issns is None and self.tdm_api:
+            issns = re.findall("<issn media_type=.*>(.*)</issn>", self.tdm_api)
+        return issns or None
 
     @property
     def best_title(self):
@@ -2169,38 +2403,23 @@ class Pub(db.Model):
 
     @property
     def crossref_title(self):
-        try:
-            return re.sub("\s+", " ", self.crossref_api_modified["title"])
-        except (AttributeError, TypeError, KeyError, IndexError):
-            return None
+        return self.crossref_view.title
 
     @property
     def year(self):
-        try:
-            return self.crossref_api_modified["year"]
-        except (AttributeError, TypeError, KeyError, IndexError):
-            return None
+        return self.crossref_view.get("year")
 
     @property
     def journal(self):
-        try:
-            return re.sub("\s+", " ", self.crossref_api_modified["journal"])
-        except (AttributeError, TypeError, KeyError, IndexError):
-            return None
+        return self.crossref_view.journal
 
     @property
     def all_journals(self):
-        try:
-            return self.crossref_api_modified["all_journals"]
-        except (AttributeError, TypeError, KeyError, IndexError):
-            return None
+        return self.crossref_view.get("all_journals")
 
     @property
     def genre(self):
-        try:
-            return re.sub("\s+", " ", self.crossref_api_modified["type"])
-        except (AttributeError, TypeError, KeyError):
-            return None
+        return self.crossref_view.genre
 
     @property
     def abstract_from_crossref(self):
@@ -2209,11 +2428,47 @@ class Pub(db.Model):
         except (AttributeError, TypeError, KeyError):
             return None
 
+    def clear_location_pipeline_cache(self):
+        self._location_pipeline_key = None
+        self._location_pipeline_result = None
+
+    def _current_location_pipeline_key(self):
+        # locations are only ever appended or the list replaced,
+        # so the identity of the list and its members tells us if anything changed
+        return id(self.open_locations), tuple(id(loc) for loc in self.open_locations)
+
+    def _location_pipeline(self):
+        key = self._current_location_pipeline_key()
+        if self._location_pipeline_result is None or key != self._location_pipeline_key:
+            self.location_pipeline_runs += 1
+
+            valid_locations = self.filtered_locations
+            sorted_locations = self._sort_locations(valid_locations)
+            if self._merge_publisher_pdf_urls(sorted_locations):
+                # moving a pdf url changes best_url and sort_score, so sort again
+                sorted_locations = self._sort_locations(valid_locations)
+            deduped_locations = self._dedupe_locations(sorted_locations)
+
+            self._location_pipeline_key = key
+            self._location_pipeline_result = (sorted_locations, deduped_locations)
+
+        return self._location_pipeline_result
+
     @property
     def deduped_sorted_locations(self):
-        locations = []
-        sorted_locations = self.sorted_locations
+        # callers are allowed to reorder what they get back, so hand out copies
+        return list(self._location_pipeline()[1])
+
+    @property
+    def filtered_locations(self):
+        return self._filter_locations(self.open_locations)
+
+    @property
+    def sorted_locations(self):
+        return list(self._location_pipeline()[0])
 
+    @staticmethod
+    def _merge_publisher_pdf_urls(sorted_locations):
         # transfer PDF URLs from bronze location to hybrid location
         # then best_url is the same, and they aren't duplicated
         # be very conservative - only merge if exactly one location with pdf and one without,
@@ -2235,22 +2490,26 @@ class Pub(db.Model):
             if publisher_no_pdf[0].metadata_url == publisher_pdf[
                 0].metadata_url:
                 publisher_no_pdf[0].pdf_url = publisher_pdf[0].pdf_url
+                return True
+
+        return False
 
+    @staticmethod
+    def _dedupe_locations(sorted_locations):
+        locations = []
+        urls_so_far = set()
         for next_location in sorted_locations:
-            urls_so_far = [location.best_url for location in locations]
             if next_location.best_url not in urls_so_far:
                 locations.append(next_location)
+                urls_so_far.add(next_location.best_url)
         return locations
 
-    @property
-    def filtered_locations(self):
-        locations = self.open_locations
-
+    def _filter_locations(self, locations):
         # now remove noncompliant ones
         compliant_locations = [location for location in locations if
                                not location.is_reported_noncompliant]
 
-        validate_pdf_urls(compliant_locations)
+        validate_pdf_urls(compliant_locations, prefetched_pdf_url_is_pdf())
         valid_locations = [
             x for x in compliant_locations
             if x.pdf_url_valid
@@ -2269,9 +2528,8 @@ class Pub(db.Model):
 
         return valid_locations
 
-    @property
-    def sorted_locations(self):
-        locations = self.filtered_locations
+    @staticmethod
+    def _sort_locations(locations):
         # first sort by best_url so ties are handled consistently
         locations = sorted(locations, key=lambda x: x.best_url, reverse=False)
         # now sort by what's actually better
@@ -2289,16 +2547,25 @@ class Pub(db.Model):
         for issn in self.issns or []:
             # use the first issn that matches an issn_l
             # can't really do anything if they would match different issn_ls
-            lookup = db.session.query(IssnlLookup).get(issn)
-            if lookup:
-                return lookup
+            mapping = issn_l_mapping(issn)
+            if mapping:
+                return mapping
 
         return None
 
     def lookup_journal(self):
-        return self.issn_l and db.session.query(Journal).options(
-            orm.defer('api_raw_crossref'), orm.defer('api_raw_issn')
-        ).get({'issn_l': self.issn_l})
+        return self.issn_l and prefetched_lookup(
+            'journal', self.issn_l,
+            lambda: db.session.query(Journal).options(
+                orm.defer('api_raw_crossref'), orm.defer('api_raw_issn')
+            ).get({'issn_l': self.issn_l})
+        )
+
+    def lookup_oa_manual(self):
+        return prefetched_lookup(
+            'oa_manual', self.doi and self.doi.lower(),
+            lambda: db.session.query(OAManual).filter(func.lower(OAManual.doi) == func.lower(self.doi)).first()
+        )
 
     def get_resolved_url(self):
         if hasattr(self, "my_resolved_url_cached"):
@@ -2580,17 +2847,19 @@ class Pub(db.Model):
         )
 
     def is_open_journal_via_observed_oa_rate(self):
-        lookup = self.issn_l and db.session.query(JournalOaStartYear).get(
-            {'issn_l': self.issn_l})
+        lookup = self.issn_l and prefetched_lookup(
+            'journal_oa_start_year', self.issn_l,
+            lambda: db.session.query(JournalOaStartYear).get({'issn_l': self.issn_l})
+        )
         return lookup and self.issued and self.issued.year >= lookup.oa_year
 
     def store_refresh_priority(self):
         logger.info(
             f"Setting refresh priority for {self.id} to {self.refresh_priority}")
-        stmt = sql.text(
-            'update pub_refresh_queue set priority = :priority where id = :id'
-        ).bindparams(priority=self.refresh_priority, id=self.id)
-        db.session.execute(stmt)
+        priorities = [(self.id, self.refresh_priority)]
+
+        if not add_batched_pub_writes(refresh_priorities=priorities):
+            store_refresh_priorities(db.session, priorities)
 
     def store_preprint_relationships(self):
         preprint_relationships = []
@@ -2604,8 +2873,7 @@ class Pub(db.Model):
             for postprint_doi in postprint_dois:
                 try:
                     normalized_postprint_doi = normalize_doi(postprint_doi)
-                    preprint_relationships.append({'preprint_id': self.doi,
-                                                   'postprint_id': normalized_postprint_doi})
+                    preprint_relationships.append((self.doi, normalized_postprint_doi))
                 except Exception:
                     pass
 
@@ -2616,14 +2884,12 @@ class Pub(db.Model):
             for preprint_doi in preprint_dois:
                 try:
                     normalized_preprint_doi = normalize_doi(preprint_doi)
-                    preprint_relationships.append(
-                        {'preprint_id': normalized_preprint_doi,
-                         'postprint_id': self.doi})
+                    preprint_relationships.append((normalized_preprint_doi, self.doi))
                 except Exception:
                     pass
 
-        for preprint_relationship in preprint_relationships:
-            db.session.merge(Preprint(**preprint_relationship))
+        if not add_batched_pub_writes(preprints=preprint_relationships):
+            store_preprints(db.session, preprint_relationships)
 
     def store_retractions(self):
         retracted_dois = set()
@@ -2635,14 +2901,10 @@ class Pub(db.Model):
                                                       return_none_if_error=True):
                         retracted_dois.add(retracted_doi)
 
-        db.session.query(Retraction).filter(
-            Retraction.retraction_doi == self.doi,
-            Retraction.retracted_doi.notin_(list(retracted_dois))
-        ).delete()
+        retractions = [(self.doi, retracted_doi) for retracted_doi in retracted_dois]
 
-        for retracted_doi in retracted_dois:
-            db.session.merge(Retraction(retraction_doi=self.doi,
-                                        retracted_doi=retracted_doi))
+        if not add_batched_pub_writes(retraction_dois=[self.doi], retractions=retractions):
+            replace_retractions(db.session, [self.doi], retractions)
 
     def store_or_remove_pdf_urls_for_validation(self):
         """Store PDF URLs for validation."""
@@ -2651,15 +2913,10 @@ class Pub(db.Model):
             if loc.pdf_url and not is_pmc(loc.pdf_url):
                 urls_to_add.add(loc.pdf_url)
 
-        for url in urls_to_add:
-            try:
-                db.session.merge(
-                    PdfUrl(url=url, publisher=self.publisher)
-                )
-                db.session.commit()
-            except (IntegrityError, UniqueViolation):
-                db.session.rollback()
-                logger.info(f"Integrity error for {url} in {self.id}")
+        pdf_urls = [(url, self.publisher) for url in urls_to_add]
+
+        if not add_batched_pub_writes(pdf_urls=pdf_urls):
+            store_pdf_urls(db.session, pdf_urls)
 
     def mint_pages(self):
         for p in oa_page.make_oa_pages(self):
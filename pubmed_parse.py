@@ -1,18 +1,22 @@
+import argparse
+import csv
+import io
 import logging
 import re
 import unicodedata
 from datetime import timedelta, datetime
+from multiprocessing import Pool
 
 from lxml import etree
 from lxml.etree import tostring
-from sqlalchemy import insert, inspect
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import text
 
 from app import db
 from recordthresher.pubmed import PubmedWork, PubmedReference, PubmedAuthor, \
     PubmedAffiliation, PubmedMesh
 
-COMMIT_CHUNK_SIZE = 100
+PARSE_CHUNK_SIZE = 1000
+COPY_NULL = '\\N'
 
 
 def make_logger():
@@ -66,13 +70,6 @@ def start_batch():
     return int(result[0])
 
 
-def get_raw_records(last_successful_batch_start):
-    query = 'SELECT * FROM recordthresher.pubmed_raw WHERE created > :last_successful'
-    return db.session.execute(query,
-                              {
-                                  'last_successful': last_successful_batch_start}).fetchall()
-
-
 def get_raw_record(pmid):
     query = 'SELECT * FROM recordthresher.pubmed_raw WHERE pmid = :pmid'
     return db.session.execute(query, {'pmid': pmid}).fetchone()
@@ -87,153 +84,212 @@ def make_tree(record: dict):
     return etree.fromstring(safe_article_xml(record['pubmed_article_xml']))
 
 
-def model_to_dict(model):
-    inspector = inspect(model.__class__)
-    d = {}
-    for col in inspector.columns:
-        d[col.name] = getattr(model, col.name)
-    return d
-
-
 def safe_get_first_xpath(tree: etree.Element, xpath, default=None):
     if result := tree.xpath(xpath):
         return result[0]
     return default
 
 
-def store_pubmed_work(record: dict, tree=None):
-    if tree is None:
-        tree = make_tree(record)
-    work = PubmedWork()
-    work.pubmed_article_xml = safe_article_xml(record['pubmed_article_xml'])
-    work.issn = safe_get_first_xpath(tree, '//ISSNLinking/text()')
-    work.article_title = safe_get_first_xpath(tree, '//ArticleTitle/text()')
-    work.year = safe_get_first_xpath(tree, '//PubDate/Year/text()')
-    abstract_texts = tree.xpath('//Abstract/AbstractText')
-    work.abstract = '\n'.join(''.join(tag.itertext()) for tag in abstract_texts) if abstract_texts else None
-    work.created = datetime.now()
-    work.doi = record['doi']
-    work.pmid = record['pmid']
-    work.pmcid = record['pmcid']
-    db.session.add(work)
-
-
-def store_pubmed_works(records: list):
-    for i, record in enumerate(records):
-        store_pubmed_work(record)
-        if i % COMMIT_CHUNK_SIZE == 0:
-            db.session.commit()
-            LOGGER.info(f'Stored {i + 1}/{len(records)} works')
+def _first(results, default=None):
+    return results[0] if results else default
+
+
+# compiled once and evaluated relative to the <PubmedArticle> root of each record
+_issn_linking_xpath = etree.XPath('.//ISSNLinking/text()')
+_article_title_xpath = etree.XPath('.//ArticleTitle/text()')
+_pub_date_year_xpath = etree.XPath('.//PubDate/Year/text()')
+_abstract_text_xpath = etree.XPath('.//Abstract/AbstractText')
+_article_id_xpath = etree.XPath('.//ArticleId/text()')
+_reference_xpath = etree.XPath('.//ReferenceList/Reference')
+_citation_xpath = etree.XPath('./Citation/text()')
+_author_xpath = etree.XPath('.//AuthorList/Author')
+_last_name_xpath = etree.XPath('./LastName/text()')
+_fore_name_xpath = etree.XPath('./ForeName/text()')
+_initials_xpath = etree.XPath('./Initials/text()')
+_orcid_xpath = etree.XPath('./Identifier[@Source="ORCID"]/text()')
+_affiliation_xpath = etree.XPath('./AffiliationInfo/Affiliation')
+_mesh_heading_xpath = etree.XPath('.//MeshHeadingList/MeshHeading')
+_qualifier_ui_xpath = etree.XPath('./QualifierName/@UI')
+_qualifier_name_xpath = etree.XPath('./QualifierName/text()')
+_descriptor_ui_xpath = etree.XPath('./DescriptorName/@UI')
+_descriptor_name_xpath = etree.XPath('./DescriptorName/text()')
+_qualifier_major_topic_xpath = etree.XPath('./QualifierName/@MajorTopicYN')
+
+# staging table columns, in the order parse_raw_record returns them
+STAGED_COLUMNS = {
+    PubmedWork: ['pmid', 'created', 'doi', 'pmcid', 'year', 'issn', 'article_title', 'abstract', 'pubmed_article_xml'],
+    PubmedReference: ['pmid', 'reference_number', 'created', 'doi', 'reference', 'pmid_referenced', 'citation'],
+    PubmedAuthor: ['pmid', 'author_order', 'doi', 'created', 'family', 'given', 'initials', 'orcid'],
+    PubmedAffiliation: ['pmid', 'author_order', 'affiliation_number', 'created', 'author_string', 'affiliation'],
+    PubmedMesh: ['pmid', 'descriptor_ui', 'descriptor_name', 'qualifier_ui', 'qualifier_name', 'is_major_topic', 'created'],
+}
+
+
+def parse_raw_record(record: dict):
+    """Parse one pubmed_raw row once and return {model: [row tuple, ...]} for every table we fill from it."""
+    article_xml = safe_article_xml(record['pubmed_article_xml'])
+    tree = etree.fromstring(article_xml)
+    created = datetime.now()
+    pmid, doi = record['pmid'], record['doi']
+
+    abstract_texts = _abstract_text_xpath(tree)
+    works = [(
+        pmid,
+        created,
+        doi,
+        record['pmcid'],
+        _first(_pub_date_year_xpath(tree)),
+        _first(_issn_linking_xpath(tree)),
+        _first(_article_title_xpath(tree)),
+        '\n'.join(''.join(tag.itertext()) for tag in abstract_texts) if abstract_texts else None,
+        article_xml,
+    )]
+
+    # every reference gets the article's first ArticleId, as it always has
+    first_article_id = _first(_article_id_xpath(tree))
+    references = [
+        (
+            pmid,
+            int(raw_ref.attrib.get('RecordthresherReferenceNo', 1)),
+            created,
+            doi,
+            tostring(raw_ref).decode(),
+            first_article_id,
+            _first(_citation_xpath(raw_ref)),
+        )
+        for raw_ref in _reference_xpath(tree)
+    ]
+
+    authors = []
+    affiliations = []
+    for raw_author in _author_xpath(tree):
+        author_order = int(raw_author.attrib.get('RecordthresherAuthorNo', 1))
+        authors.append((
+            pmid,
+            author_order,
+            doi,
+            created,
+            _first(_last_name_xpath(raw_author)),
+            _first(_fore_name_xpath(raw_author)),
+            _first(_initials_xpath(raw_author)),
+            _first(_orcid_xpath(raw_author)),
+        ))
+
+        raw_affiliations = _affiliation_xpath(raw_author)
+        author_string = tostring(raw_author).decode() if raw_affiliations else None
+        for raw_aff in raw_affiliations:
+            affiliations.append((
+                pmid,
+                author_order,
+                int(raw_aff.attrib.get('RecordthresherAuthorAffiliationNo', 1)),
+                created,
+                author_string,
+                raw_aff.text,
+            ))
+
+    meshes = [
+        (
+            pmid,
+            _first(_descriptor_ui_xpath(raw_mesh)),
+            _first(_descriptor_name_xpath(raw_mesh)),
+            _first(_qualifier_ui_xpath(raw_mesh)),
+            _first(_qualifier_name_xpath(raw_mesh)),
+            _first(_qualifier_major_topic_xpath(raw_mesh)) == 'Y',
+            created,
+        )
+        for raw_mesh in _mesh_heading_xpath(tree)
+    ]
+
+    return {
+        PubmedWork: works,
+        PubmedReference: references,
+        PubmedAuthor: authors,
+        PubmedAffiliation: affiliations,
+        PubmedMesh: meshes,
+    }
+
+
+def staging_table_name(model):
+    return f'tmp_{model.__tablename__}'
+
+
+def create_staging_tables(conn):
+    for model in STAGED_COLUMNS:
+        conn.execute(text(f'drop table if exists {staging_table_name(model)}'))
+        # no constraints, duplicates are dropped when the rows are moved over
+        conn.execute(text(
+            f'create temp table {staging_table_name(model)} (like {model.__table__.fullname} including defaults)'
+        ))
+
+
+def copy_to_staging_tables(conn, parsed_records):
+    cursor = conn.connection.cursor()
+
+    for model, columns in STAGED_COLUMNS.items():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for parsed_record in parsed_records:
+            for row in parsed_record[model]:
+                writer.writerow([COPY_NULL if value is None else value for value in row])
+
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"copy {staging_table_name(model)} ({', '.join(columns)}) from stdin with (format csv, null '{COPY_NULL}')",
+            buffer
+        )
+
+
+def move_staged_rows(conn, last_successful_batch):
+    for model, columns in STAGED_COLUMNS.items():
+        pre_delete(model.__tablename__, last_successful_batch, conn)
+        conn.execute(text(
+            f"insert into {model.__table__.fullname} ({', '.join(columns)}) "
+            f"select {', '.join(columns)} from {staging_table_name(model)} on conflict do nothing"
+        ))
+        LOGGER.info(f'Stored staged {model.__tablename__} rows')
+
+
+def store_raw_records(last_successful_batch, workers=1):
+    """
+    Stream pubmed_raw rows since the last batch with a server-side cursor, parse each
+    article once (in a process pool if workers > 1) and COPY the extracted rows into
+    staging tables, then replace the rows for these pmids in one transaction.
+    """
+    # temp tables belong to one connection, so do everything on this one
+    conn = db.session.connection()
+    create_staging_tables(conn)
+
+    pool = Pool(workers) if workers > 1 else None
+    parse = pool.imap if pool else map
+    stored = 0
+
+    try:
+        with db.engine.connect().execution_options(stream_results=True) as stream_conn:
+            result = stream_conn.execute(
+                text('SELECT * FROM recordthresher.pubmed_raw WHERE created > :last_successful'),
+                {'last_successful': last_successful_batch}
+            )
+
+            for rows in result.partitions(PARSE_CHUNK_SIZE):
+                parsed_records = list(parse(parse_raw_record, [dict(row) for row in rows]))
+                copy_to_staging_tables(conn, parsed_records)
+                stored += len(parsed_records)
+                LOGGER.info(f'Parsed and staged {stored} works')
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    move_staged_rows(conn, last_successful_batch)
     db.session.commit()
+    LOGGER.info(f'Stored {stored} works')
 
 
-def store_pubmed_work_references(record: dict, tree=None):
-    if tree is None:
-        tree = make_tree(record)
-    references = tree.xpath('//ReferenceList/Reference')
-    for raw_ref in references:
-        ref = PubmedReference()
-        ref.created = datetime.now()
-        ref.pmid = record['pmid']
-        ref.reference = tostring(raw_ref).decode()
-        ref.reference_number = int(
-            raw_ref.attrib.get('RecordthresherReferenceNo', 1))
-        ref.doi = record['doi']
-        ref.citation = safe_get_first_xpath(raw_ref, './Citation/text()')
-        ref.pmid_referenced = safe_get_first_xpath(tree, '//ArticleId/text()')
-        db.session.add(ref)
-
-
-def store_pubmed_references(records: list):
-    for i, record in enumerate(records):
-        store_pubmed_work_references(record)
-        if i % COMMIT_CHUNK_SIZE == 0:
-            db.session.commit()
-            LOGGER.info(f'Stored references for {i + 1}/{len(records)} works')
-    db.session.commit()
-
-
-def store_pubmed_authors_and_affiliations(records: list):
-    for i, record in enumerate(records):
-        store_pubmed_work_authors_and_affiliations(record)
-        if i % COMMIT_CHUNK_SIZE == 0:
-            db.session.commit()
-            LOGGER.info(
-                f'Stored authors and references for {i + 1}/{len(records)} works')
-    db.session.commit()
-
-
-def store_pubmed_work_authors_and_affiliations(record: dict, tree=None):
-    if tree is None:
-        tree = make_tree(record)
-    authors = tree.xpath('//AuthorList/Author')
-    for raw_author in authors:
-        author = PubmedAuthor()
-        author.created = datetime.now()
-        author.pmid = record['pmid']
-        author.doi = record['doi']
-        author.author_order = int(
-            raw_author.attrib.get('RecordthresherAuthorNo', 1))
-        author.family = safe_get_first_xpath(raw_author, './LastName/text()')
-        author.given = safe_get_first_xpath(raw_author, './ForeName/text()')
-        author.initials = safe_get_first_xpath(raw_author, './Initials/text()')
-        author.orcid = safe_get_first_xpath(raw_author,
-                                            './Identifier[@Source="ORCID"]/text()')
-        stmnt = insert(PubmedAuthor).values(
-            **model_to_dict(author)).on_conflict_do_nothing()
-        db.session.execute(stmnt)
-
-        affiliations = raw_author.xpath('./AffiliationInfo/Affiliation')
-        for raw_aff in affiliations:
-            affiliation = PubmedAffiliation()
-            affiliation.created = datetime.now()
-            affiliation.affiliation = raw_aff.text
-            affiliation.author_string = tostring(raw_author).decode()
-            affiliation.pmid = author.pmid
-            affiliation.affiliation_number = int(
-                raw_aff.attrib.get('RecordthresherAuthorAffiliationNo', 1))
-            affiliation.author_order = author.author_order
-            stmnt = insert(PubmedAffiliation).values(
-                **model_to_dict(affiliation)).on_conflict_do_nothing()
-            db.session.execute(stmnt)
-
-
-def store_pubmed_work_mesh(record: dict, tree=None):
-    if tree is None:
-        tree = make_tree(record)
-    raw_meshes = tree.xpath('//MeshHeadingList/MeshHeading')
-    for raw_mesh in raw_meshes:
-        mesh = PubmedMesh()
-        mesh.created = datetime.now()
-        mesh.pmid = record['pmid']
-        mesh.qualifier_ui = safe_get_first_xpath(raw_mesh,
-                                                 './QualifierName/@UI')
-        mesh.qualifier_name = safe_get_first_xpath(raw_mesh,
-                                                   './QualifierName/text()')
-        mesh.descriptor_ui = safe_get_first_xpath(raw_mesh,
-                                                  './DescriptorName/@UI')
-        mesh.descriptor_name = safe_get_first_xpath(raw_mesh,
-                                                    './DescriptorName/text()')
-        mesh.is_major_topic = safe_get_first_xpath(raw_mesh,
-                                                   './QualifierName/@MajorTopicYN') == 'Y'
-        db.session.add(mesh)
-
-
-def store_pubmed_mesh(records: list):
-    for i, record in enumerate(records):
-        store_pubmed_work_mesh(record)
-        if i % 100 == 0:
-            db.session.commit()
-            LOGGER.info(f'Stored meshes for {i + 1}/{len(records)} works')
-    db.session.commit()
-
-
-def pre_delete(table, last_successful_batch):
-    db.session.execute(f'''delete from recordthresher.{table} where pmid in (
+def pre_delete(table, last_successful_batch, conn):
+    conn.execute(text(f'''delete from recordthresher.{table} where pmid in (
     	select distinct pmid from recordthresher.pubmed_raw 
-        where created > :last_successful)''',
-                       {'last_successful': last_successful_batch})
-    db.session.commit()
+        where created > :last_successful)'''),
+                 {'last_successful': last_successful_batch})
 
 
 def mark_batch_completed(batch_id, last_successful_batch):
@@ -262,6 +318,10 @@ def enqueue_to_record_queue(last_successful_batch):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parse new pubmed_raw rows into the pubmed tables.")
+    parser.add_argument('--workers', type=int, default=1, help="processes to parse articles with")
+    parsed_args = parser.parse_args()
+
     last_successful_batch = get_last_successful_pubmed_batch_start() - timedelta(
         hours=24)
     LOGGER.info(f'Last successful batch: {last_successful_batch}')
@@ -269,24 +329,9 @@ if __name__ == '__main__':
     delete_from_record_queue(last_successful_batch)
     LOGGER.info(f'Finished deleting from record queue')
     batch_id = start_batch()
-    raw_records = [dict(row) for row in get_raw_records(last_successful_batch)]
-    pre_delete('pubmed_works', last_successful_batch)
-    LOGGER.info('Storing works')
-    store_pubmed_works(raw_records)
-    LOGGER.info('Finished storing works')
-    pre_delete('pubmed_reference', last_successful_batch)
-    LOGGER.info('Storing references')
-    store_pubmed_references(raw_records)
-    LOGGER.info('Stored references')
-    pre_delete('pubmed_author', last_successful_batch)
-    pre_delete('pubmed_affiliation', last_successful_batch)
-    LOGGER.info('Storing authors and affiliations')
-    store_pubmed_authors_and_affiliations(raw_records)
-    LOGGER.info('Finished storing authors and affiliations')
-    pre_delete('pubmed_mesh', last_successful_batch)
-    LOGGER.info('Storing meshes')
-    store_pubmed_mesh(raw_records)
-    LOGGER.info('Finished storing meshes')
+    LOGGER.info('Storing works, references, authors, affiliations and meshes')
+    store_raw_records(last_successful_batch, workers=parsed_args.workers)
+    LOGGER.info('Finished storing works, references, authors, affiliations and meshes')
     LOGGER.info('Marking batch completed')
     mark_batch_completed(batch_id, last_successful_batch)
     LOGGER.info('Finished marking batch completed')
@@ -1,13 +1,16 @@
 import argparse
 import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from threading import Thread
 from time import time, sleep
 from urllib.parse import quote
 
 import requests
 from requests.exceptions import RequestException
-from sqlalchemy import text
+from sqlalchemy import text, literal_column
+from sqlalchemy.dialects.postgresql import insert
 from tenacity import retry, stop_after_attempt, wait_exponential, \
     retry_if_exception_type, retry_if_result
 
@@ -20,6 +23,7 @@ from pub import build_new_pub
 from util import elapsed
 from util import normalize_doi
 from util import safe_commit
+from util import TokenBucket
 from endpoint import Endpoint  # magic
 
 # data from https://archive.org/details/crossref_doi_metadata
@@ -30,6 +34,13 @@ from endpoint import Endpoint  # magic
 
 CROSSREF_API_KEY = os.getenv('CROSSREF_API_KEY')
 
+# be nice: one cursor page request per second, however long the db writes take
+CROSSREF_PAGES_PER_SECOND = 1
+# single-doi lookups are small, but don't hammer the api with them
+CROSSREF_DOI_FETCH_WORKERS = 5
+# pages fetched ahead of the one being written
+PREFETCH_PAGES = 2
+
 
 def is_good_file(filename):
     return "chunk_" in filename
@@ -49,9 +60,11 @@ def get_api_for_one_doi(doi):
 
 
 def add_pubs_from_dois(dois):
+    with ThreadPoolExecutor(max_workers=CROSSREF_DOI_FETCH_WORKERS) as executor:
+        crossref_apis = list(executor.map(get_api_for_one_doi, dois))
+
     new_pubs = []
-    for doi in dois:
-        crossref_api = get_api_for_one_doi(doi)
+    for doi, crossref_api in zip(dois, crossref_apis):
         new_pub = build_new_pub(doi, crossref_api)
 
         # hack so it gets updated soon
@@ -74,41 +87,83 @@ def add_new_pubs_from_dois(dois):
     return added_pubs
 
 
-def add_pubs_or_update_crossref(pubs):
+def upsert_crossref_pubs(pubs, update_existing=False):
+    """
+    Write a page of pubs built by build_new_pub in one statement. New pubs are inserted;
+    existing ones get the new crossref_api_raw_new if update_existing is set and are left
+    alone otherwise. Inserted and updated pubs are queued for recordthresher. Returns the ids inserted.
+    """
     if not pubs:
         return []
 
-    pubs_by_id = dict((p.id, p) for p in pubs)
-
-    existing_pub_ids = set([
-        id_tuple[0] for id_tuple in db.session.query(Pub.id).filter(Pub.id.in_(list(pubs_by_id.keys()))).all()
+    # the cursor can repeat a doi within a page, and one upsert can't touch a row twice
+    pubs_by_id = {}
+    for p in pubs:
+        pubs_by_id.setdefault(p.id, p)
+
+    stmt = insert(Pub.__table__).values([
+        {
+            'id': p.id,
+            'crossref_api_raw_new': p.crossref_api_raw_new,
+            'title': p.title,
+            'normalized_title': p.normalized_title,
+            'updated': p.updated,
+            'rand': p.rand,
+        } for p in pubs_by_id.values()
     ])
 
-    pubs_to_add = [p for p in pubs if p.id not in existing_pub_ids]
-    pubs_to_update = [p for p in pubs if p.id in existing_pub_ids]
-
-    if pubs_to_add:
-        logger.info("adding {} pubs".format(len(pubs_to_add)))
-        db.session.add_all(pubs_to_add)
-
-    if pubs_to_update:
-        row_dicts = [{'id': p.id, 'crossref_api_raw_new': p.crossref_api_raw_new} for p in pubs_to_update]
-        logger.info("updating {} pubs".format(len(pubs_to_update)))
-        db.session.bulk_update_mappings(Pub, row_dicts)
-
-    db.session.execute(
-        text(
-            '''
-            insert into recordthresher.doi_record_queue (doi, updated) (
-                select id, (crossref_api_raw_new->'indexed'->>'date-time')::timestamp without time zone from pub
-                where id = any (:dois)
-            ) on conflict do nothing
-            '''
-        ).bindparams(dois=list(set(pubs_by_id.keys())))
-    )
+    if update_existing:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Pub.id],
+            set_={'crossref_api_raw_new': stmt.excluded.crossref_api_raw_new}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Pub.id])
+
+    # xmax is 0 for rows this statement inserted rather than updated
+    written = db.session.execute(stmt.returning(Pub.id, literal_column('xmax = 0'))).fetchall()
+    inserted_ids = [row[0] for row in written if row[1]]
+    queued_ids = [row[0] for row in written] if update_existing else inserted_ids
+
+    if queued_ids:
+        db.session.execute(
+            text(
+                '''
+                insert into recordthresher.doi_record_queue (doi, updated) (
+                    select id, (crossref_api_raw_new->'indexed'->>'date-time')::timestamp without time zone from pub
+                    where id = any (:dois)
+                ) on conflict do nothing
+                '''
+            ).bindparams(dois=queued_ids)
+        )
 
     safe_commit(db)
-    return pubs_to_add
+    logger.info(f"inserted {len(inserted_ids)} and wrote {len(written)} pubs")
+    return inserted_ids
+
+
+def prefetched(iterable, buffer_size):
+    """Iterate over iterable in a background thread, staying up to buffer_size items ahead of the caller."""
+    buffer = Queue(maxsize=buffer_size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put((item, None))
+        except Exception as e:
+            buffer.put((None, e))
+        buffer.put((done, None))
+
+    Thread(target=produce, daemon=True).start()
+
+    while True:
+        item, error = buffer.get()
+        if error:
+            raise error
+        if item is done:
+            return
+        yield item
 
 
 def is_bad_response(response):
@@ -140,11 +195,7 @@ def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today
         root_url_with_last = "https://api.crossref.org/works?order=desc&sort=updated&filter=from-created-date:{first},until-created-date:{last}&rows={chunk}&cursor={next_cursor}"
         root_url_no_last = "https://api.crossref.org/works?order=desc&sort=updated&filter=from-created-date:{first}&rows={chunk}&cursor={next_cursor}"
 
-    next_cursor = "*"
-    has_more_responses = True
     num_pubs_added_so_far = 0
-    pubs_this_chunk = []
-
     if week:
         last = (datetime.date.today() + datetime.timedelta(days=1))
         first = (datetime.date.today() - datetime.timedelta(days=7))
@@ -163,76 +214,73 @@ def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today
 
     start_time = time()
 
-    insert_pub_fn = add_pubs_or_update_crossref if get_updates else add_new_pubs
-
-    while has_more_responses:
+    def page_url(next_cursor):
         if query_doi:
-            url = root_url_doi.format(doi=query_doi)
-        else:
-            if last:
-                url = root_url_with_last.format(first=first.isoformat(),
-                                                last=last.isoformat(),
-                                                next_cursor=next_cursor,
-                                                chunk=chunk_size)
-            else:
-                # query is much faster if don't have a last specified, even if it is far in the future
-                url = root_url_no_last.format(first=first.isoformat(),
-                                              next_cursor=next_cursor,
-                                              chunk=chunk_size)
+            return root_url_doi.format(doi=query_doi)
 
-        logger.info("calling url: {}".format(url))
-        crossref_time = time()
+        if last:
+            return root_url_with_last.format(first=first.isoformat(),
+                                             last=last.isoformat(),
+                                             next_cursor=next_cursor,
+                                             chunk=chunk_size)
 
-        resp = get_response_page(url)
-        logger.info("getting crossref response took {} seconds".format(elapsed(crossref_time, 2)))
-        crossref_answer_time = time()
+        # query is much faster if don't have a last specified, even if it is far in the future
+        return root_url_no_last.format(first=first.isoformat(),
+                                       next_cursor=next_cursor,
+                                       chunk=chunk_size)
 
-        if resp.status_code != 200:
-            logger.info("error in crossref call, status_code = {}".format(resp.status_code))
-            resp = None
+    # the next page downloads while this thread writes the current one
+    for items in prefetched(crossref_pages(page_url), PREFETCH_PAGES):
+        loop_time = time()
 
-        if resp:
-            resp_data = resp.json()["message"]
-            next_cursor = resp_data.get("next-cursor", None)
-            if next_cursor:
-                next_cursor = quote(next_cursor)
+        pubs_this_page = []
+        for api_raw in items:
+            doi = normalize_doi(api_raw["DOI"])
+            my_pub = build_new_pub(doi, api_raw)
 
-            if not resp_data["items"] or not next_cursor:
-                has_more_responses = False
+            # hack so it gets updated soon
+            my_pub.updated = datetime.datetime(1042, 1, 1)
 
-            for api_raw in resp_data["items"]:
-                loop_time = time()
+            pubs_this_page.append(my_pub)
 
-                doi = normalize_doi(api_raw["DOI"])
-                my_pub = build_new_pub(doi, api_raw)
+        added_ids = upsert_crossref_pubs(pubs_this_page, update_existing=get_updates)
+        logger.info("added {} pubs, loop done in {} seconds".format(len(added_ids), elapsed(loop_time, 2)))
+        num_pubs_added_so_far += len(added_ids)
+        db.session.expunge_all()
 
-                # hack so it gets updated soon
-                my_pub.updated = datetime.datetime(1042, 1, 1)
+    logger.info("Added >>{}<< new crossref dois on {}, took {} seconds".format(
+        num_pubs_added_so_far, datetime.datetime.now().isoformat()[0:10], elapsed(start_time, 2)))
 
-                pubs_this_chunk.append(my_pub)
 
-                if len(pubs_this_chunk) >= 100:
-                    added_pubs = insert_pub_fn(pubs_this_chunk)
-                    logger.info("added {} pubs, loop done in {} seconds".format(len(added_pubs), elapsed(loop_time, 2)))
-                    num_pubs_added_so_far += len(added_pubs)
+def crossref_pages(page_url):
+    """Yield the items from each cursor page, at most CROSSREF_PAGES_PER_SECOND pages a second."""
+    rate = TokenBucket(CROSSREF_PAGES_PER_SECOND)
+    next_cursor = "*"
+    has_more_responses = True
 
-                    pubs_this_chunk = []
+    while has_more_responses:
+        rate.acquire()
 
-        logger.info("at bottom of loop")
+        url = page_url(next_cursor)
+        logger.info("calling url: {}".format(url))
+        crossref_time = time()
 
-        # be nice
-        seconds_between_requests = 1
-        time_since_crossref_request = elapsed(crossref_answer_time)
-        sleep_time = max(0, seconds_between_requests - time_since_crossref_request)
-        logger.info(f'sleeping {sleep_time} between crossref requests')
-        sleep(sleep_time)
+        resp = get_response_page(url)
+        logger.info("getting crossref response took {} seconds".format(elapsed(crossref_time, 2)))
 
-    # make sure to get the last ones
-    logger.info("saving last ones")
-    added_pubs = insert_pub_fn(pubs_this_chunk)
-    num_pubs_added_so_far += len(added_pubs)
-    logger.info("Added >>{}<< new crossref dois on {}, took {} seconds".format(
-        num_pubs_added_so_far, datetime.datetime.now().isoformat()[0:10], elapsed(start_time, 2)))
+        if resp.status_code != 200:
+            logger.info("error in crossref call, status_code = {}".format(resp.status_code))
+            continue
+
+        resp_data = resp.json()["message"]
+        next_cursor = resp_data.get("next-cursor", None)
+        if next_cursor:
+            next_cursor = quote(next_cursor)
+
+        if not resp_data["items"] or not next_cursor:
+            has_more_responses = False
+
+        yield resp_data["items"]
 
 
 # this one is used for catch up.  use the above function when we want all weekly dois
@@ -1,16 +1,16 @@
 import argparse
 import concurrent.futures
+import heapq
+import json
 import logging
 import os
-import pickle
-from datetime import datetime, timedelta
-from multiprocessing import current_process
+from threading import current_thread
+from time import monotonic
 from time import sleep
 from time import time
 from urllib.parse import urlparse
 
 import redis
-from redis import WatchError
 from sqlalchemy import orm, text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import make_transient
@@ -24,13 +24,69 @@ from recordthresher.record import RecordthresherParentRecord
 from recordthresher.record_maker import PmhRecordMaker
 from util import elapsed
 from util import safe_commit
+from util import TokenBucket
 
 from pub import Pub  # magic
 import endpoint  # magic
 import pmh_record  # magic
 
-def _procs_per_worker():
-    return int(os.getenv('GREEN_SCRAPE_PROCS_PER_WORKER', 10))
+def _scrape_threads_per_worker():
+    return int(os.getenv('GREEN_SCRAPE_THREADS_PER_WORKER', os.getenv('GREEN_SCRAPE_PROCS_PER_WORKER', 10)))
+
+
+# give up on a page after this long and return it to the queue
+SCRAPE_TIMEOUT_SECONDS = 300
+
+# pages that can't get a turn at their host this soon after a chunk starts go back to the queue
+MAX_RATE_LIMIT_WAIT_SECONDS = 60
+
+DEFAULT_SCRAPE_INTERVAL_SECONDS = 10
+
+# host suffix -> seconds between scrapes. GREEN_SCRAPE_HOST_INTERVALS, a json object
+# like {"example.edu": 2}, adds to or overrides these without a deploy.
+HOST_SCRAPE_INTERVAL_SECONDS = {
+    'citeseerx.ist.psu.edu': 1,
+    'www.ncbi.nlm.nih.gov': 1,
+    'pt.cision.com': 1,
+    'doaj.org': 1,
+    'hal.archives-ouvertes.fr': 1,
+    'figshare.com': 1,
+    'arxiv.org': 1,
+    'europepmc.org': 1,
+    'bibliotheques-specialisees.paris.fr': 1,
+    'nbn-resolving.de': 1,
+    'osti.gov': 1,
+    'zenodo.org': 1,
+    'kuleuven.be': 1,
+    'edoc.hu-berlin.de': 1,
+    'rug.nl': 1,
+}
+HOST_SCRAPE_INTERVAL_SECONDS.update(json.loads(os.getenv('GREEN_SCRAPE_HOST_INTERVALS') or '{}'))
+
+# refill, take a token if there is one, and return how many seconds until there will be, all in one step.
+# the caller's clock is used so the script stays deterministic.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'refilled_at')
+local tokens = tonumber(bucket[1]) or capacity
+local refilled_at = tonumber(bucket[2]) or now
+now = math.max(now, refilled_at)
+tokens = math.min(capacity, tokens + (now - refilled_at) * rate)
+
+local wait_seconds = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_seconds = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'refilled_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait_seconds)
+"""
 
 
 def _redis_max_connections():
@@ -55,149 +111,208 @@ def get_redis_client():
     return _redis_client
 
 
-def scrape_pages(pages):
-    for page in pages:
-        make_transient(page)
+def rate_limit_key(page):
+    domain = urlparse(page.url).netloc
+    return 'green-scrape-bucket:{}:{}'.format(page.endpoint_id, domain)
 
-    # free up the connection while doing net IO
-    db.session.close()
-    db.engine.dispose()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=_procs_per_worker()) as pool:
-        map_results = pool.map(scrape_page, pages, chunksize=1)
-        scraped_pages = [p for p in map_results if p]
+def scrape_interval_seconds(page):
+    hostname = urlparse(page.url).hostname
 
-    logger.info('finished scraping all pages')
+    if hostname:
+        for host, interval_seconds in HOST_SCRAPE_INTERVAL_SECONDS.items():
+            if hostname.endswith(host):
+                return interval_seconds
 
-    logger.info('preparing update records')
-    extant_page_ids = [
-        row[0] for row in
-        db.session.query(PageNew.id).filter(PageNew.id.in_(
-            [p.id for p in scraped_pages]
-        )).all()
-    ]
+    return DEFAULT_SCRAPE_INTERVAL_SECONDS
 
-    scraped_pages = [db.session.merge(p) for p in scraped_pages if p.id in extant_page_ids]
 
-    for scraped_page in scraped_pages:
-        scraped_page.save_first_version_availability()
+class LocalHostBuckets(object):
+    """One util.TokenBucket per host, only shared by this process's threads."""
+    def __init__(self):
+        self.buckets = {}
 
-    return scraped_pages
+    def take(self, key, interval_seconds):
+        bucket = self.buckets.setdefault(key, TokenBucket(1.0 / interval_seconds))
+        return bucket.take()
 
 
-def scrape_page(page):
-    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
-        worker = current_process().name
+class RedisHostBuckets(object):
+    """Token buckets in redis, so every green scrape dyno shares each host's budget."""
+    def __init__(self, redis_client):
+        self.take_token = redis_client.register_script(TOKEN_BUCKET_LUA)
+        self.fallback = LocalHostBuckets()
+
+    def take(self, key, interval_seconds):
         try:
-            return pool.submit(scrape_page_worker, page).result(timeout=300)
-        except concurrent.futures.TimeoutError as e:
-            logger.error(f'{worker} timed out')
-            for pid, process in pool._processes.items():
-                process.terminate()
-            pool.shutdown()
-            return None
-        except (KeyboardInterrupt, SystemExit):
-            pass
-        except Exception as e:
-            logger.exception(f'{worker} exception scraping page {page.id}')
-            return None
+            return float(self.take_token(keys=[key], args=[1.0 / interval_seconds, 1, time()]))
+        except redis.RedisError as e:
+            logger.exception(f'failed taking a redis token for {key}, using a local bucket: {e}')
+            return self.fallback.take(key, interval_seconds)
 
 
-def scrape_page_worker(page):
-    worker = current_process().name
-    site_key_stem = redis_key(page, '')
+_host_buckets = None
 
-    logger.info('{} started scraping page {} {} {}'.format(worker, page.id, site_key_stem, page))
 
-    total_wait_seconds = 0
-    wait_seconds = 5
-    while total_wait_seconds < 60:
-        if begin_rate_limit(page):
-            page.scrape()
-            end_rate_limit(page)
-            logger.info('{} finished scraping page {} {} {}'.format(worker, page.id, site_key_stem, page))
-            return page
-        else:
-            logger.info('{} not ready to scrape page {} {} {}, waiting'.format(worker, page.id, site_key_stem, page))
-            sleep(wait_seconds)
-            total_wait_seconds += wait_seconds
+def get_host_buckets():
+    global _host_buckets
 
-    logger.info('{} done waiting to scrape page {} {} {}, giving up'.format(worker, page.id, site_key_stem, page))
+    if _host_buckets is None:
+        redis_client = get_redis_client()
+        _host_buckets = RedisHostBuckets(redis_client) if redis_client else LocalHostBuckets()
 
-    return None
+    return _host_buckets
 
 
-def unpickle(v):
-    return pickle.loads(v) if v else None
+def scrape_page(page):
+    worker = current_thread().name
+    logger.info('{} started scraping page {} {}'.format(worker, page.id, page))
+    try:
+        page.scrape()
+    finally:
+        # pool threads live as long as the process, so don't let them keep a session open
+        db.session.remove()
+    logger.info('{} finished scraping page {} {}'.format(worker, page.id, page))
+    return page
+
+
+class GreenScrapeScheduler(object):
+    """
+    Scrape a chunk of pages on a pool of threads, starting each one as soon as its host has a token.
+
+    Instead of polling, the dispatcher sleeps exactly until the next host token is due, a thread
+    frees up, or a running scrape hits its deadline. Threads can't be killed, so a scrape that runs
+    past SCRAPE_TIMEOUT_SECONDS is abandoned: its page goes back to the queue and its thread is left
+    to finish on its own, which the http timeouts in page.scrape make sure it eventually does.
+
+    One scheduler and thread pool serve every chunk a process scrapes, so threads still stuck
+    from earlier chunks count against `workers` and the thread count never grows past it.
+    Those threads also hold up process exit until their http calls time out.
+    """
+    def __init__(self, workers, host_buckets, timeout_seconds=SCRAPE_TIMEOUT_SECONDS, max_wait_seconds=MAX_RATE_LIMIT_WAIT_SECONDS):
+        self.workers = workers
+        self.host_buckets = host_buckets
+        self.timeout_seconds = timeout_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.abandoned = set()
+
+    def take_turn(self, page):
+        if page.endpoint_id == publisher_equivalent_endpoint_id:
+            return 0
+
+        return self.host_buckets.take(rate_limit_key(page), scrape_interval_seconds(page))
+
+    def scrape(self, pages):
+        start = monotonic()
+        give_up_at = start + self.max_wait_seconds
+
+        # heap of (not before, position in chunk, page)
+        waiting = [(start, n, page) for n, page in enumerate(pages)]
+        running = {}
+        scraped_pages = []
+
+        while waiting or running:
+            now = monotonic()
+
+            self.abandoned = {f for f in self.abandoned if not f.done()}
+            all_stuck = len(self.abandoned) >= self.workers
+            if all_stuck and waiting and now >= give_up_at:
+                logger.error(f'all {self.workers} scrape threads are stuck, returning {len(waiting)} pages to the queue')
+                waiting = []
+
+            while waiting and waiting[0][0] <= now and len(running) + len(self.abandoned) < self.workers:
+                not_before, n, page = heapq.heappop(waiting)
+                wait_seconds = self.take_turn(page)
+
+                if wait_seconds <= 0:
+                    running[self.executor.submit(scrape_page, page)] = (page, now + self.timeout_seconds)
+                elif now + wait_seconds > give_up_at:
+                    logger.info('not ready to scrape page {} {}, giving up'.format(page.id, page))
+                else:
+                    heapq.heappush(waiting, (now + wait_seconds, n, page))
+
+            for future, (page, deadline) in list(running.items()):
+                if deadline <= now:
+                    logger.error('timed out scraping page {} {}'.format(page.id, page))
+                    del running[future]
+                    if not future.cancel():
+                        self.abandoned.add(future)
+
+            if not (waiting or running):
+                break
+
+            wake_times = [deadline for page, deadline in running.values()]
+            if waiting and len(running) + len(self.abandoned) < self.workers:
+                wake_times.append(waiting[0][0])
+            elif waiting and all_stuck:
+                wake_times.append(give_up_at)
+
+            timeout = max(0, min(wake_times) - now) if wake_times else None
+
+            if running or self.abandoned:
+                done, not_done = concurrent.futures.wait(
+                    list(running) + list(self.abandoned), timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+            else:
+                sleep(timeout)
+                done = set()
+
+            for future in done:
+                if future not in running:
+                    continue
 
+                page, deadline = running.pop(future)
+                try:
+                    scraped_pages.append(future.result())
+                except Exception as e:
+                    logger.exception(f'exception scraping page {page.id}: {e}')
 
-def redis_key(page, scrape_property):
-    domain = urlparse(page.url).netloc
-    return 'green-scrape-p3:{}:{}:{}'.format(page.endpoint_id, domain, scrape_property)
+        logger.info('scraped {} of {} pages in {} seconds'.format(
+            len(scraped_pages), len(pages), round(monotonic() - start, 2)
+        ))
 
+        return scraped_pages
 
-def scrape_interval_seconds(page):
-    hostname = urlparse(page.url).hostname
 
-    one_sec_hosts = [
-        'citeseerx.ist.psu.edu',
-        'www.ncbi.nlm.nih.gov',
-        'pt.cision.com',
-        'doaj.org',
-        'hal.archives-ouvertes.fr',
-        'figshare.com',
-        'arxiv.org',
-        'europepmc.org',
-        'bibliotheques-specialisees.paris.fr',
-        'nbn-resolving.de',
-        'osti.gov',
-        'zenodo.org',
-        'kuleuven.be',
-        'edoc.hu-berlin.de',
-        'rug.nl',
-    ]
+_scrape_scheduler = None
 
-    for host in one_sec_hosts:
-        if hostname and hostname.endswith(host):
-            return 1
 
-    return 10
+def get_scrape_scheduler():
+    global _scrape_scheduler
 
+    if _scrape_scheduler is None:
+        _scrape_scheduler = GreenScrapeScheduler(_scrape_threads_per_worker(), get_host_buckets())
 
-def begin_rate_limit(page, interval_seconds=None):
-    redis_client = get_redis_client()
+    return _scrape_scheduler
 
-    if page.endpoint_id == publisher_equivalent_endpoint_id:
-        return True
 
-    interval_seconds = interval_seconds or scrape_interval_seconds(page)
+def scrape_pages(pages):
+    for page in pages:
+        make_transient(page)
 
-    started_key = redis_key(page, 'started')
-    finished_key = redis_key(page, 'finished')
+    # free up the connection while doing net IO
+    db.session.close()
+    db.engine.dispose()
 
-    with redis_client.pipeline() as pipe:
-        try:
-            pipe.watch(started_key)
-            pipe.watch(finished_key)
+    scraped_pages = get_scrape_scheduler().scrape(pages)
 
-            scrape_started = unpickle(pipe.get(started_key))
+    logger.info('finished scraping all pages')
 
-            if scrape_started and scrape_started >= datetime.utcnow() - timedelta(seconds=interval_seconds):
-                return False
+    logger.info('preparing update records')
+    extant_page_ids = [
+        row[0] for row in
+        db.session.query(PageNew.id).filter(PageNew.id.in_(
+            [p.id for p in scraped_pages]
+        )).all()
+    ]
 
-            pipe.multi()
-            pipe.set(started_key, pickle.dumps(datetime.utcnow()))
-            pipe.set(finished_key, pickle.dumps(None))
-            pipe.execute()
-            return True
-        except WatchError:
-            return False
+    scraped_pages = [db.session.merge(p) for p in scraped_pages if p.id in extant_page_ids]
 
+    for scraped_page in scraped_pages:
+        scraped_page.save_first_version_availability()
 
-def end_rate_limit(page):
-    redis_client = get_redis_client()
-    redis_client.set(redis_key(page, 'started'), pickle.dumps(None))
-    redis_client.set(redis_key(page, 'finished'), pickle.dumps(datetime.utcnow()))
+    return scraped_pages
 
 
 def merge_and_commit_objects(objects, retry=2):
@@ -1,5 +1,6 @@
 import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from subprocess import call
 from time import sleep
 from time import time
@@ -15,6 +16,8 @@ from util import get_sql_answers
 from util import run_sql
 from util import safe_commit
 
+DEFAULT_OBJECT_TIMEOUT = 10 * 60
+
 
 class DbQueue(object):
 
@@ -148,6 +151,14 @@ class DbQueue(object):
         # if is pooling, need to do .dispose() instead
         db.engine.dispose()
 
+        workers = self.parsed_vars.get("workers") or 1
+        if workers > 1:
+            return self.update_fn_parallel(
+                cls, method_name, objects, index=index, kwargs_map=kwargs_map,
+                workers=workers,
+                object_timeout=self.parsed_vars.get("object_timeout") or DEFAULT_OBJECT_TIMEOUT
+            )
+
         start = time()
         num_obj_rows = len(objects)
 
@@ -159,35 +170,13 @@ class DbQueue(object):
         #     elapsed=elapsed(start)
         # ))
 
+        finished_ids = []
         for count, obj in enumerate(objects):
-            start_time = time()
-
             if obj is None:
-                return None
-
-            method_to_run = getattr(obj, method_name)
-
-            # logger.info(u"***")
-            logger.info("*** #{count} starting {repr}.{method_name}() method".format(
-                count=count + (num_obj_rows*index),
-                repr=obj,
-                method_name=method_name
-            ))
-
-            method_kwargs = kwargs_map.get(obj.id, {}) if kwargs_map else {}
-            method_to_run(**method_kwargs)
-
-            logger.info("finished {repr}.{method_name}(). took {elapsed} seconds".format(
-                repr=obj,
-                method_name=method_name,
-                elapsed=elapsed(start_time, 4)
-            ))
-
-            # for handling the queue
-            if not (method_name == "update" and obj.__class__.__name__ == "Pub"):
-                obj.finished = datetime.datetime.utcnow().isoformat()
-            # db.session.merge(obj)
+                return finished_ids
 
+            self.run_method_on_object(obj, method_name, count + (num_obj_rows*index), kwargs_map)
+            finished_ids.append(obj.id)
 
         start_time = time()
         commit_success = safe_commit(db)
@@ -195,7 +184,102 @@ class DbQueue(object):
             logger.info("COMMIT fail")
         logger.info("commit took {} seconds".format(elapsed(start_time, 2)))
         db.session.remove()  # close connection nicely
-        return None  # important for if we use this on RQ
+        # ids of the objects the method ran on. an exception propagates and leaves the rest started.
+        return finished_ids
+
+    def run_method_on_object(self, obj, method_name, count, kwargs_map=None):
+        start_time = time()
+        method_to_run = getattr(obj, method_name)
+
+        # logger.info(u"***")
+        logger.info("*** #{count} starting {repr}.{method_name}() method".format(
+            count=count,
+            repr=obj,
+            method_name=method_name
+        ))
+
+        method_kwargs = kwargs_map.get(obj.id, {}) if kwargs_map else {}
+        method_to_run(**method_kwargs)
+
+        logger.info("finished {repr}.{method_name}(). took {elapsed} seconds".format(
+            repr=obj,
+            method_name=method_name,
+            elapsed=elapsed(start_time, 4)
+        ))
+
+        # for handling the queue
+        if not (method_name == "update" and obj.__class__.__name__ == "Pub"):
+            obj.finished = datetime.datetime.utcnow().isoformat()
+        # db.session.merge(obj)
+
+    def update_fn_parallel(self, cls, method_name, objects, index=1, kwargs_map=None,
+                           workers=2, object_timeout=DEFAULT_OBJECT_TIMEOUT):
+        # run the method on several objects at once in threads.
+        # db.session is scoped per thread, so each worker gets its own session.
+        # methods like Pub.refresh commit and close the session part way through,
+        # so each object is committed on its own instead of once for the whole chunk.
+        # object_timeout only stops waiting for an object: its thread can't be killed, keeps
+        # running, and holds up interpreter exit (ThreadPoolExecutor joins its threads at exit)
+        # until the method returns on its own. Bound slow calls with their own http/db timeouts.
+        # returns the ids of objects whose method finished without an exception, so callers can
+        # put the failed, timed out and skipped ones back in their queue.
+        objects = [obj for obj in objects if obj is not None]
+        object_ids = [obj.id for obj in objects]
+        num_obj_rows = len(objects)
+
+        for obj in objects:
+            db.session.expunge(obj)
+        db.session.remove()
+
+        started_at = {}
+
+        def run_in_worker(count, obj):
+            started_at[count] = time()
+            try:
+                db.session.add(obj)
+                self.run_method_on_object(obj, method_name, count + (num_obj_rows*index), kwargs_map)
+                if not safe_commit(db):
+                    logger.info("COMMIT fail for {}".format(obj))
+            finally:
+                db.session.remove()
+
+        start_time = time()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(run_in_worker, count, obj): count for count, obj in enumerate(objects)}
+        pending = set(futures)
+        hung = set()
+        finished_ids = []
+
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception():
+                    logger.error("{} failed: {}".format(object_ids[futures[future]], future.exception()))
+                else:
+                    finished_ids.append(object_ids[futures[future]])
+
+            # a thread can't be killed, so stop waiting for it and let the other workers carry on
+            for future in list(pending):
+                count = futures[future]
+                if count in started_at and time() - started_at[count] > object_timeout:
+                    logger.error("{}.{}() timed out after {} seconds, abandoning it".format(
+                        object_ids[count], method_name, object_timeout))
+                    pending.discard(future)
+                    hung.add(future)
+
+            if len([f for f in hung if not f.done()]) >= workers:
+                cancelled = [f for f in pending if f.cancel()]
+                logger.error("all {} workers are stuck, skipping {} objects".format(workers, len(cancelled)))
+                pending -= set(cancelled)
+
+        executor.shutdown(wait=False)
+        if hung:
+            logger.error("{} timed out objects are still running and will delay exit until they finish".format(
+                len([f for f in hung if not f.done()])))
+        logger.info("ran {} objects with {} workers in {} seconds, {} finished".format(
+            num_obj_rows, workers, elapsed(start_time, 2), len(finished_ids)))
+        return finished_ids
 
     def run(self, parsed_args, job_type):
         start = time()
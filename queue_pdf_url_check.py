@@ -25,7 +25,7 @@ import endpoint #  magic
 import pmh_record #  magic
 
 
-def check_pdf_urls(pdf_urls):
+def check_pdf_urls(pdf_urls, workers=None):
     for url in pdf_urls:
         make_transient(url)
 
@@ -33,7 +33,7 @@ def check_pdf_urls(pdf_urls):
     safe_commit(db)
     db.engine.dispose()
 
-    req_pool = get_request_pool()
+    req_pool = get_request_pool(workers)
 
     checked_pdf_urls = req_pool.map(get_pdf_url_status, pdf_urls, chunksize=1)
     req_pool.close()
@@ -90,8 +90,8 @@ def get_pdf_url_status(pdf_url):
     return pdf_url
 
 
-def get_request_pool():
-    num_request_workers = int(os.getenv('PDF_REQUEST_PROCS_PER_WORKER', 10))
+def get_request_pool(num_request_workers=None):
+    num_request_workers = num_request_workers or int(os.getenv('PDF_REQUEST_PROCS_PER_WORKER', 10))
     return Pool(processes=num_request_workers, maxtasksperchild=10)
 
 
@@ -108,13 +108,14 @@ class DbQueuePdfUrlCheck(DbQueue):
         single_url = kwargs.get("id", None)
         chunk_size = kwargs.get("chunk", 100)
         limit = kwargs.get("limit", None)
+        workers = kwargs.get("workers", None)
 
         if limit is None:
             limit = float("inf")
 
         if single_url:
             objects = [run_class.query.filter(run_class.url == single_url).first()]
-            check_pdf_urls(objects)
+            check_pdf_urls(objects, workers)
         else:
             index = 0
             num_updated = 0
@@ -129,7 +130,7 @@ class DbQueuePdfUrlCheck(DbQueue):
                     sleep(5)
                     continue
 
-                check_pdf_urls(objects)
+                check_pdf_urls(objects, workers)
 
                 object_ids = [obj.url for obj in objects]
                 object_ids_str = ",".join(["'{}'".format(oid.replace("'", "''")) for oid in object_ids])
@@ -219,6 +220,7 @@ if __name__ == "__main__":
     parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished dois back to unstarted so they are retried")
     parser.add_argument('--limit', "-l", nargs="?", type=int, help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=100, type=int, help="how many to take off db at once")
+    parser.add_argument('--workers', nargs="?", default=None, type=int, help="how many processes to check urls with, instead of PDF_REQUEST_PROCS_PER_WORKER")
 
     parsed_args = parser.parse_args()
 
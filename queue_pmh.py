@@ -101,10 +101,13 @@ if __name__ == "__main__":
     parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished dois back to unstarted so they are retried")
     parser.add_argument('--limit', "-l", nargs="?", type=int, help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=10, type=int, help="how many to take off db at once")
+    parser.add_argument('--workers', nargs="?", default=1, type=int, help="run the method on this many objects at once, in threads")
+    parser.add_argument('--object-timeout', nargs="?", default=None, type=int, help="with --workers, stop waiting for an object after this many seconds. its thread keeps running, and the process can't exit until it finishes")
 
     parsed_args = parser.parse_args()
 
     job_type = "normal"  #should be an object attribute
     my_queue = DbQueuePmh()
+    my_queue.parsed_vars = vars(parsed_args)
     my_queue.run_right_thing(parsed_args, job_type)
     print("finished")
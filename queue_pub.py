@@ -12,11 +12,10 @@ from sqlalchemy import text
 from app import db, oa_db_engine
 from app import logger
 from endpoint import Endpoint  # magic
-from pub import Pub
+from pub import Pub, PrefetchedPubLookups, BatchedPubWrites
 from queue_main import DbQueue
 from util import elapsed, enqueue_slow_queue, enqueue_unpaywall_refresh
 from util import normalize_doi
-from util import run_sql
 
 
 class DbQueuePub(DbQueue):
@@ -35,6 +34,7 @@ class DbQueuePub(DbQueue):
         limit = kwargs.get("limit", 10)
         run_class = Pub
         run_method = kwargs.get("method")
+        prefetch = kwargs.get("prefetch", False)
 
         if dois:
             limit = len(dois)
@@ -141,21 +141,40 @@ class DbQueuePub(DbQueue):
                 return
 
             object_ids = [obj.id for obj in objects]
-            self.update_fn(run_class, run_method, objects, index=index,
-                           kwargs_map=kwargs_map)
+            # pdf urls, refresh priorities etc. are written once for the whole chunk
+            with BatchedPubWrites():
+                if prefetch:
+                    job_time = time()
+                    with PrefetchedPubLookups(objects):
+                        logger.info(
+                            "prefetched lookups in {} seconds".format(elapsed(job_time)))
+                        finished_ids = self.update_fn(run_class, run_method, objects, index=index,
+                                                      kwargs_map=kwargs_map)
+                else:
+                    finished_ids = self.update_fn(run_class, run_method, objects, index=index,
+                                                  kwargs_map=kwargs_map)
+
+            # with --workers, pubs that failed or timed out go back to the queue instead of being marked done
+            finished_id_set = set(finished_ids)
+            unfinished_ids = [object_id for object_id in object_ids if object_id not in finished_id_set]
+            if unfinished_ids:
+                logger.info(f'returning {len(unfinished_ids)} unfinished pubs to the queue')
 
-            enqueue_unpaywall_refresh(object_ids, oa_db_conn, oa_redis_conn)
-            logger.info(
-                f'Enqueued {len(object_ids)} works to be updated in unpaywall_recordthresher_fields')
+            if finished_ids:
+                enqueue_unpaywall_refresh(finished_ids, oa_db_conn, oa_redis_conn)
+                logger.info(
+                    f'Enqueued {len(finished_ids)} works to be updated in unpaywall_recordthresher_fields')
 
             if queue_table:
-                object_ids_str = ",".join(
-                    ["'{}'".format(id.replace("'", "''")) for id in object_ids])
-                object_ids_str = object_ids_str.replace("%",
-                                                        "%%")  # sql escaping
-                sql_command = "update {queue_table} set finished=now(), started=null where id in ({ids})".format(
-                    queue_table=queue_table, ids=object_ids_str)
-                run_sql(db, sql_command)
+                finished_command = text(
+                    f"update {queue_table} set finished=now(), started=null where id = any(:ids)"
+                ).bindparams(ids=list(finished_ids))
+                unfinished_command = text(
+                    f"update {queue_table} set started=null where id = any(:ids)"
+                ).bindparams(ids=unfinished_ids)
+
+                db.engine.execute(finished_command.execution_options(autocommit=True))
+                db.engine.execute(unfinished_command.execution_options(autocommit=True))
 
             index += 1
             if dois:
@@ -196,6 +215,13 @@ if __name__ == "__main__":
                         help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=500, type=int,
                         help="how many to take off db at once")
+    parser.add_argument('--prefetch', default=False, action='store_true',
+                        help="load related rows for each chunk in bulk before running the method")
+    parser.add_argument('--workers', nargs="?", default=1, type=int,
+                        help="run the method on this many objects at once, in threads")
+    parser.add_argument('--object-timeout', nargs="?", default=None, type=int,
+                        help="with --workers, stop waiting for an object after this many seconds. "
+                             "its thread keeps running, and the process can't exit until it finishes")
 
     parsed_args = parser.parse_args()
 
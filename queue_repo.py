@@ -1,6 +1,7 @@
 import argparse
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from random import shuffle
 from time import sleep
 from time import time
@@ -15,9 +16,143 @@ from app import db
 from app import logger
 from endpoint import Endpoint
 from queue_main import DbQueue
+from util import elapsed
 from util import safe_commit
 
 
+# the endpoints that are ready to harvest, for both HarvestScheduler and DbQueueRepo.worker_run
+READY_ENDPOINTS_CONDITION = """
+    (
+        most_recent_year_harvested is null
+        or (
+            most_recent_year_harvested + interval '1 day'
+            < now() at time zone 'utc'
+            - interval '1 day' -- wait until most_recent_year_harvested is over 1 day ago
+            - rand * interval '18 hours' -- plus an offset so we don't run everything at midnight
+        )
+    )
+    and (
+        last_harvest_started is null
+        or last_harvest_started < now() at time zone 'utc' - interval '8 hours'
+    )
+    and (
+        last_harvest_finished is null
+        or last_harvest_finished < now() at time zone 'utc' - interval '2 minutes'
+    )
+    and (
+        retry_at <= now()
+        or retry_at is null
+    )
+    and ready_to_run
+"""
+
+# endpoints whose pmh_url has no recognizable host get their own key, so they still get claimed
+ENDPOINT_HOST_EXPRESSION = "coalesce(lower(substring(pmh_url from '^(?:[A-Za-z]+://)?([^/:?#]+)')), 'endpoint:' || id)"
+
+
+class HarvestScheduler(object):
+    """
+    Harvest many endpoints at once from one process, one thread per endpoint.
+
+    Endpoints furthest behind (oldest most_recent_year_harvested) go first. Only one
+    endpoint per OAI server host is harvested at a time, across all processes, so we
+    never hammer a server that hosts several endpoints. Backoff after errors is the
+    retry_at / retry_interval state that Endpoint.harvest already keeps.
+    """
+    def __init__(self, workers, idle_sleep_seconds=5):
+        self.workers = workers
+        self.idle_sleep_seconds = idle_sleep_seconds
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.running = {}
+
+    def claim_endpoints(self, limit):
+        claim_query = text(f"""
+            WITH candidates AS (
+                SELECT id, {ENDPOINT_HOST_EXPRESSION} AS host, most_recent_year_harvested
+                FROM endpoint
+                WHERE {READY_ENDPOINTS_CONDITION}
+                FOR UPDATE SKIP LOCKED
+            ),
+            busy_hosts AS (
+                SELECT DISTINCT {ENDPOINT_HOST_EXPRESSION} AS host
+                FROM endpoint
+                WHERE last_harvest_started >= now() at time zone 'utc' - interval '8 hours'
+                AND last_harvest_finished is null
+            ),
+            one_per_host AS (
+                SELECT DISTINCT ON (host) id, most_recent_year_harvested
+                FROM candidates
+                WHERE host NOT IN (SELECT host FROM busy_hosts)
+                ORDER BY host, most_recent_year_harvested NULLS FIRST, random()
+            ),
+            picked AS (
+                SELECT id FROM one_per_host
+                ORDER BY most_recent_year_harvested NULLS FIRST
+                LIMIT :limit
+            )
+            UPDATE endpoint queue_rows_to_update
+            SET last_harvest_started = now() at time zone 'utc', last_harvest_finished = null
+            FROM picked
+            WHERE picked.id = queue_rows_to_update.id
+            RETURNING picked.id;
+        """).bindparams(limit=limit)
+
+        return [row[0] for row in db.engine.execute(claim_query.execution_options(autocommit=True)).fetchall()]
+
+    def harvest_endpoint(self, endpoint_id):
+        # db.session is scoped per thread, so each harvest has its own session
+        start_time = time()
+        try:
+            my_endpoint = Endpoint.query.get(endpoint_id)
+            logger.info(f"starting harvest of {my_endpoint}")
+            my_endpoint.harvest()
+            if not safe_commit(db):
+                logger.info(f"COMMIT fail for {my_endpoint}")
+            logger.info(f"finished harvest of {my_endpoint}, took {elapsed(start_time, 2)} seconds")
+        except Exception as e:
+            # don't leave the endpoint claimed, or its whole host looks busy for 8 hours
+            logger.exception(f"harvest of {endpoint_id} failed: {e}")
+            db.session.rollback()
+            my_endpoint = Endpoint.query.get(endpoint_id)
+            if my_endpoint:
+                my_endpoint.error = "error in harvest: {} {}".format(e.__class__.__name__, str(e))
+                my_endpoint.schedule_retry()
+                if not safe_commit(db):
+                    logger.info(f"COMMIT fail for {my_endpoint}")
+            raise
+        finally:
+            db.session.remove()
+
+    def fill_free_workers(self):
+        free_workers = self.workers - len(self.running)
+        if free_workers <= 0:
+            return 0
+
+        endpoint_ids = self.claim_endpoints(free_workers)
+        for endpoint_id in endpoint_ids:
+            self.running[self.executor.submit(self.harvest_endpoint, endpoint_id)] = endpoint_id
+
+        return len(endpoint_ids)
+
+    def run(self):
+        while True:
+            num_claimed = self.fill_free_workers()
+
+            if not self.running:
+                logger.info(f"no endpoints ready, sleeping for {self.idle_sleep_seconds} seconds, then going again")
+                sleep(self.idle_sleep_seconds)
+                continue
+
+            if num_claimed:
+                logger.info(f"started {num_claimed} harvests, {len(self.running)} running")
+
+            done, pending = wait(self.running, timeout=self.idle_sleep_seconds, return_when=FIRST_COMPLETED)
+            for future in done:
+                endpoint_id = self.running.pop(future)
+                if future.exception():
+                    logger.error(f"harvest of {endpoint_id} failed: {future.exception()}")
+
+
 class DbQueueRepo(DbQueue):
     def table_name(self, job_type):
         table_name = "endpoint"
@@ -71,32 +206,15 @@ class DbQueueRepo(DbQueue):
 
         limit = 1 # just do one repo at a time
 
+        if not single_obj_id and kwargs.get("scheduler"):
+            HarvestScheduler(workers=kwargs.get("workers") or 1).run()
+            return
+
         if not single_obj_id:
             text_query_pattern = """WITH picked_from_queue AS (
                         SELECT id
                         FROM   {queue_table}
-                        WHERE (
-                            most_recent_year_harvested is null
-                            or (
-                                most_recent_year_harvested + interval '1 day'
-                                < now() at time zone 'utc'
-                                - interval '1 day' -- wait until most_recent_year_harvested is over 1 day ago
-                                - rand * interval '18 hours' -- plus an offset so we don't run everything at midnight
-                            )
-                        )
-                        and (
-                            last_harvest_started is null
-                            or last_harvest_started < now() at time zone 'utc' - interval '8 hours'
-                        )
-                        and (
-                            last_harvest_finished is null
-                            or last_harvest_finished < now() at time zone 'utc' - interval '2 minutes'
-                        )
-                        and (
-                            retry_at <= now()
-                            or retry_at is null
-                        )
-                        and ready_to_run
+                        WHERE {ready_endpoints_condition}
                         ORDER BY random() -- not rand, because want it to be different every time
                     LIMIT  {chunk}
                     FOR UPDATE SKIP LOCKED
@@ -108,7 +226,8 @@ class DbQueueRepo(DbQueue):
                 RETURNING picked_from_queue.*;"""
             text_query = text_query_pattern.format(
                 chunk=chunk,
-                queue_table=queue_table
+                queue_table=queue_table,
+                ready_endpoints_condition=READY_ENDPOINTS_CONDITION
             )
 
         index = 0
@@ -195,9 +314,14 @@ if __name__ == "__main__":
 
     parser.add_argument('--add', default=False, action='store_true', help="how many to take off db at once")
 
+    parser.add_argument('--workers', nargs="?", default=1, type=int, help="run the method on this many objects at once, in threads")
+    parser.add_argument('--scheduler', default=False, action='store_true', help="with --run, harvest up to --workers endpoints at once, one per host")
+    parser.add_argument('--object-timeout', nargs="?", default=None, type=int, help="with --workers, stop waiting for an object after this many seconds. its thread keeps running, and the process can't exit until it finishes")
+
     parsed_args = parser.parse_args()
 
     job_type = "normal"  #should be an object attribute
     my_queue = DbQueueRepo()
+    my_queue.parsed_vars = vars(parsed_args)
     my_queue.run_right_thing(parsed_args, job_type)
     print("finished")
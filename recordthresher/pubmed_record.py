@@ -10,6 +10,7 @@ from lxml import etree
 
 from app import db
 from app import logger
+from issn_l_map import issn_l_mapping
 from journal import Journal
 from recordthresher.pubmed import PubmedAffiliation, PubmedArticleType, PubmedAuthor
 from recordthresher.pubmed import PubmedReference, PubmedMesh, PubmedWork
@@ -233,9 +234,8 @@ class PubmedRecord(Record):
                 if title_text := title_element.text and title_element.text.strip():
                     record.venue_name = title_text
 
-        from pub import IssnlLookup
         for lookup_issn in lookup_issns:
-            if lookup := IssnlLookup.query.get(lookup_issn):
+            if lookup := issn_l_mapping(lookup_issn):
                 # record.journal_id = lookup.journal_id
                 record.journal_issn_l = lookup.issn_l
                 break
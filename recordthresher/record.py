@@ -9,6 +9,7 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm.attributes import flag_modified
 
 from app import db
+from util import json_equal_ignoring_keys
 
 
 class Record(db.Model):
@@ -112,32 +113,11 @@ class Record(db.Model):
     def set_published_date(self, published_date):
         self._set_datetime('published_date', published_date)
 
-    @staticmethod
-    def remove_json_keys(obj, keys):
-        obj_copy = json.loads(json.dumps(obj))
-
-        if isinstance(obj_copy, dict):
-            for key in keys:
-                try:
-                    del obj_copy[key]
-                except KeyError:
-                    pass
-
-            obj_keys = obj_copy.keys()
-            for obj_key in obj_keys:
-                if isinstance(obj_copy[obj_key], dict) or isinstance(obj_copy[obj_key], list):
-                    obj_copy[obj_key] = Record.remove_json_keys(obj_copy[obj_key], keys)
-        elif isinstance(obj_copy, list):
-            for i in range(0, len(obj_copy)):
-                if isinstance(obj_copy[i], dict) or isinstance(obj_copy[i], list):
-                    obj_copy[i] = Record.remove_json_keys(obj_copy[i], keys)
-
-        return obj_copy
-
     def set_jsonb(self, name, value):
         if name not in self._original_json:
             original_value = getattr(self, name)
-            self._original_json[name] = json.dumps(original_value, sort_keys=True, indent=2)
+            # serialized so later in-place changes to the value can't touch the snapshot
+            self._original_json[name] = json.dumps(original_value)
 
         setattr(self, name, value)
 
@@ -148,14 +128,7 @@ class Record(db.Model):
             original_value = json.loads(self._original_json[attribute_name])
             current_value = getattr(self, attribute_name)
 
-            if attribute_name in ignore_keys:
-                original_value = Record.remove_json_keys(original_value, ignore_keys[attribute_name])
-                current_value = Record.remove_json_keys(current_value, ignore_keys[attribute_name])
-
-            original_json = json.dumps(original_value, sort_keys=True, indent=2)
-            current_json = json.dumps(current_value, sort_keys=True, indent=2)
-
-            if original_json != current_json:
+            if not json_equal_ignoring_keys(original_value, current_value, ignore_keys.get(attribute_name, [])):
                 flag_modified(self, attribute_name)
 
 
@@ -0,0 +1,229 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import Counter, namedtuple
+from urllib.parse import urlsplit, urlunsplit
+
+import boto3
+import requests
+from botocore.exceptions import ClientError
+
+from app import logger
+
+# off: always fetch. on: serve fresh cached responses, fetch and store the rest.
+# record: always fetch and store. replay: only serve from the cache, never fetch.
+CACHE_MODE_OFF = 'off'
+CACHE_MODE_ON = 'on'
+CACHE_MODE_RECORD = 'record'
+CACHE_MODE_REPLAY = 'replay'
+CACHE_MODES = [CACHE_MODE_OFF, CACHE_MODE_ON, CACHE_MODE_RECORD, CACHE_MODE_REPLAY]
+
+HTTP_RESPONSE_CACHE_MODE = os.getenv('HTTP_RESPONSE_CACHE_MODE', CACHE_MODE_OFF)
+if HTTP_RESPONSE_CACHE_MODE not in CACHE_MODES:
+    # an unknown mode would otherwise act like record and keep paying for every fetch
+    raise ValueError(f'HTTP_RESPONSE_CACHE_MODE must be one of {CACHE_MODES}, not {HTTP_RESPONSE_CACHE_MODE!r}')
+HTTP_RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('HTTP_RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+HTTP_RESPONSE_CACHE_DIR = os.getenv('HTTP_RESPONSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'http_response_cache'))
+# if set, entries and blobs go to this bucket instead of the local dir
+HTTP_RESPONSE_CACHE_S3_BUCKET = os.getenv('HTTP_RESPONSE_CACHE_S3_BUCKET')
+HTTP_RESPONSE_CACHE_S3_PREFIX = 'http-response-cache'
+
+FetchedResponse = namedtuple('FetchedResponse', ['status_code', 'url', 'headers', 'content'])
+
+_store = None
+_store_lock = threading.Lock()
+_stats = Counter()
+
+
+class ResponseCacheMiss(requests.exceptions.RequestException):
+    pass
+
+
+class LocalDiskStore(object):
+    """Entries as json files and bodies as blobs named by their sha256, under root."""
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, kind, name):
+        return os.path.join(self.root, kind, name[0:2], name)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so concurrent readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_entry(self, key):
+        data = self._read(self._path('entries', key))
+        return data and json.loads(data)
+
+    def write_entry(self, key, entry):
+        self._write(self._path('entries', key), json.dumps(entry).encode('utf-8'))
+
+    def read_blob(self, digest):
+        return self._read(self._path('blobs', digest))
+
+    def write_blob(self, digest, content):
+        path = self._path('blobs', digest)
+        if not os.path.exists(path):
+            self._write(path, content)
+
+
+class S3Store(object):
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3')
+
+    def _key(self, kind, name):
+        return f'{self.prefix}/{kind}/{name[0:2]}/{name}'
+
+    def _read(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def read_entry(self, key):
+        data = self._read(self._key('entries', key))
+        return data and json.loads(data)
+
+    def write_entry(self, key, entry):
+        self.client.put_object(Bucket=self.bucket, Key=self._key('entries', key), Body=json.dumps(entry).encode('utf-8'))
+
+    def read_blob(self, digest):
+        return self._read(self._key('blobs', digest))
+
+    def write_blob(self, digest, content):
+        # blobs are named by their content, so an existing one is already right
+        self.client.put_object(Bucket=self.bucket, Key=self._key('blobs', digest), Body=content)
+
+
+def get_store():
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            if HTTP_RESPONSE_CACHE_S3_BUCKET:
+                _store = S3Store(HTTP_RESPONSE_CACHE_S3_BUCKET, HTTP_RESPONSE_CACHE_S3_PREFIX)
+            else:
+                _store = LocalDiskStore(HTTP_RESPONSE_CACHE_DIR)
+        return _store
+
+
+def set_store(store):
+    """Use another store, e.g. a LocalDiskStore over a directory of recorded responses for a replay run."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def normalize_cache_url(url):
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+def cache_key(url, params):
+    # the same url fetched with a different zyte policy can come back different, so it's part of the key
+    policy = json.dumps({k: v for k, v in (params or {}).items() if k != 'url'}, sort_keys=True)
+    return hashlib.sha256(f'{normalize_cache_url(url)}\n{policy}'.encode('utf-8')).hexdigest()
+
+
+def _read_cached(key, mode):
+    store = get_store()
+    entry = store.read_entry(key)
+    if not entry:
+        return None
+
+    fetched_at = datetime.datetime.fromisoformat(entry['fetched_at'])
+    is_fresh = datetime.datetime.utcnow() - fetched_at < datetime.timedelta(seconds=HTTP_RESPONSE_CACHE_TTL_SECONDS)
+    if mode != CACHE_MODE_REPLAY and not is_fresh:
+        return None
+
+    content = store.read_blob(entry['content_sha256'])
+    if content is None:
+        return None
+
+    return FetchedResponse(
+        status_code=entry['status_code'],
+        url=entry['url'],
+        headers=entry['headers'],
+        content=content
+    )
+
+
+def _write_cached(key, requested_url, params, fetched):
+    store = get_store()
+    content_sha256 = hashlib.sha256(fetched.content).hexdigest()
+    store.write_blob(content_sha256, fetched.content)
+    store.write_entry(key, {
+        'requested_url': requested_url,
+        'params': params,
+        'status_code': fetched.status_code,
+        'url': fetched.url,
+        'headers': fetched.headers,
+        'content_sha256': content_sha256,
+        'fetched_at': datetime.datetime.utcnow().isoformat(),
+    })
+
+
+def cached_fetch(url, params, fetch, mode=None):
+    """
+    Return the FetchedResponse for url fetched with these zyte params, calling fetch() to get it
+    unless the cache mode lets us use a stored one. Only responses under 400 are stored.
+    """
+    mode = mode or HTTP_RESPONSE_CACHE_MODE
+    if mode not in CACHE_MODES:
+        raise ValueError(f'unknown response cache mode {mode!r}, expected one of {CACHE_MODES}')
+
+    if mode == CACHE_MODE_OFF:
+        return fetch()
+
+    key = cache_key(url, params)
+
+    if mode in (CACHE_MODE_ON, CACHE_MODE_REPLAY):
+        try:
+            cached = _read_cached(key, mode)
+        except Exception as e:
+            if mode == CACHE_MODE_REPLAY:
+                raise
+            logger.exception(f'error reading cached response for {url}: {e}')
+            cached = None
+
+        if cached:
+            _stats['hit'] += 1
+            logger.info(f'using cached response for {url}')
+            return cached
+
+        if mode == CACHE_MODE_REPLAY:
+            _stats['replay_miss'] += 1
+            raise ResponseCacheMiss(f'no cached response for {url}')
+
+    _stats['miss'] += 1
+    fetched = fetch()
+
+    if fetched.status_code is not None and fetched.status_code < 400:
+        try:
+            _write_cached(key, url, params, fetched)
+        except Exception as e:
+            logger.exception(f'error caching response for {url}: {e}')
+
+    return fetched
+
+
+def cache_stats():
+    return dict(_stats)
@@ -2,7 +2,7 @@
 
 for (( i=1; i<=$CROSSREF_SNAPSHOT_SYNC_WORKERS_PER_DYNO; i++ ))
 do
-  COMMAND="python crossref_snapshot_sync.py"
+  COMMAND="python crossref_snapshot_sync.py --partitions $CROSSREF_SNAPSHOT_SYNC_WORKERS_PER_DYNO --partition $((i-1))"
   echo $COMMAND
   $COMMAND &
 done
@@ -0,0 +1,158 @@
+import datetime
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import mock
+from nose.tools import assert_equals
+from nose.tools import assert_is_none
+from nose.tools import assert_is_not_none
+from nose.tools import assert_true
+
+from endpoint import Endpoint
+from queue_repo import HarvestScheduler
+
+# run with a stub OAI-PMH server on localhost, no network or database needed:
+# nosetests test/test_harvest_scheduler.py
+
+LIST_RECORDS_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2024-01-01T00:00:00Z</responseDate>
+  <request verb="ListRecords" metadataPrefix="oai_dc">http://localhost/oai</request>
+  <ListRecords>
+    <record>
+      <header>
+        <identifier>oai:repo.example.com:1</identifier>
+        <datestamp>2000-01-02</datestamp>
+      </header>
+      <metadata>
+        <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+          <dc:title>The first stub record</dc:title>
+          <dc:creator>Smith, Alice</dc:creator>
+          <dc:identifier>http://repo.example.com/record/1</dc:identifier>
+        </oai_dc:dc>
+      </metadata>
+    </record>
+    <record>
+      <header>
+        <identifier>oai:repo.example.com:2</identifier>
+        <datestamp>2000-01-03</datestamp>
+      </header>
+      <metadata>
+        <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">
+          <dc:title>The second stub record</dc:title>
+          <dc:creator>Jones, Bob</dc:creator>
+          <dc:identifier>http://repo.example.com/record/2</dc:identifier>
+        </oai_dc:dc>
+      </metadata>
+    </record>
+  </ListRecords>
+</OAI-PMH>
+"""
+
+
+class StubOaiHandler(BaseHTTPRequestHandler):
+    list_records_status = 200
+
+    def do_GET(self):
+        verb = parse_qs(urlparse(self.path).query).get('verb', [None])[0]
+        status = self.list_records_status if verb == 'ListRecords' else 400
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(LIST_RECORDS_RESPONSE.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHarvestAgainstStubServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), StubOaiHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.pmh_url = 'http://127.0.0.1:{}/oai'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubOaiHandler.list_records_status = 200
+
+    def make_endpoint(self):
+        return Endpoint(
+            id='stubendpoint',
+            pmh_url=self.pmh_url,
+            metadata_prefix='oai_dc',
+            harvest_identify_response='SUCCESS!',
+            harvest_test_recent_dates='stub',
+            last_harvest_started=datetime.datetime.utcnow(),
+            retry_interval=datetime.timedelta(minutes=5),
+        )
+
+    @mock.patch('endpoint.safe_commit')
+    @mock.patch('pmh_record.save_pmh_records')
+    def test_harvest_saves_list_records(self, save_pmh_records, safe_commit):
+        my_endpoint = self.make_endpoint()
+        my_endpoint.harvest()
+
+        assert_is_none(my_endpoint.error)
+        assert_equals(save_pmh_records.call_count, 1)
+
+        saved_records = save_pmh_records.call_args[0][0]
+        assert_equals([r.id for r in saved_records], ['stubendpoint:oai:repo.example.com:1', 'stubendpoint:oai:repo.example.com:2'])
+        assert_equals([r.title for r in saved_records], ['The first stub record', 'The second stub record'])
+        assert_equals(saved_records[0].urls, ['http://repo.example.com/record/1'])
+
+        assert_is_none(my_endpoint.last_harvest_started)
+        assert_is_not_none(my_endpoint.last_harvest_finished)
+        assert_is_none(my_endpoint.retry_at)
+
+    @mock.patch('endpoint.safe_commit')
+    @mock.patch('pmh_record.save_pmh_records')
+    def test_harvest_backs_off_after_server_error(self, save_pmh_records, safe_commit):
+        StubOaiHandler.list_records_status = 500
+
+        my_endpoint = self.make_endpoint()
+        my_endpoint.harvest()
+
+        assert_true(my_endpoint.error.startswith('error in get_pmh_input_record'))
+        assert_equals(save_pmh_records.call_count, 0)
+        assert_is_none(my_endpoint.last_harvest_started)
+        assert_is_not_none(my_endpoint.retry_at)
+        assert_equals(my_endpoint.retry_interval, datetime.timedelta(minutes=10))
+
+    @mock.patch('queue_repo.safe_commit')
+    @mock.patch('queue_repo.db')
+    @mock.patch('queue_repo.Endpoint')
+    @mock.patch('endpoint.safe_commit')
+    @mock.patch('pmh_record.save_pmh_records')
+    def test_scheduler_releases_endpoint_when_harvest_raises(
+            self, save_pmh_records, endpoint_safe_commit, queue_endpoint, queue_db, queue_safe_commit):
+        save_pmh_records.side_effect = RuntimeError('database went away')
+
+        my_endpoint = self.make_endpoint()
+        queue_endpoint.query.get.return_value = my_endpoint
+
+        scheduler = HarvestScheduler(workers=1)
+        with self.assertRaises(RuntimeError):
+            scheduler.harvest_endpoint(my_endpoint.id)
+
+        queue_db.session.rollback.assert_called_once_with()
+        queue_db.session.remove.assert_called_once_with()
+        assert_equals(queue_safe_commit.call_count, 1)
+
+        assert_true('database went away' in my_endpoint.error)
+        assert_is_none(my_endpoint.last_harvest_started)
+        assert_is_not_none(my_endpoint.retry_at)
+        assert_equals(my_endpoint.retry_interval, datetime.timedelta(minutes=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import copy
+import json
+import re
+import unittest
+
+from nose.tools import assert_equals
+
+from util import json_equal_ignoring_keys
+
+# Pub.ignored_keys_for_internal_diff and Pub.ignored_top_level_keys_for_external_diff
+IGNORED_KEYS = ["updated", "last_changed_date", "x_reported_noncompliant_copies", "x_error", "data_standard"]
+IGNORED_TOP_LEVEL_KEYS = ["z_authors", "oa_locations_embargoed"]
+
+
+def pretty_printed_json_changed(new, old, ignored_keys, ignored_top_level_keys):
+    # how Pub.has_changed used to decide: delete top-level keys, then regex keys out of sorted, indented json
+    new = copy.deepcopy(new)
+    old = copy.deepcopy(old)
+    for key in ignored_top_level_keys:
+        new.pop(key, None)
+        old.pop(key, None)
+
+    new_json = json.dumps(new, sort_keys=True, indent=2)
+    old_json = json.dumps(old, sort_keys=True, indent=2)
+
+    for key in ignored_keys:
+        for pattern in [r'"{}":\s*".+?",?\s*', r'"{}":\s*\[\],?\s*', r'"{}":\s*.+?,\s*']:
+            new_json = re.sub(pattern.format(key), '', new_json)
+            old_json = re.sub(pattern.format(key), '', old_json)
+
+    return new_json != old_json
+
+
+class TestJsonEqualIgnoringKeys(unittest.TestCase):
+    response = {
+        "doi": "10.1234/abc",
+        "data_standard": 2,
+        "is_oa": True,
+        "oa_locations": [
+            {"url": "http://a.example.com", "updated": "2020-01-01T00:00:00", "version": "publishedVersion"},
+            {"url": "http://b.example.com", "updated": "2020-01-02T00:00:00", "version": "acceptedVersion"},
+        ],
+        "oa_locations_embargoed": [{"url": "http://c.example.com", "updated": "2020-01-03T00:00:00"}],
+        "updated": "2020-01-04T00:00:00",
+        "year": 2020,
+        "z_authors": [{"family": "Smith", "given": "A"}],
+    }
+
+    def assert_changed(self, new, expected, ignored_top_level_keys=IGNORED_TOP_LEVEL_KEYS):
+        changed = not json_equal_ignoring_keys(new, self.response, IGNORED_KEYS, ignored_top_level_keys)
+        assert_equals(changed, expected)
+        assert_equals(changed, pretty_printed_json_changed(new, self.response, IGNORED_KEYS, ignored_top_level_keys))
+
+    def modified(self, change):
+        new = copy.deepcopy(self.response)
+        change(new)
+        return new
+
+    def test_unchanged(self):
+        self.assert_changed(copy.deepcopy(self.response), False)
+        self.assert_changed(dict(reversed(list(self.response.items()))), False)
+
+    def test_ignored_keys_at_any_depth(self):
+        def change(r):
+            r["updated"] = "2021-01-01T00:00:00"
+            r["data_standard"] = 1
+            r["oa_locations"][1]["updated"] = "2021-01-01T00:00:00"
+
+        self.assert_changed(self.modified(change), False)
+
+    def test_top_level_keys_ignored_only_at_top(self):
+        def change_top(r):
+            r["z_authors"] = [{"family": "Jones"}]
+            r["oa_locations_embargoed"] = []
+
+        def change_nested(r):
+            r["oa_locations"][0]["z_authors"] = [{"family": "Jones"}]
+
+        self.assert_changed(self.modified(change_top), False)
+        self.assert_changed(self.modified(change_top), True, ignored_top_level_keys=[])
+        self.assert_changed(self.modified(change_nested), True)
+
+    def test_list_order(self):
+        self.assert_changed(self.modified(lambda r: r["oa_locations"].reverse()), True)
+
+    def test_numbers_and_types(self):
+        def set_year(value):
+            return self.modified(lambda r: r.update(year=value))
+
+        self.assert_changed(set_year(2020.0), True)
+        self.assert_changed(set_year("2020"), True)
+        self.assert_changed(set_year(2021), True)
+        self.assert_changed(set_year(None), True)
+        self.assert_changed(self.modified(lambda r: r.update(is_oa=1)), True)
+        self.assert_changed(self.modified(lambda r: r.pop("year")), True)
+
+    def test_nested_value_changed(self):
+        self.assert_changed(self.modified(lambda r: r["oa_locations"][0].update(version="submittedVersion")), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
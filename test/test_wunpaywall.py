@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from nose.tools import assert_equals
+
+from wunpaywall import project_json_fields
+
+
+def full_decode_projection(json_text, fields):
+    response = json.loads(json_text)
+    return {f: response[f] for f in fields if f in response}
+
+
+class TestProjectJsonFields(unittest.TestCase):
+    response = {
+        "doi": "10.1234/abc",
+        "title": "A title with } unbalanced {{ braces, \"quotes\" and a \\ backslash: \"updated\": 1",
+        "oa_locations": [
+            {"updated": "nested", "url": "http://example.com/{", "evidence": {"updated": 2}},
+        ],
+        "z_authors": [{"family": "]", "given": "["}],
+        "is_oa": True,
+        "updated": "2024-01-01T00:00:00",
+        "year": None,
+        "empty": "",
+    }
+
+    def assert_matches_full_decode(self, json_text, fields):
+        assert_equals(project_json_fields(json_text, fields), full_decode_projection(json_text, fields))
+
+    def test_braces_and_quotes_in_strings(self):
+        for separators in [(',', ':'), (', ', ': ')]:
+            json_text = json.dumps(self.response, separators=separators)
+            self.assert_matches_full_decode(json_text, ["updated", "is_oa", "title", "year", "empty"])
+
+        self.assert_matches_full_decode(json.dumps(self.response, indent=2), ["updated", "z_authors"])
+
+    def test_nested_key_with_requested_name(self):
+        json_text = json.dumps(self.response)
+        assert_equals(project_json_fields(json_text, ["updated"]), {"updated": "2024-01-01T00:00:00"})
+
+    def test_unbalanced_brace_before_nested_key(self):
+        # counting raw braces, the stray } made the nested updated look like the only top-level one
+        json_text = json.dumps({
+            "title": "a } b",
+            "oa_locations": [{"updated": "nested"}],
+            "updated": "top",
+        })
+        assert_equals(project_json_fields(json_text, ["updated"]), {"updated": "top"})
+
+    def test_escaped_keys(self):
+        json_text = '{"oa_locations": [{"updated": 1}], "\\u0075pdated": "escaped", "a\\"b": [1, 2]}'
+        assert_equals(project_json_fields(json_text, ["updated", 'a"b']), {"updated": "escaped", 'a"b': [1, 2]})
+        self.assert_matches_full_decode(json_text, ["updated", 'a"b'])
+
+    def test_missing_fields(self):
+        json_text = json.dumps(self.response)
+        assert_equals(project_json_fields(json_text, ["missing"]), {})
+        self.assert_matches_full_decode(json_text, ["missing", "doi", "also_missing"])
+
+    def test_field_order_follows_request(self):
+        json_text = json.dumps(self.response)
+        assert_equals(list(project_json_fields(json_text, ["updated", "doi"])), ["updated", "doi"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import logging
 import math
 import os
 import re
+import threading
 import time
 import unicodedata
 import uuid
@@ -411,6 +412,51 @@ def elapsed(since, round_places=2):
     return round(time.time() - since, round_places)
 
 
+class TokenBucket(object):
+    """
+    Allows `rate` calls per second on average, and up to `capacity` back to back after a quiet spell.
+    Safe to share between threads.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def wait_time(self):
+        """Seconds until a token is available, without taking one."""
+        with self.lock:
+            self._refill()
+            return max(0, (1 - self.tokens) / self.rate)
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def take(self):
+        """Take a token and return 0, or return the seconds until one is available, in one step."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while not self.try_acquire():
+            time.sleep(self.wait_time())
+
+
 def truncate(str, max=100):
     if len(str) > max:
         return str[0:max] + "..."
@@ -654,6 +700,46 @@ def delete_key_from_dict(dictionary, key):
                     yield result
 
 
+def json_equal_ignoring_keys(a, b, ignored_keys=(), ignored_top_level_keys=()):
+    """
+    Compare two json-like values without copying or serializing them.
+    ignored_keys are skipped in objects at any depth, ignored_top_level_keys only in the outermost object.
+    """
+    ignored_keys = frozenset(ignored_keys)
+    return _json_equal(a, b, ignored_keys, ignored_keys | frozenset(ignored_top_level_keys))
+
+
+def _json_equal(a, b, ignored_keys, skipped_keys):
+    if isinstance(a, dict):
+        if not isinstance(b, dict):
+            return False
+
+        a_keys = a.keys() - skipped_keys
+        if a_keys != b.keys() - skipped_keys:
+            return False
+
+        return all(_json_equal(a[k], b[k], ignored_keys, ignored_keys) for k in a_keys)
+
+    if isinstance(a, (list, tuple)):
+        if not isinstance(b, (list, tuple)) or len(a) != len(b):
+            return False
+
+        return all(_json_equal(x, y, ignored_keys, ignored_keys) for x, y in zip(a, b))
+
+    if isinstance(b, (dict, list, tuple)):
+        return False
+
+    # true and 1 are different json
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+
+    # so are 1 and 1.0, which serialize differently
+    if isinstance(a, float) != isinstance(b, float):
+        return False
+
+    return a == b
+
+
 def restart_dynos(app_name, dyno_prefix):
     heroku_conn = heroku3.from_key(os.getenv('HEROKU_API_KEY'))
     app = heroku_conn.apps()[app_name]
@@ -737,6 +823,25 @@ def make_do_redis_client():
     return Redis.from_url(os.getenv('REDIS_DO_URL'))
 
 
+_redis_client = None
+_redis_init = False
+
+
+def get_redis_client():
+    """The REDIS_URL client shared by the api rate limits and the api response cache, or None."""
+    global _redis_client, _redis_init
+
+    if not _redis_init:
+        try:
+            _redis_client = Redis.from_url(os.environ.get("REDIS_URL"), max_connections=1)
+        except Exception as e:
+            logging.exception(f'failed creating redis client: {e}')
+
+        _redis_init = True
+
+    return _redis_client
+
+
 def enqueue_slow_queue(dois_chunk: List[str], conn):
     stmnt = text(
         '''INSERT INTO queue.run_once_work_add_most_things(work_id)
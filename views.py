@@ -1,7 +1,9 @@
 import json
 import os
 import re
+import shutil
 import sys
+import tempfile
 from collections import defaultdict, OrderedDict
 from datetime import date, datetime, timedelta
 from threading import Thread
@@ -10,7 +12,6 @@ from time import time
 import boto
 from botocore.exceptions import ClientError
 import boto3
-import redis
 import unicodecsv
 from flask import stream_with_context
 from flask import Response
@@ -36,6 +37,8 @@ import repository
 from app import app
 from app import db
 from app import logger
+from app import openalex_engine
+from api_response_cache import cache_stats, get_doi_response, make_cached_response
 from changefile import DAILY_FEED, WEEKLY_FEED
 from changefile import get_changefile_dicts
 from changefile import get_file_from_bucket, generate_presigned_download_url
@@ -61,9 +64,10 @@ from static_api_response import StaticAPIResponse
 from util import NoDoiException
 from util import clean_doi, normalize_doi
 from util import elapsed
+from util import get_redis_client
 from util import restart_dynos
 from util import str_to_bool
-from wunpaywall import WunpaywallPub, WunpaywallFeed
+from wunpaywall import WunpaywallPub, WunpaywallFeed, project_json_fields
 
 app.config['JSON_SORT_KEYS'] = False
 
@@ -183,14 +187,18 @@ def after_request_stuff(resp):
     return resp
 
 
+def is_admin_request():
+    admin_key = request.args.get("admin_key", None)
+    admin_key_env = os.environ.get("ADMIN_KEY", None)
+    return admin_key and admin_key_env and admin_key == admin_key_env
+
+
 @app.before_request
 def stuff_before_request():
     # Check for admin key to bypass rate limiting
-    admin_key = request.args.get("admin_key", None)
-    admin_key_env = os.environ.get("ADMIN_KEY", None)
-    is_admin = admin_key and admin_key_env and admin_key == admin_key_env
+    is_admin = is_admin_request()
     
-    if request.endpoint in ["get_doi_endpoint_v2_new", "get_doi_endpoint", "get_search_query"]:
+    if request.endpoint in ["get_doi_endpoint_v2_new", "get_doi_endpoint", "get_search_query", "batch_doi_lookup"]:
         email = request.args.get("email", None)
         api_key = request.args.get("api_key", None)
 
@@ -254,7 +262,8 @@ def stuff_before_request():
                             "Get in touch with us at support@unpaywall.org to see how we can help."
                         ))
 
-                if email.lower().strip() == "unpaywall@impactstory.org":
+                # batch lookups charge this same bucket for every doi they ask for
+                if email.lower().strip() == "unpaywall@impactstory.org" and request.endpoint != "batch_doi_lookup":
                     try:
                         too_many_requests = too_many_requests_per_second(ip)
                     except Exception as e:
@@ -327,7 +336,7 @@ def too_many_emails_per_ip(ip, email):
     return emails_per_ip > max_emails_per_ip
 
 
-def too_many_requests_per_second(ip):
+def too_many_requests_per_second(ip, cost=1):
     redis_client = get_redis_client()
 
     if not redis_client:
@@ -341,29 +350,12 @@ def too_many_requests_per_second(ip):
     if redis_client.setnx(ip, limit):
         redis_client.expire(ip, int(period.total_seconds()))
     bucket_val = redis_client.get(ip)
-    if bucket_val and int(bucket_val) > 0:
-        redis_client.decrby(ip, 1)
+    if bucket_val and int(bucket_val) >= cost:
+        redis_client.decrby(ip, cost)
         return False
     return True
 
 
-_redis_client = None
-_redis_init = False
-
-
-def get_redis_client():
-    global _redis_client, _redis_init
-
-    if not _redis_init:
-        try:
-            _redis_client = redis.from_url(os.environ.get("REDIS_URL"), max_connections=1)
-        except Exception as e:
-            logger.exception(f'failed creating redis client: {e}')
-
-        _redis_init = True
-
-    return _redis_client
-
 # convenience function because we do this in multiple places
 def get_multiple_pubs_response():
     is_person_who_is_making_too_many_requests = False
@@ -744,89 +736,206 @@ def get_doi_endpoint_v2_old(doi):
     return current_app.response_class(json.dumps(answer, indent=indent), mimetype='application/json')
 
 
+def load_wunpaywall_response(doi):
+    wunpaywall_pub = WunpaywallPub.query.get(doi)
+    if not wunpaywall_pub:
+        return None
+    return make_cached_response(
+        wunpaywall_pub.to_json_bytes(validate=str_to_bool(os.getenv("VALIDATE_WUNPAYWALL_JSON", "False"))),
+        wunpaywall_pub.to_dict_fields(["updated"]).get("updated")
+    )
+
+
 @app.route("/v2/<path:doi>", methods=["GET"])
 def get_doi_endpoint_v2_new(doi):
     doi = normalize_doi(doi, return_none_if_error=True)
-    wunpaywall_pub = WunpaywallPub.query.get(doi)
-    if not wunpaywall_pub:
+    cached_response = doi and get_doi_response(doi, load_wunpaywall_response)
+    if not cached_response:
         abort(404)
-    return jsonify(wunpaywall_pub.to_dict())
 
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    if fields:
+        resp = jsonify(project_json_fields(cached_response.body.decode("utf-8"), fields))
+        resp.add_etag()
+        return resp.make_conditional(request)
 
-@app.route("/v2/dois", methods=["POST"])
-def simple_query_tool():
+    resp = current_app.response_class(cached_response.body, mimetype='application/json')
+    resp.set_etag(cached_response.etag)
+    if cached_response.last_modified:
+        resp.last_modified = cached_response.last_modified
+    return resp.make_conditional(request)
+
+
+@app.route("/debug/doi-response-cache", methods=["GET"])
+def get_doi_response_cache_stats():
+    return jsonify({"results": cache_stats()})
+
+
+MAX_BATCH_LOOKUP_DOIS = 1000
+
+
+@app.route("/v2/dois/lookup", methods=["POST"])
+def batch_doi_lookup():
     body = request.json
-    dirty_dois_list = [d for d in body["dois"] if d]
+    if not isinstance(body, dict):
+        abort_json(422, "request body must be a json object like {\"dois\": [...]}")
 
-    # look up normalized dois
-    normalized_dois = [n for n in [normalize_doi(d, return_none_if_error=True) for d in dirty_dois_list] if n]
-    q = db.session.query(pub.Pub.response_jsonb).filter(pub.Pub.id.in_(set(normalized_dois)))
-    normalized_doi_responses = dict([(row[0]['doi'], row[0]) for row in q.all() if row[0]])
+    dirty_dois_list = body.get("dois") or []
 
-    # look up cleaned dois
-    cleaned_dois = [c for c in [clean_doi(d, return_none_if_error=True) for d in dirty_dois_list] if c]
-    q = db.session.query(pub.Pub.response_jsonb).filter(pub.Pub.id.in_(set(cleaned_dois)))
-    cleaned_doi_responses = dict([(row[0]['doi'], row[0]) for row in q.all() if row[0]])
+    if not isinstance(dirty_dois_list, list):
+        abort_json(422, "dois must be a list")
+    if len(dirty_dois_list) > MAX_BATCH_LOOKUP_DOIS:
+        abort_json(413, "max number of DOIs is {}".format(MAX_BATCH_LOOKUP_DOIS))
 
-    responses = [
-        normalized_doi_responses.get(normalize_doi(d, return_none_if_error=True), None)
-        or cleaned_doi_responses.get(clean_doi(d, return_none_if_error=True), None)
-        or pub.build_new_pub(d, None).to_dict_v2()
-        for d in dirty_dois_list
-    ]
+    # a batch costs as many calls as it has dois, from the same bucket single GETs use
+    if not is_admin_request():
+        try:
+            too_many_requests = too_many_requests_per_second(get_ip(), cost=len(dirty_dois_list))
+        except Exception as e:
+            logger.exception(f'error in batch lookup rate limiting: {e}')
+            too_many_requests = False
+        if too_many_requests:
+            abort_json(429, "Too many DOIs requested. "
+                            "Please email support@unpaywall.org so we can help.")
+
+    normalized_dois = [normalize_doi(d, return_none_if_error=True) if isinstance(d, str) else None
+                       for d in dirty_dois_list]
+
+    rows = openalex_engine.execute(
+        sql.text(
+            "select doi, json_response from unpaywall.unpaywall_from_walden where doi = any(:dois)"
+        ).bindparams(dois=list({d for d in normalized_dois if d}))
+    ).fetchall()
+    json_responses = {row[0]: row[1] for row in rows}
+
+    def generate_lines():
+        for dirty_doi, normalized_doi in zip(dirty_dois_list, normalized_dois):
+            json_response = normalized_doi and json_responses.get(normalized_doi)
+            if json_response:
+                if "\n" in json_response:
+                    json_response = json.dumps(json.loads(json_response))
+                yield json_response + "\n"
+            else:
+                yield json.dumps({
+                    "doi": dirty_doi,
+                    "HTTP_status_code": 404,
+                    "message": "'{}' isn't in Unpaywall.".format(dirty_doi),
+                    "error": True
+                }) + "\n"
 
-    formats = body.get("formats", []) or ["jsonl", "csv"]
+    return Response(stream_with_context(generate_lines()), mimetype="application/x-ndjson")
+
+
+SIMPLE_QUERY_CHUNK_SIZE = 1000
+
+
+def simple_query_responses(dirty_dois_list):
+    # look up a chunk at a time so we never hold every response at once
+    for chunk_start in range(0, len(dirty_dois_list), SIMPLE_QUERY_CHUNK_SIZE):
+        chunk = dirty_dois_list[chunk_start:chunk_start + SIMPLE_QUERY_CHUNK_SIZE]
+        normalized_dois = [normalize_doi(d, return_none_if_error=True) for d in chunk]
+        cleaned_dois = [clean_doi(d, return_none_if_error=True) for d in chunk]
+
+        q = db.session.query(pub.Pub.response_jsonb).filter(
+            pub.Pub.id.in_({d for d in normalized_dois + cleaned_dois if d})
+        )
+        chunk_responses = dict([(row[0]['doi'], row[0]) for row in q.all() if row[0]])
+
+        for dirty_doi, normalized_doi, cleaned_doi in zip(chunk, normalized_dois, cleaned_dois):
+            yield (
+                chunk_responses.get(normalized_doi, None)
+                or chunk_responses.get(cleaned_doi, None)
+                or pub.build_new_pub(dirty_doi, None).to_dict_v2()
+            )
+
+        db.session.expunge_all()
+
+
+def simple_query_csv_fieldnames():
+    fieldnames = sorted(pub.csv_dict_from_response_dict({"doi": None}).keys())
+    return ["doi"] + [name for name in fieldnames if name != "doi"]
+
+
+def run_simple_query(dirty_dois_list, formats, email_address):
+    output_dir = tempfile.mkdtemp(prefix="simple_query_")
+    fieldnames = simple_query_csv_fieldnames()
     files = []
+    jsonl_file = csv_file = csv_writer = book = sheet = None
+
+    try:
+        if "jsonl" in formats:
+            files.append(os.path.join(output_dir, "results.jsonl"))
+            jsonl_file = open(files[-1], 'w')
+
+        if "csv" in formats:
+            files.append(os.path.join(output_dir, "results.csv"))
+            csv_file = open(files[-1], 'wb')
+            csv_writer = unicodecsv.DictWriter(csv_file, fieldnames=fieldnames, dialect='excel')
+            csv_writer.writeheader()
+
+        if "xlsx" in formats:
+            book = Workbook(write_only=True)
+            sheet = book.create_sheet("results")
+            sheet.append(fieldnames)
+
+        for response_jsonb in simple_query_responses(dirty_dois_list):
+            if jsonl_file:
+                jsonl_file.write(json.dumps(response_jsonb, sort_keys=True))
+                jsonl_file.write("\n")
+
+            csv_dict = pub.csv_dict_from_response_dict(response_jsonb)
+            if csv_dict:
+                if csv_writer:
+                    csv_writer.writerow(csv_dict)
+                if sheet:
+                    sheet.append([csv_dict[field_name] for field_name in fieldnames])
+
+        for f in [jsonl_file, csv_file]:
+            if f:
+                f.close()
+
+        if book:
+            files.append(os.path.join(output_dir, "results.xlsx"))
+            book.save(filename=files[-1])
+
+        # prep email
+        email = create_email(email_address,
+                     "Your Unpaywall results",
+                     "simple_query_tool",
+                     {"profile": {}},
+                     files)
+        send(email, for_real=True)
+    except Exception as e:
+        logger.exception(f'simple query for {email_address} failed: {e}')
+    finally:
+        for f in [jsonl_file, csv_file]:
+            if f and not f.closed:
+                f.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+        db.session.remove()
+
+
+def run_simple_query_in_app_context(dirty_dois_list, formats, email_address):
+    with app.app_context():
+        run_simple_query(dirty_dois_list, formats, email_address)
+
 
-    if "jsonl" in formats:
-        # save jsonl
-        with open("output.jsonl", 'w') as f:
-            for response_jsonb in responses:
-                f.write(json.dumps(response_jsonb, sort_keys=True))
-                f.write("\n")
-        files.append("output.jsonl")
-
-    csv_dicts = [pub.csv_dict_from_response_dict(my_dict) for my_dict in responses]
-    csv_dicts = [my_dict for my_dict in csv_dicts if my_dict]
-    fieldnames = sorted(csv_dicts[0].keys())
-    fieldnames = ["doi"] + [name for name in fieldnames if name != "doi"]
-
-    if "csv" in formats:
-        # save csv
-        with open("output.csv", 'wb') as f:
-            writer = unicodecsv.DictWriter(f, fieldnames=fieldnames, dialect='excel')
-            writer.writeheader()
-            for my_dict in csv_dicts:
-                writer.writerow(my_dict)
-        files.append("output.csv")
-
-    if "xlsx" in formats:
-        book = Workbook()
-        sheet = book.worksheets[0]
-        sheet.title = "results"
-
-        for col_idx, field_name in enumerate(fieldnames):
-            sheet.cell(column=col_idx+1, row=1, value=field_name)
-
-        for row_idx, row in enumerate(csv_dicts):
-            for col_idx, field_name in enumerate(fieldnames):
-                sheet.cell(column=col_idx+1, row=row_idx+2, value=row[field_name])
-
-        book.save(filename="output.xlsx")
-        files.append("output.xlsx")
-
-    # prep email
+@app.route("/v2/dois", methods=["POST"])
+def simple_query_tool():
+    body = request.json
+    dirty_dois_list = [d for d in body["dois"] if d]
+    formats = body.get("formats", []) or ["jsonl", "csv"]
     email_address = body["email"]
-    email = create_email(email_address,
-                 "Your Unpaywall results",
-                 "simple_query_tool",
-                 {"profile": {}},
-                 files)
-    send(email, for_real=True)
+
+    # build the files and send the email after we've responded
+    Thread(
+        target=run_simple_query_in_app_context,
+        args=(dirty_dois_list, formats, email_address)
+    ).start()
 
     return jsonify({
         "got it": email_address,
-        "dois": [r['doi'] for r in responses]
+        "dois": [normalize_doi(d, return_none_if_error=True) or d for d in dirty_dois_list]
     })
 
 
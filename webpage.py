@@ -3,6 +3,7 @@
 
 import os
 import re
+from copy import deepcopy
 from time import time
 from urllib.parse import urlparse
 
@@ -427,7 +428,12 @@ class Webpage(object):
 
         # logger.info(page)
 
-        links = [get_pdf_in_meta(page)] + [get_pdf_from_javascript(page_with_scripts or page)] + get_useful_links(page)
+        parsed_page = as_parsed_page(page)
+        links = (
+            [get_pdf_in_meta(parsed_page)]
+            + [get_pdf_from_javascript(page_with_scripts or parsed_page.page)]
+            + parsed_page.useful_links
+        )
         links = [link for link in links if link is not None and link.href]
 
         for link in links:
@@ -691,11 +697,14 @@ class PublisherWebpage(Webpage):
                         logger.info('looks like a full issue index from OJS, skipping full text search')
                         return
 
-            license_search_text = page_potential_license_text(page)
+            # parse once for the license, pdf link and citation_pdf_url lookups below
+            parsed_page = ParsedPage(page)
+
+            license_search_text = page_potential_license_text(parsed_page)
 
             # Look for a pdf link. If we find one, look for a license.
 
-            pdf_download_link = self.find_pdf_link(page) if find_pdf_link else None
+            pdf_download_link = self.find_pdf_link(parsed_page) if find_pdf_link else None
 
             # if we haven't found a pdf yet, try known patterns
             if pdf_download_link is None:
@@ -846,7 +855,7 @@ class PublisherWebpage(Webpage):
                 r'^https?://www\.sciencedirect\.com/science/article/pii/S[0-9X]+/pdf(?:ft)?\?md5=[0-9a-f]+.*[0-9x]+-main.pdf$'
             ]
 
-            citation_pdf_link = get_pdf_in_meta(page)
+            citation_pdf_link = get_pdf_in_meta(parsed_page)
 
             if citation_pdf_link and citation_pdf_link.href:
                 for pattern in bronze_citation_pdf_patterns:
@@ -1187,6 +1196,9 @@ class RepoWebpage(Webpage):
             if scraped_version:
                 self.scraped_version = scraped_version
 
+            # parse once for the pdf, doc and BHL link lookups below
+            parsed_page = ParsedPage(page)
+
             pdf_download_link = None
             # special exception for citeseer because we want the pdf link where
             # the copy is on the third party repo, not the cached link, if we can get it
@@ -1204,7 +1216,7 @@ class RepoWebpage(Webpage):
 
             # otherwise look for it the normal way
             else:
-                pdf_download_link = self.find_pdf_link(page, page_with_scripts=page_with_scripts)
+                pdf_download_link = self.find_pdf_link(parsed_page, page_with_scripts=page_with_scripts)
 
             if pdf_download_link is None:
                 if re.search(r'https?://cdm21054\.contentdm\.oclc\.org/digital/collection/IR/id/(\d+)', self.resolved_url):
@@ -1265,7 +1277,7 @@ class RepoWebpage(Webpage):
 
             # try this later because would rather get a pdf
             # if they are linking to a .docx or similar, this is open.
-            doc_link = find_doc_download_link(page)
+            doc_link = find_doc_download_link(parsed_page)
             if doc_link is None and _try_pdf_link_as_doc(self.resolved_url):
                 doc_link = pdf_download_link
 
@@ -1282,7 +1294,7 @@ class RepoWebpage(Webpage):
                     if DEBUG_SCRAPING:
                         logger.info("we've decided this ain't a word doc. [{}]".format(absolute_doc_url))
 
-            bhl_link = find_bhl_view_link(self.resolved_url, page)
+            bhl_link = find_bhl_view_link(self.resolved_url, parsed_page)
             if bhl_link is not None:
                 logger.info('found a BHL document link: {}'.format(get_link_target(bhl_link.href, self.resolved_url)))
                 self.scraped_open_metadata_url = metadata_url
@@ -1396,89 +1408,135 @@ class DuckLink(object):
         self.anchor = anchor
 
 
-def get_useful_links(page):
-    links = []
+USEFUL_LINK_BAD_SECTION_FINDERS = [
+    # references and related content sections
+
+    "//div[@class=\'relatedItem\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
+    "//ol[@class=\'links-for-figure\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
+    "//div[@class=\'citedBySection\']",  #10.3171/jns.1966.25.4.0458
+    "//div[@class=\'references\']",  #https://www.emeraldinsight.com/doi/full/10.1108/IJCCSM-04-2017-0089
+    "//div[@class=\'moduletable\']",  # http://vestnik.mrsu.ru/index.php/en/articles2-en/80-19-1/671-10-15507-0236-2910-029-201901-1
+    "//div[contains(@class, 'ref-list')]", #https://www.jpmph.org/journal/view.php?doi=10.3961/jpmph.16.069
+    "//div[contains(@class, 'references')]", #https://venue.ep.liu.se/article/view/1498
+    "//div[@id=\'supplementary-material\']", #https://www.jpmph.org/journal/view.php?doi=10.3961/jpmph.16.069
+    "//div[@id=\'toc\']",  # https://www.elgaronline.com/view/edcoll/9781781004326/9781781004326.xml
+    "//div[contains(@class, 'cta-guide-authors')]",  # https://www.journals.elsevier.com/physics-of-the-dark-universe/
+    "//div[contains(@class, 'footer-publication')]",  # https://www.journals.elsevier.com/physics-of-the-dark-universe/
+    "//d-appendix",  # https://distill.pub/2017/aia/
+    "//dt-appendix",  # https://distill.pub/2016/handwriting/
+    "//div[starts-with(@id, 'dt-cite')]",  # https://distill.pub/2017/momentum/
+    "//ol[contains(@class, 'ref-item')]",  # http://www.cjcrcn.org/article/html_9778.html
+    "//div[contains(@class, 'NLM_back')]",      # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
+    "//div[contains(@class, 'NLM_citation')]",  # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
+    "//div[@id=\'relatedcontent\']",            # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
+    "//div[@id=\'author-infos\']",  # https://www.tandfonline.com/doi/full/10.1080/01639374.2019.1670767
+    "//ul[@id=\'book-metrics\']",   # https://link.springer.com/book/10.1007%2F978-3-319-63811-9
+    "//section[@id=\'article_references\']",   # https://www.nejm.org/doi/10.1056/NEJMms1702111
+    "//section[@id=\'SupplementaryMaterial\']",   # https://link.springer.com/article/10.1057%2Fs41267-018-0191-3
+    "//div[@id=\'attach_additional_files\']",   # https://digitalcommons.georgiasouthern.edu/ij-sotl/vol5/iss2/14/
+    "//span[contains(@class, 'fa-lock')]",  # https://www.dora.lib4ri.ch/eawag/islandora/object/eawag%3A15303
+    "//ul[@id=\'reflist\']",  # https://elibrary.steiner-verlag.de/article/10.25162/sprib-2019-0002
+    "//div[@class=\'listbibl\']",  # http://sk.sagepub.com/reference/the-sage-handbook-of-television-studies
+    "//div[contains(@class, 'summation-section')]",  # https://www.tandfonline.com/eprint/EHX2T4QAGTIYVPK7MJBF/full?target=10.1080/20507828.2019.1614768
+    "//ul[contains(@class, 'references')]",  # https://www.tandfonline.com/eprint/EHX2T4QAGTIYVPK7MJBF/full?target=10.1080/20507828.2019.1614768
+    "//p[text()='References']/following-sibling::p", # http://researcherslinks.com/current-issues/Effect-of-Different-Temperatures-on-Colony/20/1/2208/html
+    "//span[contains(@class, 'ref-lnk')]",  # https://www.tandfonline.com/doi/full/10.1080/19386389.2017.1285143
+    "//div[@id=\'referenceContainer\']",  # https://www.jbe-platform.com/content/journals/10.1075/ld.00050.kra
+    "//div[contains(@class, 'table-of-content')]",  # https://onlinelibrary.wiley.com/doi/book/10.1002/9781118897126
+    "//img[contains(@src, 'supplementary_material')]/following-sibling::p", # https://pure.mpg.de/pubman/faces/ViewItemOverviewPage.jsp?itemId=item_2171702
+    "//span[text()[contains(., 'Supplemental Material')]]/parent::td/parent::tr",  # https://authors.library.caltech.edu/56142/
+    "//div[@id=\'utpPrimaryNav\']",  # https://utpjournals.press/doi/10.3138/jsp.51.4.10
+    "//p[@class=\'bibentry\']",  # http://research.ucc.ie/scenario/2019/01/Voelker/12/de
+    "//a[contains(@class, 'cover-out')]",  # https://doi.org/10.5152/dir.2019.18142
+    "//div[@class=\'footnotes\']",  # https://mhealth.jmir.org/2020/4/e19359/
+    "//h2[text()='References']/following-sibling::ul",  # http://hdl.handle.net/2027/spo.17063888.0037.114
+    "//section[@id=\'article-references\']",  # https://journals.lww.com/academicmedicine/Fulltext/2015/05000/Implicit_Bias_Against_Sexual_Minorities_in.8.aspx
+    "//div[@class=\'refs\']",  # https://articles.math.cas.cz/10.21136/AM.2020.0344-19
+    "//div[@class=\'citation-content\']",  # https://cdnsciencepub.com/doi/10.1139/cjz-2019-0247
+    "//li[@class=\'refbiblio\']",  # https://www.erudit.org/fr/revues/documentation/2021-v67-n1-documentation05867/1075634ar/
+    "//div[@class=\'Citation\']", # https://mijn.bsl.nl/seksualiteit-kinderwens-vruchtbaarheidsproblemen-en-vruchtbaarhe/16090564
+    "//section[@id=\'ej-article-sam-container\']", # https://journals.lww.com/epidem/Fulltext/2014/09000/Elemental_Composition_of_Particulate_Matter_and.5.aspx
+    "//h4[text()='References']/following-sibling::p",  # https://editions.lib.umn.edu/openrivers/article/mapping-potawatomi-presences/
+    "//li[contains(@class, 'article-references')]",  # https://www.nejm.org/doi/10.1056/NEJMc2032052
+    "//section[@id=\'supplementary-materials']", # https://www.science.org/doi/pdf/10.1126/science.aan5893
+    "//td[text()='References']/following-sibling::td", # http://www.rudmet.ru/journal/2021/article/33922/?language=en
+    "//article[@id=\'ej-article-view\']//div[contains(@class, 'ejp-fulltext-content')]//p[contains(@id, 'JCL-P')]",  # https://journals.lww.com/oncology-times/Fulltext/2020/11200/UpToDate.4.aspx
+    "//span[contains(@class, 'ref-list')]//span[contains(@class, 'reference')]", #  https://www.degruyter.com/document/doi/10.1515/ijamh-2020-0111/html
+    "//div[contains(@class, 'ncbiinpagenav')]",  # https://www.ncbi.nlm.nih.gov/pmc/articles/PMC6657953/
+    "//h4[text()[contains(., 'Multimedia Appendix')]]/following-sibling::a",  # https://www.researchprotocols.org/2019/1/e11540/
+    "//section[contains(@class, 'references')]",  # http://ojs.ual.es/ojs/index.php/eea/article/view/5974
+    "//h3[text()='Acknowledgements']/following-sibling::p",  # https://www.tandfonline.com/doi/full/10.1080/02635143.2016.1248928
+    "//div[@id=\'references-list\']",  # https://www.cambridge.org/core/books/abs/juries-lay-judges-and-mixed-courts/worldwide-perspective-on-lay-participation/E0CA7057A55D03C4500371752E352571
+    "//h2[text()='Notes']/following-sibling::ol//p[@class=\'alinea\']", # https://www.erudit.org/fr/revues/im/2015-n26-im02640/1037312ar/
+    "//h2[text()='Policies and information']/following-sibling::ul",  # https://www.emerald.com/insight/content/doi/10.1108/RSR-06-2021-0025/full/html
+
+    # can't tell what chapter/section goes with what doi
+    "//div[@id=\'booktoc\']",  # https://link.springer.com/book/10.1007%2F978-3-319-63811-9
+    "//div[@id=\'tocWrapper\']",  # https://www.elgaronline.com/view/edcoll/9781786431417/9781786431417.xml
+    "//tr[@class=\'bookTocEntryRow\']",  # https://www.degruyter.com/document/doi/10.3138/9781487514976/html
+]
+
+# one union expression, so each page is walked once instead of once per finder
+_useful_link_bad_section_xpath = etree.XPath(" | ".join(USEFUL_LINK_BAD_SECTION_FINDERS))
+
+LICENSE_TEXT_BAD_SECTION_FINDERS = [
+    "//div[contains(@class, 'view-pnas-featured')]",  # https://www.pnas.org/content/114/38/10035
+    "//meta[contains(@name, 'citation_reference')]",  # https://www.thieme-connect.de/products/ebooks/lookinside/10.1055/sos-SD-226-00098
+]
+
+_license_text_bad_section_xpath = etree.XPath(" | ".join(LICENSE_TEXT_BAD_SECTION_FINDERS))
+
+_link_xpath = etree.XPath("//a")
+_meta_xpath = etree.XPath("//meta")
+
+
+class ParsedPage(object):
+    """
+    Landing page html that's parsed at most once, however many of the link and
+    license finders look at it. The parsed tree is never modified; finders that
+    clear sections work on a copy, which is much cheaper than parsing again.
+    """
+    def __init__(self, page):
+        self.page = page
+        self._tree = None
+        self._parsed = False
+        self._useful_links = None
 
-    tree = get_tree(page)
-    if tree is None:
-        return []
+    @property
+    def tree(self):
+        if not self._parsed:
+            self._tree = get_tree(self.page)
+            self._parsed = True
+        return self._tree
 
-    # remove related content sections
+    def tree_copy(self):
+        return deepcopy(self.tree) if self.tree is not None else None
+
+    @property
+    def useful_links(self):
+        if self._useful_links is None:
+            tree = self.tree_copy()
+            self._useful_links = [] if tree is None else _get_useful_links_from_tree(tree)
+        return list(self._useful_links)
 
-    bad_section_finders = [
-        # references and related content sections
-
-        "//div[@class=\'relatedItem\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
-        "//ol[@class=\'links-for-figure\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
-        "//div[@class=\'citedBySection\']",  #10.3171/jns.1966.25.4.0458
-        "//div[@class=\'references\']",  #https://www.emeraldinsight.com/doi/full/10.1108/IJCCSM-04-2017-0089
-        "//div[@class=\'moduletable\']",  # http://vestnik.mrsu.ru/index.php/en/articles2-en/80-19-1/671-10-15507-0236-2910-029-201901-1
-        "//div[contains(@class, 'ref-list')]", #https://www.jpmph.org/journal/view.php?doi=10.3961/jpmph.16.069
-        "//div[contains(@class, 'references')]", #https://venue.ep.liu.se/article/view/1498
-        "//div[@id=\'supplementary-material\']", #https://www.jpmph.org/journal/view.php?doi=10.3961/jpmph.16.069
-        "//div[@id=\'toc\']",  # https://www.elgaronline.com/view/edcoll/9781781004326/9781781004326.xml
-        "//div[contains(@class, 'cta-guide-authors')]",  # https://www.journals.elsevier.com/physics-of-the-dark-universe/
-        "//div[contains(@class, 'footer-publication')]",  # https://www.journals.elsevier.com/physics-of-the-dark-universe/
-        "//d-appendix",  # https://distill.pub/2017/aia/
-        "//dt-appendix",  # https://distill.pub/2016/handwriting/
-        "//div[starts-with(@id, 'dt-cite')]",  # https://distill.pub/2017/momentum/
-        "//ol[contains(@class, 'ref-item')]",  # http://www.cjcrcn.org/article/html_9778.html
-        "//div[contains(@class, 'NLM_back')]",      # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
-        "//div[contains(@class, 'NLM_citation')]",  # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
-        "//div[@id=\'relatedcontent\']",            # https://pubs.acs.org/doi/10.1021/acs.est.7b05624
-        "//div[@id=\'author-infos\']",  # https://www.tandfonline.com/doi/full/10.1080/01639374.2019.1670767
-        "//ul[@id=\'book-metrics\']",   # https://link.springer.com/book/10.1007%2F978-3-319-63811-9
-        "//section[@id=\'article_references\']",   # https://www.nejm.org/doi/10.1056/NEJMms1702111
-        "//section[@id=\'SupplementaryMaterial\']",   # https://link.springer.com/article/10.1057%2Fs41267-018-0191-3
-        "//div[@id=\'attach_additional_files\']",   # https://digitalcommons.georgiasouthern.edu/ij-sotl/vol5/iss2/14/
-        "//span[contains(@class, 'fa-lock')]",  # https://www.dora.lib4ri.ch/eawag/islandora/object/eawag%3A15303
-        "//ul[@id=\'reflist\']",  # https://elibrary.steiner-verlag.de/article/10.25162/sprib-2019-0002
-        "//div[@class=\'listbibl\']",  # http://sk.sagepub.com/reference/the-sage-handbook-of-television-studies
-        "//div[contains(@class, 'summation-section')]",  # https://www.tandfonline.com/eprint/EHX2T4QAGTIYVPK7MJBF/full?target=10.1080/20507828.2019.1614768
-        "//ul[contains(@class, 'references')]",  # https://www.tandfonline.com/eprint/EHX2T4QAGTIYVPK7MJBF/full?target=10.1080/20507828.2019.1614768
-        "//p[text()='References']/following-sibling::p", # http://researcherslinks.com/current-issues/Effect-of-Different-Temperatures-on-Colony/20/1/2208/html
-        "//span[contains(@class, 'ref-lnk')]",  # https://www.tandfonline.com/doi/full/10.1080/19386389.2017.1285143
-        "//div[@id=\'referenceContainer\']",  # https://www.jbe-platform.com/content/journals/10.1075/ld.00050.kra
-        "//div[contains(@class, 'table-of-content')]",  # https://onlinelibrary.wiley.com/doi/book/10.1002/9781118897126
-        "//img[contains(@src, 'supplementary_material')]/following-sibling::p", # https://pure.mpg.de/pubman/faces/ViewItemOverviewPage.jsp?itemId=item_2171702
-        "//span[text()[contains(., 'Supplemental Material')]]/parent::td/parent::tr",  # https://authors.library.caltech.edu/56142/
-        "//div[@id=\'utpPrimaryNav\']",  # https://utpjournals.press/doi/10.3138/jsp.51.4.10
-        "//p[@class=\'bibentry\']",  # http://research.ucc.ie/scenario/2019/01/Voelker/12/de
-        "//a[contains(@class, 'cover-out')]",  # https://doi.org/10.5152/dir.2019.18142
-        "//div[@class=\'footnotes\']",  # https://mhealth.jmir.org/2020/4/e19359/
-        "//h2[text()='References']/following-sibling::ul",  # http://hdl.handle.net/2027/spo.17063888.0037.114
-        "//section[@id=\'article-references\']",  # https://journals.lww.com/academicmedicine/Fulltext/2015/05000/Implicit_Bias_Against_Sexual_Minorities_in.8.aspx
-        "//div[@class=\'refs\']",  # https://articles.math.cas.cz/10.21136/AM.2020.0344-19
-        "//div[@class=\'citation-content\']",  # https://cdnsciencepub.com/doi/10.1139/cjz-2019-0247
-        "//li[@class=\'refbiblio\']",  # https://www.erudit.org/fr/revues/documentation/2021-v67-n1-documentation05867/1075634ar/
-        "//div[@class=\'Citation\']", # https://mijn.bsl.nl/seksualiteit-kinderwens-vruchtbaarheidsproblemen-en-vruchtbaarhe/16090564
-        "//section[@id=\'ej-article-sam-container\']", # https://journals.lww.com/epidem/Fulltext/2014/09000/Elemental_Composition_of_Particulate_Matter_and.5.aspx
-        "//h4[text()='References']/following-sibling::p",  # https://editions.lib.umn.edu/openrivers/article/mapping-potawatomi-presences/
-        "//li[contains(@class, 'article-references')]",  # https://www.nejm.org/doi/10.1056/NEJMc2032052
-        "//section[@id=\'supplementary-materials']", # https://www.science.org/doi/pdf/10.1126/science.aan5893
-        "//td[text()='References']/following-sibling::td", # http://www.rudmet.ru/journal/2021/article/33922/?language=en
-        "//article[@id=\'ej-article-view\']//div[contains(@class, 'ejp-fulltext-content')]//p[contains(@id, 'JCL-P')]",  # https://journals.lww.com/oncology-times/Fulltext/2020/11200/UpToDate.4.aspx
-        "//span[contains(@class, 'ref-list')]//span[contains(@class, 'reference')]", #  https://www.degruyter.com/document/doi/10.1515/ijamh-2020-0111/html
-        "//div[contains(@class, 'ncbiinpagenav')]",  # https://www.ncbi.nlm.nih.gov/pmc/articles/PMC6657953/
-        "//h4[text()[contains(., 'Multimedia Appendix')]]/following-sibling::a",  # https://www.researchprotocols.org/2019/1/e11540/
-        "//section[contains(@class, 'references')]",  # http://ojs.ual.es/ojs/index.php/eea/article/view/5974
-        "//h3[text()='Acknowledgements']/following-sibling::p",  # https://www.tandfonline.com/doi/full/10.1080/02635143.2016.1248928
-        "//div[@id=\'references-list\']",  # https://www.cambridge.org/core/books/abs/juries-lay-judges-and-mixed-courts/worldwide-perspective-on-lay-participation/E0CA7057A55D03C4500371752E352571
-        "//h2[text()='Notes']/following-sibling::ol//p[@class=\'alinea\']", # https://www.erudit.org/fr/revues/im/2015-n26-im02640/1037312ar/
-        "//h2[text()='Policies and information']/following-sibling::ul",  # https://www.emerald.com/insight/content/doi/10.1108/RSR-06-2021-0025/full/html
-
-        # can't tell what chapter/section goes with what doi
-        "//div[@id=\'booktoc\']",  # https://link.springer.com/book/10.1007%2F978-3-319-63811-9
-        "//div[@id=\'tocWrapper\']",  # https://www.elgaronline.com/view/edcoll/9781786431417/9781786431417.xml
-        "//tr[@class=\'bookTocEntryRow\']",  # https://www.degruyter.com/document/doi/10.3138/9781487514976/html
-    ]
 
-    for section_finder in bad_section_finders:
-        for bad_section in tree.xpath(section_finder):
-            bad_section.clear()
+def as_parsed_page(page):
+    return page if isinstance(page, ParsedPage) else ParsedPage(page)
+
+
+def get_useful_links(page):
+    return as_parsed_page(page).useful_links
+
+
+def _get_useful_links_from_tree(tree):
+    links = []
+
+    # remove related content sections
+    for bad_section in _useful_link_bad_section_xpath(tree):
+        bad_section.clear()
 
     # now get the links
-    link_elements = tree.xpath("//a")
+    link_elements = _link_xpath(tree)
     link_elements = [elem for elem in link_elements if not elem.attrib.get('href', '').startswith('mailto')]
 
     for link in link_elements:
@@ -1516,26 +1574,19 @@ def get_useful_links(page):
 
 
 def page_potential_license_text(page):
-    tree = get_tree(page)
+    parsed_page = as_parsed_page(page)
+    page = parsed_page.page
 
-    if tree is None:
+    if parsed_page.tree is None:
         return page
 
-    section_removed = False
-
-    bad_section_finders = [
-        "//div[contains(@class, 'view-pnas-featured')]",  # https://www.pnas.org/content/114/38/10035
-        "//meta[contains(@name, 'citation_reference')]",  # https://www.thieme-connect.de/products/ebooks/lookinside/10.1055/sos-SD-226-00098
-    ]
-
-    for section_finder in bad_section_finders:
-        for bad_section in tree.xpath(section_finder):
-            bad_section.clear()
-            section_removed = True
-
-    if not section_removed:
+    if not _license_text_bad_section_xpath(parsed_page.tree):
         return page
 
+    tree = parsed_page.tree_copy()
+    for bad_section in _license_text_bad_section_xpath(tree):
+        bad_section.clear()
+
     try:
         return etree.tostring(tree, encoding=str)
     except Exception:
@@ -1858,13 +1909,16 @@ def has_bad_anchor_word(anchor_text):
 
 
 def get_pdf_in_meta(page):
+    parsed_page = as_parsed_page(page)
+    page = parsed_page.page
+
     if "citation_pdf_url" in page:
         if DEBUG_SCRAPING:
             logger.info("citation_pdf_url in page")
 
-        tree = get_tree(page)
+        tree = parsed_page.tree
         if tree is not None:
-            metas = tree.xpath("//meta")
+            metas = _meta_xpath(tree)
             for meta in metas:
                 meta_name = meta.attrib.get('name', None)
                 meta_property = meta.attrib.get('property', None)
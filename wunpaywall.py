@@ -1,7 +1,48 @@
 import json
+import re
 
 from app import db
 
+_json_decoder = json.JSONDecoder()
+
+# a whole json string, or a bracket that changes depth
+_json_token_pattern = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+_key_separator_pattern = re.compile(r'\s*:\s*')
+
+
+def project_json_fields(json_text, fields):
+    """
+    Pick top-level fields out of a serialized json object without decoding the rest of it.
+
+    Strings are skipped whole, so braces inside titles and abstracts don't throw off the
+    depth count, and only the values of the requested keys are decoded.
+    """
+    wanted = set(fields)
+    projected = {}
+    depth = 0
+    pos = 0
+
+    while len(projected) < len(wanted):
+        token_match = _json_token_pattern.search(json_text, pos)
+        if not token_match:
+            break
+
+        token = token_match.group()
+        pos = token_match.end()
+
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+        elif depth == 1:
+            separator_match = _key_separator_pattern.match(json_text, pos)
+            if separator_match:
+                key = json.loads(token) if '\\' in token else token[1:-1]
+                if key in wanted and key not in projected:
+                    projected[key], pos = _json_decoder.raw_decode(json_text, separator_match.end())
+
+    return {f: projected[f] for f in fields if f in projected}
+
 
 class WunpaywallPub(db.Model):
     __tablename__ = 'unpaywall_from_walden'
@@ -15,6 +56,15 @@ class WunpaywallPub(db.Model):
         response = json.loads(self.json_response)
         return response
 
+    def to_json_bytes(self, validate=False):
+        # the stored text is already the api response, so send it as-is
+        if validate:
+            json.loads(self.json_response)
+        return self.json_response.encode('utf-8')
+
+    def to_dict_fields(self, fields):
+        return project_json_fields(self.json_response, fields)
+
 
 class WunpaywallFeed(db.Model):
     __tablename__ = 'export_metadata'